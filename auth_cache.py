@@ -0,0 +1,442 @@
+"""
+Process-wide caches used when authenticating requests.
+"""
+import base64
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Optional
+
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives.asymmetric.rsa import RSAPublicNumbers
+from redis import RedisError
+
+
+def _b64_to_int(value: str) -> int:
+    """
+    Decodes a base64url encoded, unpadded big-endian integer as used by JWKs.
+
+    Arguments:
+        value {str} -- Base64url string.
+
+    Returns:
+        int -- Decoded integer.
+    """
+    padded = value + "=" * (-len(value) % 4)
+    return int.from_bytes(base64.urlsafe_b64decode(padded), "big")
+
+
+def parse_rsa_key(key: dict) -> object:
+    """
+    Builds an RSA public key object from a JWK.
+
+    Arguments:
+        key {dict} -- JWK with "n" and "e" members.
+
+    Returns:
+        object -- cryptography RSAPublicKey.
+    """
+    numbers = RSAPublicNumbers(_b64_to_int(key["e"]), _b64_to_int(key["n"]))
+    return numbers.public_key(default_backend())
+
+
+def fetch_jwks(client) -> dict:
+    """
+    Fetches the JSON web key set published by an Auth0 tenant.
+
+    Arguments:
+        client {http_client.OutboundClient} -- Client for the Auth0 domain.
+
+    Returns:
+        dict -- The key set.
+    """
+    response = client.get("/.well-known/jwks.json")
+    response.raise_for_status()
+    return response.json()
+
+
+class JWKSCache:
+    """
+    Keeps the parsed RSA signing keys of a JWKS endpoint indexed by kid.
+
+    The first lookup fetches the key set synchronously. After that, lookups on a stale
+    cache are served from memory while a background thread refreshes it, and an unknown
+    kid triggers at most one forced refetch per `min_refetch_interval` seconds. Failed
+    fetches keep the previous keys, so a short outage at the provider does not fail
+    requests that use a known key.
+    """
+
+    def __init__(
+        self, fetch: Callable[[], dict], ttl: int = 3600, min_refetch_interval: int = 30
+    ):
+        """
+        Arguments:
+            fetch {Callable[[], dict]} -- Returns the current key set.
+
+        Keyword Arguments:
+            ttl {int} -- Seconds before the keys are refreshed. (default: {3600})
+            min_refetch_interval {int} -- Minimum seconds between forced refetches
+                caused by unknown kids. (default: {30})
+        """
+        self.fetch = fetch
+        self.ttl = ttl
+        self.min_refetch_interval = min_refetch_interval
+        self.keys: Dict[str, object] = {}
+        self.fetched_at = None
+        self._last_attempt = 0.0
+        self._lock = threading.Lock()
+        self._refreshing = False
+
+    def refresh(self) -> bool:
+        """
+        Fetches the key set and replaces the cached keys.
+
+        Returns:
+            bool -- True if the keys were replaced.
+        """
+        self._last_attempt = time.monotonic()
+        try:
+            jwks = self.fetch()
+            keys = {
+                key["kid"]: parse_rsa_key(key)
+                for key in jwks["keys"]
+                if key.get("kty") == "RSA" and key.get("use", "sig") == "sig"
+            }
+        except Exception:  # pylint: disable=broad-except
+            logging.error(
+                {"message": "Failed to refresh jwks", "category": "ERROR-EVE-AUTH"},
+                exc_info=True,
+            )
+            return False
+
+        self.keys = keys
+        self.fetched_at = time.monotonic()
+        return True
+
+    def _refresh_in_background(self) -> None:
+        """
+        Starts a refresh thread unless one is already running.
+        """
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+
+        def run():
+            try:
+                self.refresh()
+            finally:
+                self._refreshing = False
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def get_key(self, kid: str) -> Optional[object]:
+        """
+        Looks up the public key for a kid.
+
+        Arguments:
+            kid {str} -- Key id from the token header.
+
+        Returns:
+            Optional[object] -- RSA public key, or None if the kid is unknown.
+        """
+        if self.fetched_at is None:
+            with self._lock:
+                if self.fetched_at is None:
+                    self.refresh()
+        elif time.monotonic() - self.fetched_at > self.ttl:
+            self._refresh_in_background()
+
+        key = self.keys.get(kid)
+        if (
+            key is None
+            and time.monotonic() - self._last_attempt > self.min_refetch_interval
+        ):
+            with self._lock:
+                if kid not in self.keys:
+                    self.refresh()
+            key = self.keys.get(kid)
+        return key
+
+
+def hash_token(token: str) -> str:
+    """
+    Hashes a bearer token so it can be used as a cache key without storing it.
+
+    Arguments:
+        token {str} -- Bearer token.
+
+    Returns:
+        str -- Hex digest of the token.
+    """
+    if isinstance(token, str):
+        token = token.encode("utf-8")
+    return hashlib.sha256(token).hexdigest()
+
+
+class TokenCache:
+    """
+    Bounded LRU of values derived from bearer tokens, such as verified payloads, kept
+    until the token's exp claim.
+    """
+
+    def __init__(
+        self, maxsize: int = 1024, name: str = "token_cache", log_every: int = 0
+    ):
+        """
+        Keyword Arguments:
+            maxsize {int} -- Maximum number of cached tokens. (default: {1024})
+            name {str} -- Name the stats are logged under. (default: {"token_cache"})
+            log_every {int} -- Lookups between logs of the stats, 0 to never log them.
+                (default: {0})
+        """
+        self.maxsize = maxsize
+        self.name = name
+        self.log_every = log_every
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, token: str) -> Optional[object]:
+        """
+        Looks up a token.
+
+        Arguments:
+            token {str} -- Bearer token.
+
+        Returns:
+            Optional[object] -- The cached value, or None on a miss.
+        """
+        key = hash_token(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] <= time.time():
+                del self._entries[key]
+                self.evictions += 1
+                entry = None
+            if entry:
+                self._entries.move_to_end(key)
+                self.hits += 1
+            else:
+                self.misses += 1
+            lookups = self.hits + self.misses
+        if self.log_every and not lookups % self.log_every:
+            self.log()
+        return entry[1] if entry else None
+
+    def put(self, token: str, value: object, expires_at: Optional[float]) -> None:
+        """
+        Caches a value for a token until it expires.
+
+        Arguments:
+            token {str} -- Bearer token.
+            value {object} -- Value to cache.
+            expires_at {Optional[float]} -- Unix time the token expires, tokens without
+                one are not cached.
+        """
+        if not expires_at or expires_at <= time.time():
+            return
+        key = hash_token(token)
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.maxsize:
+                self._evict()
+
+    def _evict(self) -> None:
+        """
+        Drops expired entries, then least recently used ones until the cache fits.
+        """
+        now = time.time()
+        for key in [key for key, entry in self._entries.items() if entry[0] <= now]:
+            del self._entries[key]
+            self.evictions += 1
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def discard(self, token: str) -> None:
+        """
+        Drops a token's entry if there is one.
+
+        Arguments:
+            token {str} -- Bearer token.
+        """
+        with self._lock:
+            self._entries.pop(hash_token(token), None)
+
+    def clear(self) -> None:
+        """
+        Empties the cache.
+        """
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        """
+        Returns:
+            dict -- Name, size and hit/miss/eviction counters.
+        """
+        return {
+            "name": self.name,
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+    def log(self) -> None:
+        """
+        Publishes the stats as a structured log.
+        """
+        logging.info({"message": self.stats(), "category": "INFO-EVE-METRICS"})
+
+
+class AccountCache:
+    """
+    Short lived cache of account documents keyed by email. Entries are tied to the
+    account's session version counter in Redis, which is bumped when its role,
+    approval or permissions change, so every worker reloads it on the next request.
+    The TTL bounds staleness of other fields, and of all fields while Redis is down.
+    """
+
+    def __init__(self, ttl: int = 60, maxsize: int = 1024):
+        """
+        Keyword Arguments:
+            ttl {int} -- Seconds an account is cached for. (default: {60})
+            maxsize {int} -- Maximum number of cached accounts. (default: {1024})
+        """
+        self.ttl = ttl
+        self.entries = TokenCache(maxsize=maxsize)
+
+    def get(
+        self,
+        email: str,
+        load: Callable[[str], Optional[dict]],
+        version: Optional[int] = None,
+    ) -> Optional[dict]:
+        """
+        Gets an account, loading it on a miss or when it was cached under another
+        version. Missing accounts are not cached so that newly registered users are
+        picked up immediately.
+
+        Arguments:
+            email {str} -- Account email.
+            load {Callable[[str], Optional[dict]]} -- Loads the account from the database.
+
+        Keyword Arguments:
+            version {Optional[int]} -- Current version of the account, read before
+                the account. (default: {None})
+
+        Returns:
+            Optional[dict] -- The account, or None if there is none.
+        """
+        entry = self.entries.get(email)
+        if entry is not None and entry[0] == version:
+            return entry[1]
+        account = load(email)
+        if account:
+            self.entries.put(email, (version, account), time.time() + self.ttl)
+        return account
+
+    def invalidate(self, email: str) -> None:
+        """
+        Drops the cached copy of an account.
+
+        Arguments:
+            email {str} -- Account email.
+        """
+        self.entries.discard(email)
+
+
+class UserInfoCache:
+    """
+    Two tier cache of the emails Auth0's /userinfo endpoint returns. A TokenCache
+    in front serves hot tokens from memory, and Redis shares entries between workers.
+    Entries expire with the token they were resolved for.
+    """
+
+    def __init__(self, redis_client, maxsize: int = 1024, prefix: str = "userinfo:"):
+        """
+        Arguments:
+            redis_client {redis.StrictRedis} -- Shared Redis connection.
+
+        Keyword Arguments:
+            maxsize {int} -- Size of the in-process tier. (default: {1024})
+            prefix {str} -- Prefix of the Redis keys. (default: {"userinfo:"})
+        """
+        self.redis = redis_client
+        self.local = TokenCache(maxsize=maxsize)
+        self.prefix = prefix
+
+    def get(self, subject: str) -> Optional[str]:
+        """
+        Looks up the email resolved for a token.
+
+        Arguments:
+            subject {str} -- The token's sub claim, or the token itself.
+
+        Returns:
+            Optional[str] -- The email, or None on a miss.
+        """
+        email = self.local.get(subject)
+        if email:
+            return email
+
+        try:
+            cached = self.redis.get(self.prefix + hash_token(subject))
+        except RedisError:
+            logging.warning(
+                {
+                    "message": "Userinfo cache unavailable",
+                    "category": "WARNING-EVE-AUTH",
+                },
+                exc_info=True,
+            )
+            return None
+        if not cached:
+            return None
+
+        entry = json.loads(cached)
+        self.local.put(subject, entry["email"], entry["exp"])
+        return entry["email"]
+
+    def put(self, subject: str, email: str, expires_at: Optional[float]) -> None:
+        """
+        Caches the email resolved for a token until the token expires.
+
+        Arguments:
+            subject {str} -- The token's sub claim, or the token itself.
+            email {str} -- Email returned by /userinfo.
+            expires_at {Optional[float]} -- Unix time the token expires.
+        """
+        if not expires_at:
+            return
+        ttl = int(expires_at - time.time())
+        if ttl <= 0:
+            return
+
+        self.local.put(subject, email, expires_at)
+        try:
+            self.redis.set(
+                self.prefix + hash_token(subject),
+                json.dumps({"email": email, "exp": expires_at}),
+                ex=ttl,
+            )
+        except RedisError:
+            logging.warning(
+                {
+                    "message": "Userinfo cache unavailable",
+                    "category": "WARNING-EVE-AUTH",
+                },
+                exc_info=True,
+            )
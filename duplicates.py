@@ -0,0 +1,78 @@
+"""
+Duplicate file detection for uploads, as one $in query per trial, assay and chunk of
+file names.
+"""
+
+from collections import OrderedDict
+from typing import Dict, Iterator, List, Tuple
+
+from bson import ObjectId
+
+
+def group_by_trial_assay(items: List[dict]) -> Dict[Tuple[ObjectId, ObjectId], list]:
+    """
+    Groups the file names of data records by trial and assay, without repeats.
+
+    Arguments:
+        items {List[dict]} -- Data records with trial, assay and file_name.
+
+    Returns:
+        Dict[Tuple[ObjectId, ObjectId], list] -- File names per (trial, assay), in the
+            order they were first seen.
+    """
+    groups = OrderedDict()
+    for record in items:
+        key = (ObjectId(record["trial"]), ObjectId(record["assay"]))
+        groups.setdefault(key, OrderedDict())[record["file_name"]] = None
+    return OrderedDict((key, list(names)) for key, names in groups.items())
+
+
+def duplicate_keys(
+    collection, items: List[dict], chunk_size: int = 500
+) -> Iterator[Tuple[ObjectId, ObjectId, str]]:
+    """
+    Finds the records whose file is already uploaded and visible. Each query is an
+    equality on trial and assay and an $in on file_name, served by the partial index
+    on data(trial, assay, file_name) over visible records.
+
+    Arguments:
+        collection {pymongo.collection.Collection} -- The data collection.
+        items {List[dict]} -- Data records being uploaded.
+
+    Keyword Arguments:
+        chunk_size {int} -- Most file names per query. (default: {500})
+
+    Returns:
+        Iterator[Tuple[ObjectId, ObjectId, str]] -- Trial, assay and file name of
+            each file already uploaded.
+    """
+    for (trial, assay), file_names in group_by_trial_assay(items).items():
+        for start in range(0, len(file_names), chunk_size):
+            query = {
+                "trial": trial,
+                "assay": assay,
+                "file_name": {"$in": file_names[start : start + chunk_size]},
+                "visibility": True,
+            }
+            for record in collection.find(query, projection={"_id": 0, "file_name": 1}):
+                yield trial, assay, record["file_name"]
+
+
+def find_duplicate_files(
+    collection, items: List[dict], chunk_size: int = 500
+) -> List[str]:
+    """
+    Finds the names of the files in items that are already uploaded, see
+    duplicate_keys.
+
+    Arguments:
+        collection {pymongo.collection.Collection} -- The data collection.
+        items {List[dict]} -- Data records being uploaded.
+
+    Keyword Arguments:
+        chunk_size {int} -- Most file names per query. (default: {500})
+
+    Returns:
+        List[str] -- Names of the files already uploaded.
+    """
+    return [key[2] for key in duplicate_keys(collection, items, chunk_size)]
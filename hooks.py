@@ -1,56 +1,102 @@
 """
 Hooks responsible for determining the endpoint behavior of the application.
 """
-import base64
+import atexit
+import copy
 import datetime
 import json
 import logging
-import time
-import urllib
-from typing import List
+from typing import List, Optional, Set, Union
 
 from cidc_utils.loghandler.stack_driver_handler import send_mail, log_formatted
-from bson import ObjectId, json_util
+from bson import ObjectId
 from flask import _request_ctx_stack, abort
 from flask import current_app as app
-from kombu import Connection, Exchange, Producer
-from oauth2client.service_account import ServiceAccountCredentials
 
-from settings import GOOGLE_UPLOAD_BUCKET, GOOGLE_BUCKET_NAME, GOOGLE_URL, RABBIT_MQ_ADDRESS, SENDGRID_API_KEY
-
-CREDS = ServiceAccountCredentials.from_json_keyfile_name("../auth/.google_auth.json")
-CLIENT_ID = CREDS.service_account_email
+from auth_cache import AccountCache
+from duplicates import find_duplicate_files
+from ingestion_files import (
+    FILES_COLLECTION,
+    PROGRESS_COUNTERS,
+    counter_updates,
+    file_documents,
+    files_href,
+    insert_files,
+    job_files,
+)
+from settings import (
+    ACCOUNT_CACHE_TTL,
+    DUPLICATE_CHECK_CHUNK_SIZE,
+    LAST_ACCESS_FLUSH_INTERVAL,
+    OUTBOX_DISPATCH_INTERVAL,
+    OUTBOX_MAX_ATTEMPTS,
+    PERMISSION_FILTER_CACHE_SIZE,
+    PERMISSION_FILTER_TTL,
+    GOOGLE_UPLOAD_BUCKET,
+    GOOGLE_BUCKET_NAME,
+    GOOGLE_URL,
+    RABBIT_MQ_ADDRESS,
+    RABBIT_MQ_POOL_LIMIT,
+    SENDGRID_API_KEY,
+    SIGNED_URL_CACHE_SIZE,
+    SIGNED_URL_LIFETIME,
+    SIGNED_URL_WINDOW,
+    TASK_FILES_BY_LINK,
+    TASK_INLINE_MAX_BYTES,
+    TASK_PAYLOAD_MODE,
+    TASK_SERIALIZER,
+    TRIAL_LOCK_CACHE_TTL,
+    WORKFLOW_TRIGGER_TARGETS,
+    WORKFLOW_TRIGGER_WINDOW,
+)
+from outbox import TaskOutbox
+from permissions import PermissionFilterCache
+from session_tokens import account_version, revoke_sessions
+from task_payloads import document_size, reference
+from task_queue import TaskPublisher
+from trial_locks import TrialLockCache
+from url_signing import SignedUrlCache, UrlSigner
+from write_behind import LastAccessBuffer
+
+URL_SIGNER = UrlSigner("../auth/.google_auth.json")
+SIGNED_URL_CACHE = SignedUrlCache(
+    URL_SIGNER,
+    lifetime=SIGNED_URL_LIFETIME,
+    window=SIGNED_URL_WINDOW,
+    maxsize=SIGNED_URL_CACHE_SIZE,
+)
+ACCOUNT_CACHE = AccountCache(ttl=ACCOUNT_CACHE_TTL)
+TRIAL_LOCK_CACHE = TrialLockCache(ttl=TRIAL_LOCK_CACHE_TTL)
+PERMISSION_FILTERS = PermissionFilterCache(
+    ttl=PERMISSION_FILTER_TTL, maxsize=PERMISSION_FILTER_CACHE_SIZE
+)
+LAST_ACCESS_BUFFER = LastAccessBuffer(interval=LAST_ACCESS_FLUSH_INTERVAL)
+atexit.register(LAST_ACCESS_BUFFER.stop)
+TASK_PUBLISHER = TaskPublisher(RABBIT_MQ_ADDRESS, pool_limit=RABBIT_MQ_POOL_LIMIT)
+TASK_OUTBOX = TaskOutbox(
+    TASK_PUBLISHER,
+    interval=OUTBOX_DISPATCH_INTERVAL,
+    max_attempts=OUTBOX_MAX_ATTEMPTS,
+    serializer=TASK_SERIALIZER,
+    send_targets=WORKFLOW_TRIGGER_TARGETS,
+)
+atexit.register(TASK_PUBLISHER.close)
+atexit.register(TASK_OUTBOX.stop)
 
 
 def update_last_access(email: str):
     """
-    Updates a user's last access time when they touch an endpoint.
+    Updates a user's last access time when they touch an endpoint. The write is
+    buffered and flushed in bulk by LAST_ACCESS_BUFFER.
 
     Arguments:
         email {str} -- User's email.
     """
-    last_access = app.data.driver.db["last_access"]
-    if not last_access.find_one({"email": email}):
-        last_access.insert(
-            {
-                "email": email,
-                "last_access": datetime.datetime.now(datetime.timezone.utc).isoformat(),
-            }
-        )
-    else:
-        last_access.update(
-            {"email": email},
-            {
-                "$set": {
-                    "last_access": datetime.datetime.now(
-                        datetime.timezone.utc
-                    ).isoformat()
-                }
-            },
-        )
-
-    log = "User: %s last login updated" % email
-    logging.info({"message": log, "category": "FAIR-EVE-LOGIN"})
+    LAST_ACCESS_BUFFER.record(
+        app.data.driver.db["last_access"],
+        email,
+        datetime.datetime.now(datetime.timezone.utc).isoformat(),
+    )
 
 
 def sign_url(
@@ -59,7 +105,7 @@ def sign_url(
     bucket: str = GOOGLE_BUCKET_NAME,
 ) -> str:
     """
-    Function that generates signed URLs.
+    Function that generates V4 signed URLs, signed locally by URL_SIGNER.
 
     Arguments:
         bucket_object {str} -- Path of file inside the bucket.
@@ -71,28 +117,9 @@ def sign_url(
     Returns:
         str -- A signed download url.
     """
-    method = "GET"
-    gcs_filename = urllib.parse.quote("/%s/%s" % (bucket, bucket_object))
-    content_md5, content_type = None, None
-    expiration_dt = datetime.datetime.utcnow() + datetime.timedelta(
-        seconds=expires_after_seconds
-    )
-    expiration = int(time.mktime(expiration_dt.timetuple()))
-    signature_string = "\n".join(
-        [method, content_md5 or "", content_type or "", str(expiration), gcs_filename]
-    )
-    signature_bytes = CREDS.sign_blob(signature_string)[1]
-    query_params = {
-        "GoogleAccessId": CLIENT_ID,
-        "Expires": str(expiration),
-        "Signature": base64.b64encode(signature_bytes),
-    }
-    result = "{endpoint}{resource}?{querystring}".format(
-        endpoint="https://storage.googleapis.com",
-        resource=gcs_filename,
-        querystring=urllib.parse.urlencode(query_params),
+    return URL_SIGNER.sign(
+        bucket, bucket_object, expires_after_seconds=expires_after_seconds
     )
-    return result
 
 
 def get_current_user():
@@ -117,10 +144,66 @@ def get_current_user():
         raise AttributeError("Unable to find a user")
 
 
+def load_account(email: str) -> dict:
+    """
+    Reads a user's account from the database.
+
+    Arguments:
+        email {str} -- User's email.
+
+    Returns:
+        dict -- The account, or None if there is none.
+    """
+    return app.data.driver.db["accounts"].find_one({"email": email})
+
+
+def get_account_version(email: str) -> Optional[int]:
+    """
+    Gets the version of a user's account, read at most once per request so that the
+    account and any session token issued for it agree.
+
+    Arguments:
+        email {str} -- User's email.
+
+    Returns:
+        Optional[int] -- The version, or None if Redis is unavailable.
+    """
+    context = _request_ctx_stack.top
+    versions = getattr(context, "account_versions", None)
+    if versions is None:
+        versions = context.account_versions = {}
+    if email not in versions:
+        versions[email] = account_version(app.redis, email)
+    return versions[email]
+
+
+def get_account(email: str) -> dict:
+    """
+    Gets a user's account. The account is read at most once per request, and is shared
+    between requests through ACCOUNT_CACHE until it expires or its version changes.
+
+    Arguments:
+        email {str} -- User's email.
+
+    Returns:
+        dict -- The account, or None if there is none.
+    """
+    context = _request_ctx_stack.top
+    accounts = getattr(context, "current_accounts", None)
+    if accounts is None:
+        accounts = context.current_accounts = {}
+    if email not in accounts:
+        accounts[email] = copy.deepcopy(
+            ACCOUNT_CACHE.get(email, load_account, get_account_version(email))
+        )
+    return accounts[email]
+
+
 def find_duplicates(items: List[dict]) -> List[str]:
     """
     Searches database for any items that are duplicates of already uploaded items and
-    filters them out
+    filters them out. Runs one query per trial, assay and DUPLICATE_CHECK_CHUNK_SIZE
+    file names.
 
     Arguments:
         items {[dict]} -- Data records
@@ -128,21 +211,9 @@ def find_duplicates(items: List[dict]) -> List[str]:
     Returns:
         List[str] -- List of duplicate filenames.
     """
-    query = {"$or": []}
-
-    for record in items:
-        query["$or"].append(
-            {
-                "assay": ObjectId(record["assay"]),
-                "trial": ObjectId(record["trial"]),
-                "file_name": record["file_name"],
-                "visibility": True,
-            }
-        )
-
-    data = app.data.driver.db["data"]
-    data_results = list(data.find(query, projection=["file_name"]))
-    return [x["file_name"] for x in data_results]
+    return find_duplicate_files(
+        app.data.driver.db["data"], items, chunk_size=DUPLICATE_CHECK_CHUNK_SIZE
+    )
 
 
 def check_trial_locked(trial_id: str) -> bool:
@@ -155,15 +226,28 @@ def check_trial_locked(trial_id: str) -> bool:
     Returns:
         bool -- [description]
     """
-    trials = app.data.driver.db["trials"]
-    locked = trials.find_one({"_id": trial_id, "locked": True})
-    return bool(locked)
+    return bool(find_locked_trials([trial_id]))
+
+
+def find_locked_trials(trial_ids: List[str]) -> Set[ObjectId]:
+    """
+    Finds which of a set of trials are locked, with one query for the trials whose
+    state is not in TRIAL_LOCK_CACHE.
+
+    Arguments:
+        trial_ids {List[str]} -- Ids of the trials to check.
+
+    Returns:
+        Set[ObjectId] -- Ids of the locked trials.
+    """
+    return TRIAL_LOCK_CACHE.locked_trials(app.data.driver.db["trials"], trial_ids)
 
 
 # On insert ingestion.
 def register_upload_job(items: List[dict]) -> None:
     """
-    Logs when file upload begins, aborts if duplicates found.
+    Logs when file upload begins, aborts if duplicates found. The files are taken off
+    the job and kept for store_upload_files to write to the files collection.
 
     Arguments:
         item {[dict]} -- Upload record
@@ -179,17 +263,18 @@ def register_upload_job(items: List[dict]) -> None:
         record["start_time"] = datetime.datetime.now(datetime.timezone.utc).isoformat()
         record["started_by"] = current_user
         log = "Upload job started by: %s\n" % current_user
-        for data_item in record["files"]:
-            if check_trial_locked(data_item["trial"]):
-                abort(401, "This trial has been locked, you may not upload files to it")
+        for data_item in record.get("files", []):
+            data_item["assay"] = ObjectId(data_item["assay"])
+            data_item["trial"] = ObjectId(data_item["trial"])
             log += "Concerning trial: %s On Assay: %s\n" % (
                 str(data_item["trial"]),
                 str(data_item["assay"]),
             )
-            logging.info({"message": log, "category": "FAIR-EVE-RECORD"})
             files.append(data_item)
-            data_item["assay"] = ObjectId(data_item["assay"])
-            data_item["trial"] = ObjectId(data_item["trial"])
+        logging.info({"message": log, "category": "FAIR-EVE-RECORD"})
+
+    if find_locked_trials([data_item["trial"] for data_item in files]):
+        abort(401, "This trial has been locked, you may not upload files to it")
 
     duplicate_filenames = find_duplicates(files)
 
@@ -202,18 +287,83 @@ def register_upload_job(items: List[dict]) -> None:
         )
         abort(409, "Upload aborted, duplicate files found")
 
+    upload_files = []
+    for record in items:
+        record_files = record.pop("files", [])
+        file_names = [data_item["file_name"] for data_item in record_files]
+        if len(set(file_names)) < len(file_names):
+            abort(409, "Upload aborted, duplicate files found")
+        record.update({counter: 0 for counter in PROGRESS_COUNTERS.values()})
+        upload_files.append(record_files)
+    _request_ctx_stack.top.upload_files = upload_files
+
+
+# On inserted ingestion.
+def store_upload_files(items: List[dict]) -> None:
+    """
+    Writes the files of new upload jobs to the files collection, one bulk write per
+    job.
+
+    Arguments:
+        items {List[dict]} -- Upload records, as inserted.
+    """
+    upload_files = getattr(_request_ctx_stack.top, "upload_files", None) or []
+    files = app.data.driver.db[FILES_COLLECTION]
+    for record, record_files in zip(items, upload_files):
+        insert_files(
+            files, file_documents(record["_id"], record["started_by"], record_files)
+        )
+
+
+# On updated ingestion_files.
+def update_job_counters(updates: dict, original: dict) -> None:
+    """
+    Moves a file between the job's progress counters when its status changes.
+
+    Arguments:
+        updates {dict} -- Patch applied to the file.
+        original {dict} -- File before the patch.
+    """
+    if "status" not in updates:
+        return
+    increments = counter_updates(
+        (original.get("status") or {}).get("progress"),
+        (updates["status"] or {}).get("progress"),
+    )
+    if increments:
+        app.data.driver.db["ingestion"].update_one(
+            {"_id": original["job"]}, {"$inc": increments}
+        )
+
 
 # On inserted data.
 def check_for_analysis(items: List[dict]) -> None:
     """
     Every time a new entry hits the "data" collection, the assay
-    collection is checked to see if any runs can be started.
+    collection is checked to see if any runs can be started. Inserts within
+    WORKFLOW_TRIGGER_WINDOW seconds share one manage_workflows task, which is told
+    the trial/assay pairs they touched if WORKFLOW_TRIGGER_TARGETS is set.
 
     Arguments:
         items {[dict]} -- list of data records
     """
-    start_celery_task("framework.tasks.snakemake_tasks.manage_workflows", [], 678)
-    start_celery_task("framework.tasks.processing_tasks.postprocessing", [items], 91011)
+    targets = []
+    for item in items:
+        target = {"trial": item["trial"], "assay": item["assay"]}
+        if target not in targets:
+            targets.append(target)
+    TASK_OUTBOX.coalesce(
+        app.data.driver.db["task_outbox"],
+        "framework.tasks.snakemake_tasks.manage_workflows",
+        targets,
+        678,
+        WORKFLOW_TRIGGER_WINDOW,
+    )
+    start_celery_task(
+        "framework.tasks.processing_tasks.postprocessing",
+        [task_documents("data", items)],
+        91011,
+    )
 
 
 # On updated trial.
@@ -243,6 +393,8 @@ def updated_trial(updates: dict, original: dict) -> None:
             474747,
         )
 
+    if "locked" in updates:
+        TRIAL_LOCK_CACHE.invalidate(original["_id"])
     if "locked" in updates and updates["locked"] != original["locked"]:
         verb = "unlocked" if updates["locked"] else "locked"
         log = "Trial %s %s by administrator %s" % (original["trial_name"], verb, admin)
@@ -268,7 +420,9 @@ def data_patched(updates: dict, original: dict) -> None:
         for key in updates:
             original[key] = updates[key]
         start_celery_task(
-            "framework.tasks.processing_tasks.postprocessing", [original], 91011
+            "framework.tasks.processing_tasks.postprocessing",
+            [task_documents("data", original)],
+            91011,
         )
         return
 
@@ -300,6 +454,9 @@ def remove_deleted_user(item: dict) -> None:
     Returns:
         None -- [description]
     """
+    ACCOUNT_CACHE.invalidate(item["email"])
+    PERMISSION_FILTERS.invalidate(app.redis, item["email"])
+    revoke_sessions(app.redis, item["email"])
     start_celery_task(
         "framework.tasks.administrative_tasks.call_deactivate_account",
         [item, "deactivate"],
@@ -361,7 +518,7 @@ def create_approval_email(user: dict) -> str:
     Returns:
         str -- Formatted email.
     """
-    return '''
+    return """
     Dear %s %s:
 
     Your registration for the CIMAC-CIDC DATA Portal has now been approved.
@@ -371,7 +528,7 @@ def create_approval_email(user: dict) -> str:
 
     Thanks,
     The CIDC Project Team
-    ''' % (user["first_n"], user["last_n"])
+    """ % (user["first_n"], user["last_n"])
 
 
 # On updated user.
@@ -383,6 +540,10 @@ def log_user_modified(updates: dict, original: dict) -> None:
         updates {dict} -- Updates made to the user's record.
         original {dict} -- State of the user record before alteration.
     """
+    ACCOUNT_CACHE.invalidate(original["email"])
+    if {"approved", "permissions", "role"} & set(updates):
+        PERMISSION_FILTERS.invalidate(app.redis, original["email"])
+        revoke_sessions(app.redis, original["email"])
     current_user = get_current_user()
 
     log = "Update to user %s made by %s: \n" % (
@@ -464,54 +625,75 @@ def drop_gene_symbol(item):
     )
 
 
+def task_documents(
+    resource: str, documents: Union[dict, List[dict]], updates: dict = None
+) -> object:
+    """
+    Prepares a document or list of documents to be sent as a task argument. With
+    TASK_PAYLOAD_MODE set to "reference" they are replaced by a reference to their ids
+    and etags, which workers resolve through /batch/<resource>.
+
+    Arguments:
+        resource {str} -- Resource the documents belong to.
+        documents {Union[dict, List[dict]]} -- Documents to send.
+
+    Keyword Arguments:
+        updates {dict} -- Patch just applied to a single document, whose etag is the
+            version referenced. (default: {None})
+
+    Returns:
+        object -- The documents, or a reference to them.
+    """
+    if TASK_PAYLOAD_MODE != "reference":
+        return documents
+    if isinstance(documents, dict):
+        documents = [dict(documents, **(updates or {}))]
+    return reference(resource, documents)
+
+
 def start_celery_task(task: str, arguments: List[object], task_id: int) -> None:
     """
-    Generic function to start a task through celery
+    Generic function to start a task through celery. The task is written to the
+    task_outbox collection and published by TASK_OUTBOX's dispatcher, so the request
+    does not wait on the broker.
 
     Arguments:
         task {string} -- Name of the task to start.
         arguments {List[object]} -- List of arguments to be supplied.
         id {int} -- Integer ID to uniquely identify the string.
     """
-    task_exchange = Exchange("", type="direct")
-    connection = Connection(RABBIT_MQ_ADDRESS)
-    producer = Producer(
-        exchange=task_exchange,
-        channel=connection.channel(),
-        routing_key="celery",
-        serializer="json",
-    )
-
-    # is the task ID necessary here?
-    payload = {
-        "id": task_id,
-        "task": task,
-        "args": arguments,
-        "kwargs": {},
-        "retries": 0,
-    }
-
-    producer.publish(
-        json.dumps(payload, default=json_util.default),
-        content_type="application/json",
-        content_encoding="utf-8",
-    )
-    connection.release()
+    TASK_OUTBOX.enqueue(app.data.driver.db["task_outbox"], task, arguments, task_id)
 
 
 # On updated ingestion.
 def process_data_upload(item: dict, original: dict) -> None:
     """
-    Tells celery to move the files from staging to an appropriate bucket.
+    Tells celery to move the files from staging to an appropriate bucket. Unless tasks
+    get references, the job is sent with its files read back from the files collection.
+    With TASK_FILES_BY_LINK set, jobs whose files take them past TASK_INLINE_MAX_BYTES,
+    near the size limit of a document in the outbox, get "files_href" instead, under
+    which workers page the files.
 
     Arguments:
         item {dict} -- Records to be moved
         original {dict} -- Patched upload record with GSURL.
     """
     google_path = app.config["GOOGLE_URL"] + app.config["GOOGLE_FOLDER_PATH"]
+    if TASK_PAYLOAD_MODE != "reference" and "files" not in original:
+        job = dict(
+            original,
+            files=job_files(app.data.driver.db[FILES_COLLECTION], original["_id"]),
+        )
+        if document_size(job) > TASK_INLINE_MAX_BYTES:
+            if TASK_FILES_BY_LINK:
+                job = dict(original, files_href=files_href(original["_id"]))
+            else:
+                log = "Upload job %s is too large to send with its files" % job["_id"]
+                logging.warning({"message": log, "category": "WARNING-EVE-CELERY"})
+        original = job
     start_celery_task(
         "framework.tasks.storage_tasks.move_files_from_staging",
-        [original, google_path],
+        [task_documents("ingestion", original, item), google_path],
         12345,
     )
 
@@ -633,7 +815,8 @@ def log_delete_request(resource: str, request: str, payload: dict) -> None:
 
 def generate_signed_url(response: dict) -> None:
     """
-    Generates a signed URL.
+    Adds a signed download URL to a data record. URLs come from SIGNED_URL_CACHE,
+    so repeated requests for a file within SIGNED_URL_WINDOW get the same URL.
 
     Arguments:
         response {dict} -- [description]
@@ -642,10 +825,9 @@ def generate_signed_url(response: dict) -> None:
         None -- [description]
     """
     url = response["gs_uri"]
-    signed_url = sign_url(
-        url.replace(GOOGLE_URL, ""), expires_after_seconds=1000
+    response["download_link"] = SIGNED_URL_CACHE.get(
+        GOOGLE_BUCKET_NAME, url.replace(GOOGLE_URL, "")
     )
-    response["download_link"] = signed_url
 
 
 def filter_on_id(resource: str, request: dict, lookup: dict) -> None:
@@ -663,12 +845,6 @@ def filter_on_id(resource: str, request: dict, lookup: dict) -> None:
     if resource in ["test"]:
         return
 
-    doc_id = None
-
-    # Check for the case of a document ID query.
-    if not request.args and not request.url.split("/")[-1] == resource:
-        doc_id = request.url.split("/")[-1]
-
     # Get current user.
     current_user = None
     try:
@@ -695,7 +871,7 @@ def filter_on_id(resource: str, request: dict, lookup: dict) -> None:
     user_id = current_user["email"]
 
     # Logic for adding the appropriate filter based on the endpoint.
-    if resource == "ingestion":
+    if resource in ["ingestion", "ingestion_files"]:
         lookup["started_by"] = user_id
     elif resource == "trials":
         return
@@ -704,86 +880,26 @@ def filter_on_id(resource: str, request: dict, lookup: dict) -> None:
     elif resource in ["assays", "accounts"]:
         return
     else:
-        accounts = app.data.driver.db["accounts"]
-        perms = accounts.find_one({"email": user_id}, {"permissions": 1})["permissions"]
-        if not doc_id:
-            get_resource(lookup, perms)
-        if doc_id:
-            if not get_document(doc_id, resource, perms):
-                lookup["find"] = "nothing"
-
-
-# Get id document
-def get_document(_id: str, resource: str, permissions: List[dict]) -> bool:
-    """
-    Method for determining if a user is allowed to see a specific document.
-
-    Arguments:
-        _id {str} -- Id of the document.
-        resource {str} -- Resource endpoint.
-        permissions {List[dict]} -- User's permissions list.
-
-    Returns:
-        bool -- True if they are allowed to see it, else false.
-    """
-    resource_coll = app.data.driver.db[resource]
-    document = resource_coll.find_one({"_id": _id})
-    # If there is no document, no need to filter.
-    if not document:
-        return True
-
-    for permission in permissions:
-        trial_match = document["trial"] == permission["trial"]
-        assay_match = document["assay"] == permission["assay"]
-        if trial_match and assay_match:
-            return True
-        if trial_match and permission["role"] == "trial_r":
-            return True
-        if assay_match and permission["role"] == "assay_r":
-            return True
-
-    return False
+        # The permission filter is merged into the lookup, so item requests do not
+        # find documents the user may not see. It is compiled from the stored account
+        # rather than ACCOUNT_CACHE, as the result is shared with other workers.
+        add_condition(
+            lookup,
+            PERMISSION_FILTERS.get(
+                app.redis, user_id, lambda: load_account(user_id)["permissions"]
+            ),
+        )
 
 
-# Get on a resource, not a specific document, e.g. /olink?where={"trial":"12345", "assay": "679"}
-def get_resource(lookup: dict, permissions: List[dict]) -> None:
+def add_condition(lookup: dict, condition: dict) -> None:
     """
-    Filters requests against a resource endpoint.
+    Narrows a lookup by a further condition.
 
     Arguments:
-        lookup {dict} -- [description]
-        permissions {List[dict]} -- [description]
-
-    Returns:
-        None -- [description]
+        lookup {dict} -- Filter condition, changed in place.
+        condition {dict} -- Condition every document found must also meet.
     """
-    conditions = []
-    assay_read = []
-    trial_read = []
-
-    for permission in permissions:
-        # If they have a broad role.
-        if permission["role"] == "trial_r":
-            # note the ID.
-            conditions.append({"trial": permission["trial"]})
-        if permission["role"] == "assay_r":
-            assay_read.append(permission["assay"])
-            if "assay" in lookup and lookup["assay"] != permission["assay"]:
-                conditions.append({"assay": permission["assay"]})
-
-    for permission in permissions:
-        if permission["role"] == "read":
-            # Check to see if rule is redundant.
-            if (
-                permission["trial"] not in trial_read
-                and permission["assay"] not in assay_read
-            ):
-                conditions.append(
-                    {"trial": permission["trial"], "assay": permission["assay"]}
-                )
-
-    # Only add the lookup key if there are any conditions to add.
-    if conditions:
-        lookup["$or"] = conditions
+    if any(key in lookup for key in condition):
+        lookup["$and"] = lookup.get("$and", []) + [condition]
     else:
-        lookup["find"] = "nothing"
+        lookup.update(condition)
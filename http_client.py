@@ -0,0 +1,212 @@
+"""
+Pooled HTTP client for outbound calls, with timeouts and a circuit breaker.
+"""
+import logging
+import os
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from metrics import LatencyHistogram
+
+
+class CircuitOpenError(Exception):
+    """
+    Raised instead of making a call while the circuit breaker is open.
+    """
+
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive failures. While open, calls are
+    rejected immediately until `reset_timeout` seconds have passed, after which one
+    trial call is let through and either closes the circuit again or reopens it.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30):
+        """
+        Keyword Arguments:
+            failure_threshold {int} -- Consecutive failures that open the circuit.
+                (default: {5})
+            reset_timeout {float} -- Seconds to wait before a trial call. (default: {30})
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        """
+        Returns:
+            str -- "closed", "open" or "half-open".
+        """
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at < self.reset_timeout:
+            return "open"
+        return "half-open"
+
+    def allow(self) -> bool:
+        """
+        Returns:
+            bool -- True if a call may be made now.
+        """
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half-open" and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self) -> None:
+        """
+        Records a successful call, closing the circuit.
+        """
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self) -> None:
+        """
+        Records a failed call, opening the circuit once the threshold is reached.
+        """
+        with self._lock:
+            self.failures += 1
+            self._trial_in_flight = False
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+
+class OutboundClient:
+    """
+    Keep-alive connection pool to one service, with per-call timeouts, a circuit
+    breaker and latency statistics.
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        timeout: float = 5,
+        pool_size: int = 10,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30,
+        log_every: int = 100,
+    ):
+        """
+        Arguments:
+            base_url {str} -- Scheme and host calls are made to.
+
+        Keyword Arguments:
+            timeout {float} -- Connect and read timeout of each call. (default: {5})
+            pool_size {int} -- Connections kept alive per worker. (default: {10})
+            failure_threshold {int} -- Consecutive failures that open the circuit.
+                (default: {5})
+            reset_timeout {float} -- Seconds the circuit stays open. (default: {30})
+            log_every {int} -- Calls between logs of the stats. (default: {100})
+        """
+        self.base_url = base_url
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self.calls = 0
+        self.errors = 0
+        self.rejected = 0
+        self.log_every = log_every
+        self.latency = LatencyHistogram("outbound_%s" % urlsplit(base_url).hostname)
+        self._session = None
+        self._pid = None
+
+    @property
+    def session(self) -> requests.Session:
+        """
+        Returns:
+            requests.Session -- The connection pool, created again in forked workers.
+        """
+        if self._session is None or self._pid != os.getpid():
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            self._session, self._pid = session, os.getpid()
+        return self._session
+
+    def get(self, path: str, **kwargs) -> requests.Response:
+        """
+        Makes a GET request. Connection errors, timeouts, any other exception raised by
+        the call and 5xx responses count as failures of the service.
+
+        Arguments:
+            path {str} -- Path relative to the base url.
+
+        Raises:
+            CircuitOpenError -- If the circuit is open.
+            requests.RequestException -- If the request failed.
+
+        Returns:
+            requests.Response -- The response.
+        """
+        if not self.breaker.allow():
+            self.rejected += 1
+            raise CircuitOpenError("Circuit open for %s" % self.base_url)
+
+        kwargs.setdefault("timeout", self.timeout)
+        self.calls += 1
+        start = time.monotonic()
+        try:
+            response = self.session.get(self.base_url + path, **kwargs)
+        except Exception:  # pylint: disable=broad-except
+            # Anything raised must end a half-open trial, or the circuit stays shut.
+            self._record_failure()
+            raise
+        finally:
+            self.latency.observe(time.monotonic() - start)
+            if self.log_every and not self.calls % self.log_every:
+                self.log()
+
+        if response.status_code >= 500:
+            self._record_failure()
+        else:
+            self.breaker.record_success()
+        return response
+
+    def _record_failure(self) -> None:
+        """
+        Counts a failed call and logs when it opens the circuit.
+        """
+        self.errors += 1
+        was_open = self.breaker.opened_at is not None
+        self.breaker.record_failure()
+        if not was_open and self.breaker.opened_at is not None:
+            log = "Circuit opened for %s after %s failures" % (
+                self.base_url,
+                self.breaker.failures,
+            )
+            logging.error({"message": log, "category": "ERROR-EVE-OUTBOUND"})
+
+    def stats(self) -> dict:
+        """
+        Returns:
+            dict -- Call counters, circuit state and the call latency histogram.
+        """
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "rejected": self.rejected,
+            "circuit": self.breaker.state,
+            "latency": self.latency.snapshot(),
+        }
+
+    def log(self) -> None:
+        """
+        Publishes the stats as a structured log.
+        """
+        logging.info({"message": self.stats(), "category": "INFO-EVE-METRICS"})
@@ -0,0 +1,269 @@
+"""
+Reconciliation of the indexes declared by DOMAIN resources with the ones in the
+database: missing indexes are built in the background, and indexes that are
+undeclared, declared differently or never used are reported.
+
+Eve builds the mongo_indexes of a resource in the foreground when it registers it, and
+drops and rebuilds those it finds declared differently. Indexes on large collections,
+and unique ones, which existing duplicates would keep from building and so keep the
+API from starting, are declared under background_indexes, which only this module
+reads.
+
+Run as a script to reconcile from the command line:
+
+    python indexes.py [--dry-run]
+"""
+import argparse
+import json
+import logging
+import sys
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from pymongo import MongoClient
+from pymongo.errors import OperationFailure, PyMongoError
+
+# Index options that change which documents an index holds or allows.
+COMPARED_OPTIONS = ("unique", "sparse", "partialFilterExpression", "expireAfterSeconds")
+# Startup modes: build missing indexes, or only report them.
+CREATE = "create"
+REPORT = "report"
+# Resource settings holding index declarations: Eve's, and the reconciler's own.
+INDEX_KEYS = ("mongo_indexes", "background_indexes")
+
+
+def declared_indexes(domain: dict) -> Dict[str, Dict[str, Tuple[list, dict]]]:
+    """
+    Collects the mongo_indexes and background_indexes of every resource by the
+    collection it reads, as several resources can share one.
+
+    Arguments:
+        domain {dict} -- Eve DOMAIN.
+
+    Raises:
+        ValueError -- If two resources declare different indexes of the same name on
+            a collection.
+
+    Returns:
+        Dict[str, Dict[str, Tuple[list, dict]]] -- Keys and options of each index, by
+            collection and index name.
+    """
+    collections = {}
+    for resource, settings in domain.items():
+        source = settings.get("datasource", {}).get("source", resource)
+        declarations = [
+            item for key in INDEX_KEYS for item in settings.get(key, {}).items()
+        ]
+        for name, value in declarations:
+            keys, options = value if isinstance(value, tuple) else (value, {})
+            index = ([tuple(key) for key in keys], dict(options))
+            declared = collections.setdefault(source, {})
+            if declared.get(name, index) != index:
+                raise ValueError(
+                    "Index %s of %s is declared differently by %s"
+                    % (name, source, resource)
+                )
+            declared[name] = index
+    return collections
+
+
+def _matches(existing: dict, keys: list, options: dict) -> bool:
+    if [tuple(key) for key in existing["key"]] != keys:
+        return False
+    return all(
+        (
+            existing.get(option) == options.get(option)
+            if option not in ("unique", "sparse")
+            else bool(existing.get(option)) == bool(options.get(option))
+        )
+        for option in COMPARED_OPTIONS
+    )
+
+
+def index_usage(collection) -> Optional[Dict[str, int]]:
+    """
+    Arguments:
+        collection {pymongo.collection.Collection} -- Collection.
+
+    Returns:
+        Optional[Dict[str, int]] -- Operations that used each index since the server
+            started, or None where $indexStats is not available.
+    """
+    try:
+        return {
+            stats["name"]: stats["accesses"]["ops"]
+            for stats in collection.aggregate([{"$indexStats": {}}])
+        }
+    except OperationFailure:
+        return None
+
+
+def reconcile(database, declared: dict, create: bool = True) -> Dict[str, dict]:
+    """
+    Compares the declared indexes with the ones in the database and builds the
+    missing ones. Nothing is dropped.
+
+    Arguments:
+        database {pymongo.database.Database} -- The API's database.
+        declared {dict} -- Indexes from declared_indexes.
+
+    Keyword Arguments:
+        create {bool} -- Build missing indexes, rather than only report them.
+            (default: {True})
+
+    Returns:
+        Dict[str, dict] -- For each collection, the indexes "created", "missing"
+            (not built), "conflicting" (same name, other keys or options),
+            "undeclared" and "unused" (no operations since the server started).
+    """
+    report = {}
+    for source in sorted(declared):
+        collection = database[source]
+        existing = collection.index_information()
+        entry = {
+            "created": [],
+            "missing": [],
+            "conflicting": [],
+            "undeclared": sorted(set(existing) - set(declared[source]) - {"_id_"}),
+            "unused": [],
+        }
+        for name, (keys, options) in sorted(declared[source].items()):
+            if name in existing:
+                if not _matches(existing[name], keys, options):
+                    entry["conflicting"].append(name)
+                continue
+            if not create:
+                entry["missing"].append(name)
+                continue
+            try:
+                collection.create_index(keys, name=name, background=True, **options)
+                entry["created"].append(name)
+            except OperationFailure:
+                logging.error(
+                    {
+                        "message": "Failed to build index %s of %s" % (name, source),
+                        "category": "ERROR-EVE-INDEXES",
+                    },
+                    exc_info=True,
+                )
+                entry["missing"].append(name)
+        usage = index_usage(collection)
+        if usage is not None:
+            entry["unused"] = sorted(
+                name for name, ops in usage.items() if not ops and name != "_id_"
+            )
+        report[source] = entry
+    return report
+
+
+def log_report(report: Dict[str, dict]) -> None:
+    """
+    Logs the collections whose indexes need attention.
+
+    Arguments:
+        report {Dict[str, dict]} -- Report from reconcile.
+    """
+    for source, entry in report.items():
+        if entry["missing"] or entry["conflicting"]:
+            logging.warning(
+                {
+                    "message": dict(entry, collection=source),
+                    "category": "WARNING-EVE-INDEXES",
+                }
+            )
+        elif any(entry.values()):
+            logging.info(
+                {
+                    "message": dict(entry, collection=source),
+                    "category": "INFO-EVE-INDEXES",
+                }
+            )
+
+
+def reconcile_in_background(app, create: bool = True) -> threading.Thread:
+    """
+    Reconciles the indexes of an Eve app from a daemon thread, so startup does not
+    wait for index builds.
+
+    Arguments:
+        app {eve.Eve} -- The API.
+
+    Keyword Arguments:
+        create {bool} -- Build missing indexes. (default: {True})
+
+    Returns:
+        threading.Thread -- The started thread.
+    """
+
+    def run():
+        try:
+            with app.app_context():
+                database = app.data.driver.db
+                log_report(
+                    reconcile(database, declared_indexes(app.config["DOMAIN"]), create)
+                )
+        except (PyMongoError, ValueError):
+            logging.error(
+                {
+                    "message": "Index reconciliation failed",
+                    "category": "ERROR-EVE-INDEXES",
+                },
+                exc_info=True,
+            )
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread
+
+
+def connect(settings) -> MongoClient:
+    """
+    Arguments:
+        settings {module} -- The settings module.
+
+    Returns:
+        MongoClient -- Client for the API's database server.
+    """
+    options = {
+        "host": settings.MONGO_HOST,
+        "port": settings.MONGO_PORT,
+        "username": settings.MONGO_USERNAME,
+        "password": settings.MONGO_PASSWORD,
+    }
+    if getattr(settings, "MONGO_AUTH_SOURCE", None):
+        options["authSource"] = settings.MONGO_AUTH_SOURCE
+    if getattr(settings, "MONGO_REPLICA_SET", None):
+        options["replicaset"] = settings.MONGO_REPLICA_SET
+    return MongoClient(**options)
+
+
+def main(argv: List[str] = None) -> int:
+    """
+    Reconciles the indexes of the configured database and prints the report.
+
+    Keyword Arguments:
+        argv {List[str]} -- Command line arguments. (default: {None})
+
+    Returns:
+        int -- 1 if indexes are missing or conflicting, else 0.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--dry-run", action="store_true", help="report missing indexes, build none"
+    )
+    args = parser.parse_args(argv)
+
+    import settings  # pylint: disable=import-outside-toplevel
+
+    database = connect(settings)[settings.MONGO_DBNAME]
+    report = reconcile(
+        database, declared_indexes(settings.DOMAIN), create=not args.dry_run
+    )
+    print(json.dumps(report, indent=2, sort_keys=True))
+    return int(
+        any(entry["missing"] or entry["conflicting"] for entry in report.values())
+    )
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,23 +2,44 @@
 """
 Configures and runs the API.
 """
+import datetime
 import json
 import logging
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from typing import List, Tuple
-from urllib.request import urlopen
 import redis
 
 import requests
+from bson import ObjectId
+from bson.errors import InvalidId
 from cidc_utils.loghandler import StackdriverJsonFormatter
 from eve import Eve
-from eve.auth import TokenAuth
+from eve.auth import TokenAuth, requires_auth
+from eve.methods.post import post_internal
+from eve.utils import ParsedRequest
 from eve_swagger import swagger
 from flask import _request_ctx_stack
-from flask import jsonify
+from flask import Response, abort, jsonify, request, stream_with_context
 from authlib.flask.client import OAuth
 from jose import jwt
+from pymongo import monitoring
 
 import hooks
+import indexes
+from auth_cache import JWKSCache, TokenCache, UserInfoCache, fetch_jwks
+from duplicates import duplicate_keys
+from http_client import CircuitOpenError, OutboundClient
+from ingestion_files import FILES_COLLECTION, file_documents, insert_files
+from ingestion_stream import ingest, read_lines
+from manifest import CONTENT_TYPES, PROJECTION, stream_manifest
+from query_monitor import SlowQueryMonitor, explain_with
+from session_tokens import SessionTokens
+from status_events import (
+    EVENT_FIELDS,
+    open_watcher,
+    stream_events,
+)
 from settings import (
     ALGORITHMS,
     AUTH0_AUDIENCE,
@@ -26,6 +47,27 @@ from settings import (
     AUTH0_CLIENT_SECRET,
     AUTH0_DOMAIN,
     AUTH0_PORTAL_AUDIENCE,
+    AUTH0_TIMEOUT,
+    BATCH_FETCH_LIMIT,
+    DUPLICATE_CHECK_CHUNK_SIZE,
+    EVENTS_HEARTBEAT,
+    EVENTS_MAX_DURATION,
+    EVENTS_MODE,
+    EVENTS_POLL_INTERVAL,
+    GOOGLE_BUCKET_NAME,
+    GOOGLE_URL,
+    INDEX_RECONCILE,
+    INGESTION_STREAM_BATCH_SIZE,
+    INGESTION_STREAM_MAX_LINE,
+    JWKS_CACHE_TTL,
+    MANIFEST_CHUNK_SIZE,
+    SESSION_SECRET,
+    SESSION_TOKEN_TTL,
+    SIGNING_WORKERS,
+    SLOW_QUERY_EXPLAIN_INTERVAL,
+    SLOW_QUERY_MS,
+    TOKEN_CACHE_LOG_EVERY,
+    TOKEN_CACHE_SIZE,
 )
 
 
@@ -51,6 +93,8 @@ class BearerAuth(TokenAuth):
             method {str} -- HTTP method (GET, POST, PATCH, DELETE)
         """
         try:
+            if SESSION_TOKENS and SESSION_TOKENS.is_session_token(token):
+                return session_auth(token, allowed_roles, resource)
             email = token_auth(token)
             role = role_auth(email, allowed_roles, resource, method)
             if resource == "accounts_create":
@@ -59,12 +103,49 @@ class BearerAuth(TokenAuth):
                 role_value = role["role"]
                 user = _request_ctx_stack.top.current_user
                 user["role"] = role_value
+                if SESSION_TOKENS:
+                    _request_ctx_stack.top.session_token = SESSION_TOKENS.issue(
+                        email, role_value, hooks.get_account_version(email)
+                    )
             return email and role
         except KeyError:
             return False
 
 
 REDIS_INSTANCE = redis.StrictRedis(host="localhost", port=6379, db=0)
+AUTH0_CLIENT = OutboundClient("https://%s" % AUTH0_DOMAIN, timeout=AUTH0_TIMEOUT)
+JWKS_CACHE = JWKSCache(partial(fetch_jwks, AUTH0_CLIENT), ttl=JWKS_CACHE_TTL)
+SIGNING_POOL = ThreadPoolExecutor(max_workers=SIGNING_WORKERS)
+TOKEN_CACHE = TokenCache(maxsize=TOKEN_CACHE_SIZE, log_every=TOKEN_CACHE_LOG_EVERY)
+USERINFO_CACHE = UserInfoCache(REDIS_INSTANCE, maxsize=TOKEN_CACHE_SIZE)
+SESSION_TOKENS = (
+    SessionTokens(SESSION_SECRET, REDIS_INSTANCE, ttl=SESSION_TOKEN_TTL)
+    if SESSION_SECRET
+    else None
+)
+
+
+def database_for(name: str):
+    """
+    Returns a database of the API's Mongo client, for explains of slow queries.
+
+    Arguments:
+        name {str} -- Database name.
+
+    Returns:
+        pymongo.database.Database -- The database.
+    """
+    with APP.app_context():
+        return APP.data.driver.db.client[name]
+
+
+# Registered before the app creates its Mongo client, so the client is monitored.
+SLOW_QUERY_MONITOR = SlowQueryMonitor(
+    threshold_ms=SLOW_QUERY_MS,
+    explain=explain_with(database_for),
+    explain_interval=SLOW_QUERY_EXPLAIN_INTERVAL,
+)
+monitoring.register(SLOW_QUERY_MONITOR)
 APP = Eve(
     "ingestion_api", auth=BearerAuth, settings="settings.py", redis=REDIS_INSTANCE
 )
@@ -141,9 +222,8 @@ def role_auth(email: str, allowed_roles: List[str], resource: str, method: str)
     Returns:
         dict -- User's account if found.
     """
-    accounts = APP.data.driver.db["accounts"]
     lookup = {"email": email}
-    account = accounts.find_one(lookup)
+    account = hooks.get_account(email)
 
     # If account found...
     if account:
@@ -181,13 +261,49 @@ def role_auth(email: str, allowed_roles: List[str], resource: str, method: str)
     return None
 
 
-def validate_payload(token: dict, rsa_key: str, audience_to_verify: str) -> dict:
+def session_auth(token: str, allowed_roles: List[str], resource: str) -> bool:
+    """
+    Authorizes a request made with a session token issued by this API, without
+    contacting Auth0 or reading the user's account.
+
+    Arguments:
+        token {str} -- Session token.
+        allowed_roles {List[str]} -- List of allowed roles for the resource.
+        resource {str} -- Endpoint being accessed.
+
+    Returns:
+        bool -- True if the token is valid and its role may use the resource.
+    """
+    claims = SESSION_TOKENS.verify(token)
+    if not claims:
+        logging.info(
+            {"message": "Invalid session token", "category": "FAIR-EVE-FAILED-SESSION"}
+        )
+        return False
+
+    email = claims["email"]
+    _request_ctx_stack.top.current_user = {"email": email, "role": claims["role"]}
+    hooks.update_last_access(email)
+    if resource in {"accounts_create", "accounts_info"}:
+        return True
+    if claims["role"] in allowed_roles:
+        return True
+
+    log = "Permissions check failed for user: %s against resource %s" % (
+        email,
+        resource,
+    )
+    logging.info({"message": log, "category": "FAIR-EVE-FAILED-PERMISSIONS"})
+    return False
+
+
+def validate_payload(token: dict, rsa_key: object, audience_to_verify: str) -> dict:
     """
     Decodes the token and checks it for validity.
 
     Arguments:
         token {dict} -- JWT
-        rsa_key {str} -- rsa_key
+        rsa_key {object} -- rsa_key, a JWK or a list of parsed public keys
         audience_to_verify {str} -- parameter to use as the audience.
 
     Raises:
@@ -246,31 +362,28 @@ def check_user_exists(email: str) -> bool:
     Returns:
         bool -- [description]
     """
-    db_accounts = APP.data.driver.db["accounts"]
-    lookup_account = db_accounts.find_one({"username": email})
-    return bool(lookup_account)
+    return bool(hooks.get_account(email))
 
 
-def token_auth(token: dict) -> str:
+def verify_token(token: str) -> Tuple[dict, bool]:
     """
-    Checks if the supplied token is valid.
+    Checks the token's signature and claims. Tokens that were verified before are
+    served from the verified token cache until they expire.
 
     Arguments:
-        token {dict} -- JWT token.
+        token {str} -- JWT token.
 
     Raises:
-        AuthError -- [description]
+        AuthError -- Caused by an unknown signing key.
 
     Returns:
-        str -- Authorized user's email.
+        Tuple[dict, bool] -- Decoded token and whether it was issued to the portal, or
+            (None, False) if it could not be verified.
     """
-    jwks = json.loads(urlopen("https://%s/.well-known/jwks.json" % AUTH0_DOMAIN).read())
-
-    if not token:
-        logging.warning(
-            {"message": "no token received", "category": "WARNING-EVE-AUTH"}
-        )
-        return False
+    cached = TOKEN_CACHE.get(token)
+    if cached:
+        payload, request_from_portal = cached
+        return dict(payload), request_from_portal
 
     unverified_header = None
     try:
@@ -284,20 +397,11 @@ def token_auth(token: dict) -> str:
             exc_info=True,
         )
 
-    if not jwks:
-        logging.warning({"message": "no jwks key", "category": "WARNING-EVE-AUTH"})
-        return False
+    rsa_key = JWKS_CACHE.get_key(unverified_header["kid"])
 
-    rsa_key = {}
-    for key in jwks["keys"]:
-        if key["kid"] == unverified_header["kid"]:
-            rsa_key = {
-                "kty": key["kty"],
-                "kid": key["kid"],
-                "use": key["use"],
-                "n": key["n"],
-                "e": key["e"],
-            }
+    if not JWKS_CACHE.keys:
+        logging.warning({"message": "no jwks key", "category": "WARNING-EVE-AUTH"})
+        return None, False
 
     if not rsa_key:
         logging.warning({"message": "no_rsa_key", "category": "WARNING-EVE-AUTH"})
@@ -315,10 +419,82 @@ def token_auth(token: dict) -> str:
         request_from_portal = True
 
     try:
-        payload = validate_payload(token, rsa_key, audience_to_verify)
+        # Passed as a one item key set so python-jose uses the parsed key as is.
+        payload = validate_payload(token, [rsa_key], audience_to_verify)
     except AuthError as ate:
         log = "Authorization failed: %s" % str(ate)
         logging.error({"message": log, "category": "ERROR-EVE-AUTH"})
+        return None, False
+
+    TOKEN_CACHE.put(token, (payload, request_from_portal), payload.get("exp"))
+    return dict(payload), request_from_portal
+
+
+def get_userinfo_email(token: str, payload: dict) -> str:
+    """
+    Resolves the email of a token's user through Auth0's /userinfo endpoint, using the
+    shared userinfo cache when the user was resolved before. Cached users can still be
+    resolved while the endpoint is down.
+
+    Arguments:
+        token {str} -- JWT token.
+        payload {dict} -- Decoded token.
+
+    Raises:
+        AuthError -- Caused by a failed or unavailable userinfo request.
+
+    Returns:
+        str -- The user's email.
+    """
+    subject = payload.get("sub") or token
+    email = USERINFO_CACHE.get(subject)
+    if email:
+        return email
+
+    try:
+        res = AUTH0_CLIENT.get(
+            "/userinfo", headers={"Authorization": "Bearer {}".format(token)}
+        )
+    except (CircuitOpenError, requests.RequestException):
+        logging.error(
+            {"message": "Userinfo endpoint unavailable", "category": "ERROR-EVE-AUTH"},
+            exc_info=True,
+        )
+        raise AuthError(
+            {"code": "No_info", "description": "Userinfo endpoint unavailable"}, 503
+        )
+    if not res.status_code == 200:
+        message = "There was an error fetching user information: %s" % res.reason
+        logging.error({"message": message, "category": "ERROR-EVE-AUTH"})
+        raise AuthError(
+            {"code": "No_info", "description": "No userinfo found at endpoint"}, 401
+        )
+    email = res.json()["email"]
+    USERINFO_CACHE.put(subject, email, payload.get("exp"))
+    return email
+
+
+def token_auth(token: dict) -> str:
+    """
+    Checks if the supplied token is valid.
+
+    Arguments:
+        token {dict} -- JWT token.
+
+    Raises:
+        AuthError -- [description]
+
+    Returns:
+        str -- Authorized user's email.
+    """
+    if not token:
+        logging.warning(
+            {"message": "no token received", "category": "WARNING-EVE-AUTH"}
+        )
+        return False
+
+    payload, request_from_portal = verify_token(token)
+    if not payload:
         return None
 
     if request_from_portal:
@@ -326,17 +502,7 @@ def token_auth(token: dict) -> str:
             log = "User not registered: %s" % payload["email"]
             logging.info({"message": log, "category": "EVE-AUTH-UNREGISTERED"})
     elif "gty" not in payload:
-        res = requests.get(
-            "https://%s/userinfo" % AUTH0_DOMAIN,
-            headers={"Authorization": "Bearer {}".format(token)},
-        )
-        if not res.status_code == 200:
-            message = "There was an error fetching user information: %s" % res.reason
-            logging.error({"message": message, "category": "ERROR-EVE-AUTH"})
-            raise AuthError(
-                {"code": "No_info", "description": "No userinfo found at endpoint"}, 401
-            )
-        payload["email"] = res.json()["email"]
+        payload["email"] = get_userinfo_email(token, payload)
     else:
         payload["email"] = "celery-taskmanager"
 
@@ -364,6 +530,9 @@ def after_request(response):
     """
     response.headers.add("google_url", APP.config["GOOGLE_URL"])
     response.headers.add("google_folder_path", APP.config["GOOGLE_UPLOAD_BUCKET"])
+    session_token = getattr(_request_ctx_stack.top, "session_token", None)
+    if session_token:
+        response.headers.add("X-Session-Token", session_token)
     try:
         auth_header = response.headers.pop("WWW-Authenticate")
         response.headers.add("WWW-Authenticate", auth_header.replace("Basic", "xBasic"))
@@ -400,6 +569,247 @@ def custom500(error):
         return jsonify({"message": err_str}), 500
 
 
+def listable_resource(resource: str) -> dict:
+    """
+    Arguments:
+        resource {str} -- Resource endpoint.
+
+    Raises:
+        MethodNotAllowed -- If the resource cannot be listed with a GET, or is
+            backed by an aggregation.
+
+    Returns:
+        dict -- Settings of the resource.
+    """
+    resource_settings = APP.config["DOMAIN"][resource]
+    aggregation = resource_settings["datasource"].get("aggregation")
+    if "GET" not in resource_settings["resource_methods"] or aggregation:
+        abort(405)
+    return resource_settings
+
+
+@APP.route("/batch/<resource>", methods=["POST"])
+@requires_auth("resource")
+def batch_fetch(resource: str):
+    """
+    Fetches many documents of a resource by id in one call, for workers resolving the
+    references sent in task payloads. The body is {"ids": [...]}. Only resources
+    that can be listed with a GET are served, and through Eve's data layer, so the
+    permission filter, datasource filter and projection of a GET on the resource
+    apply.
+
+    Arguments:
+        resource {str} -- Resource endpoint.
+
+    Returns:
+        Response -- The documents found as "_items" and the ids that were not as
+            "_missing".
+    """
+    listable_resource(resource)
+    ids = (request.get_json(silent=True) or {}).get("ids")
+    if not isinstance(ids, list) or len(ids) > BATCH_FETCH_LIMIT:
+        abort(400, "Expected a list of at most %s ids" % BATCH_FETCH_LIMIT)
+    try:
+        object_ids = [ObjectId(_id) for _id in ids]
+    except (InvalidId, TypeError):
+        abort(400, "Invalid id")
+
+    lookup = {"_id": {"$in": object_ids}}
+    hooks.filter_on_id(resource, request, lookup)
+    documents = list(APP.data.find(resource, ParsedRequest(), lookup))
+
+    found = {document["_id"] for document in documents}
+    body = {
+        "_items": documents,
+        "_missing": [str(_id) for _id in object_ids if _id not in found],
+    }
+    return APP.response_class(
+        json.dumps(body, cls=APP.data.json_encoder_class), mimetype="application/json"
+    )
+
+
+@APP.route("/manifest/<resource>", methods=["GET"])
+@requires_auth("resource")
+def download_manifest(resource: str):
+    """
+    Streams a manifest of the files of a trial, optionally narrowed to an assay, with
+    a signed download link for each. Takes ?trial=<id>[&assay=<id>][&format=tsv].
+    Only data resources listing visible files are served, through Eve's data layer,
+    so the permission filter, datasource filter and projection of a GET on the
+    resource apply. Links are signed in batches on SIGNING_POOL while the cursor is
+    read.
+
+    Arguments:
+        resource {str} -- Data resource endpoint.
+
+    Returns:
+        Response -- NDJSON, or TSV with a header row.
+    """
+    datasource = listable_resource(resource)["datasource"]
+    visible_only = (datasource.get("filter") or {}).get("visibility") is True
+    if datasource["source"] != "data" or not visible_only:
+        abort(404)
+    output_format = request.args.get("format", "ndjson")
+    if output_format not in CONTENT_TYPES:
+        abort(400, "Format must be one of %s" % ", ".join(CONTENT_TYPES))
+    try:
+        lookup = {"trial": ObjectId(request.args["trial"])}
+        if "assay" in request.args:
+            lookup["assay"] = ObjectId(request.args["assay"])
+    except KeyError:
+        abort(400, "A trial is required")
+    except (InvalidId, TypeError):
+        abort(400, "Invalid id")
+
+    hooks.filter_on_id(resource, request, lookup)
+    fields = ParsedRequest()
+    fields.projection = json.dumps(PROJECTION)
+    cursor = APP.data.find(resource, fields, lookup).batch_size(MANIFEST_CHUNK_SIZE)
+
+    def sign_batch(gs_uris: List[str]) -> List[str]:
+        return hooks.SIGNED_URL_CACHE.get_many(
+            GOOGLE_BUCKET_NAME, [gs_uri.replace(GOOGLE_URL, "") for gs_uri in gs_uris]
+        )
+
+    lines = stream_manifest(
+        cursor,
+        sign_batch,
+        SIGNING_POOL,
+        output_format=output_format,
+        chunk_size=MANIFEST_CHUNK_SIZE,
+        max_in_flight=SIGNING_WORKERS * 2,
+    )
+    return Response(lines, mimetype=CONTENT_TYPES[output_format])
+
+
+@APP.route("/stream/<resource>", methods=["POST"])
+@requires_auth("resource")
+def stream_ingestion(resource: str):
+    """
+    Starts an upload job from an NDJSON body with one file entry per line. Entries
+    are validated against the schema of the job's files as they are read, checked for
+    trial locks and duplicates in batches of INGESTION_STREAM_BATCH_SIZE, and written
+    to the job's files in bulk. The response is NDJSON too: an error per rejected line, sent
+    as soon as it is found, then a summary with the job's id. A job left without files
+    is removed and its summary has the "ERR" status.
+
+    Arguments:
+        resource {str} -- Ingestion resource endpoint.
+
+    Returns:
+        Response -- Errors as {"_line", "_status", "_issues"}, then
+            {"_status", "accepted", "rejected", "_id"}, or {"_status", "accepted",
+            "rejected", "_issues"} when no entry was accepted.
+    """
+    datasource = APP.config["DOMAIN"][resource]["datasource"]
+    if datasource["source"] != "ingestion":
+        abort(404)
+    response, _, _, status, _ = post_internal(resource, {"number_of_files": 0})
+    if status != 201:
+        abort(status, response.get("_issues"))
+    jobs = APP.data.driver.db["ingestion"]
+    files = APP.data.driver.db[FILES_COLLECTION]
+    job_id = response["_id"]
+    started_by = jobs.find_one({"_id": job_id})["started_by"]
+
+    files_schema = APP.config["DOMAIN"][resource]["schema"]["files"]["schema"]
+    validator = APP.validator(files_schema["schema"], resource=resource)
+
+    def validate(entry: dict) -> dict:
+        if validator.validate(entry):
+            return None
+        return validator.errors
+
+    def find_duplicates(entries: List[dict]) -> List[tuple]:
+        return duplicate_keys(
+            APP.data.driver.db["data"], entries, DUPLICATE_CHECK_CHUNK_SIZE
+        )
+
+    def write_batch(entries: List[dict]) -> List[int]:
+        not_written = insert_files(files, file_documents(job_id, started_by, entries))
+        jobs.update_one(
+            {"_id": job_id},
+            {
+                "$inc": {"number_of_files": len(entries) - len(not_written)},
+                "$set": {"_updated": datetime.datetime.utcnow().replace(microsecond=0)},
+            },
+        )
+        return not_written
+
+    def close_job(summary: dict) -> None:
+        if not summary["accepted"]:
+            jobs.delete_one({"_id": job_id})
+            summary["_status"] = "ERR"
+            summary["_issues"] = {"files": "No file entries were accepted"}
+            message = "Streamed upload job %s removed: %s files rejected" % (
+                job_id,
+                summary["rejected"],
+            )
+        else:
+            summary["_id"] = job_id
+            message = "Streamed upload job %s: %s files accepted, %s rejected" % (
+                job_id,
+                summary["accepted"],
+                summary["rejected"],
+            )
+        logging.info({"message": message, "category": "FAIR-EVE-RECORD"})
+
+    def generate():
+        events = ingest(
+            read_lines(request.stream, INGESTION_STREAM_MAX_LINE),
+            validate,
+            hooks.find_locked_trials,
+            find_duplicates,
+            write_batch,
+            batch_size=INGESTION_STREAM_BATCH_SIZE,
+        )
+        for event in events:
+            if "_line" not in event:
+                close_job(event)
+            yield json.dumps(event, cls=APP.data.json_encoder_class) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+
+@APP.route("/events/<resource>", methods=["GET"])
+@requires_auth("resource")
+def status_events(resource: str):
+    """
+    Pushes status changes of upload jobs or analyses as server-sent events, instead
+    of clients polling /ingestion or /status. The same permission filter as a GET on
+    the resource is computed once and applied to the polling query, or to the change
+    stream when EVENTS_MODE is "change_stream". Clients resume with Last-Event-ID.
+
+    Arguments:
+        resource {str} -- Ingestion or analysis resource endpoint.
+
+    Returns:
+        Response -- text/event-stream of {"_id", "status"} events.
+    """
+    datasource = APP.config["DOMAIN"][resource]["datasource"]
+    field = EVENT_FIELDS.get(datasource["source"])
+    if not field:
+        abort(404)
+    lookup = {}
+    hooks.filter_on_id(resource, request, lookup)
+    if datasource.get("filter"):
+        lookup = {"$and": [lookup, datasource["filter"]]}
+
+    watcher = open_watcher(
+        EVENTS_MODE,
+        APP.data.driver.db[datasource["source"]],
+        lookup,
+        field,
+        resume_after=request.headers.get("Last-Event-ID"),
+        interval=EVENTS_POLL_INTERVAL,
+    )
+    return Response(
+        stream_events(watcher, resource, EVENTS_HEARTBEAT, EVENTS_MAX_DURATION),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 def configure_logging():
     """
     Configures the loghandler to send formatted logs to stackdriver.
@@ -432,6 +842,8 @@ def add_hooks():
     # Ingestion Hooks
     APP.on_updated_ingestion += hooks.process_data_upload  # pylint: disable=E1101
     APP.on_insert_ingestion += hooks.register_upload_job  # pylint: disable=E1101
+    APP.on_inserted_ingestion += hooks.store_upload_files  # pylint: disable=E1101
+    APP.on_updated_ingestion_files += hooks.update_job_counters  # pylint: disable=E1101
 
     # Data Hooks
     APP.on_insert_data += hooks.serialize_objectids  # pylint: disable=E1101
@@ -455,11 +867,21 @@ def add_hooks():
     APP.on_post_DELETE += hooks.log_delete_request  # pylint: disable=E1101
 
 
+def reconcile_indexes():
+    """
+    Checks the database's indexes against the declared ones without delaying startup.
+    """
+    if INDEX_RECONCILE in (indexes.CREATE, indexes.REPORT):
+        indexes.reconcile_in_background(APP, create=INDEX_RECONCILE == indexes.CREATE)
+
+
 if __name__ == "__main__":
     configure_logging()
     add_hooks()
+    reconcile_indexes()
     APP.run(host="0.0.0.0", port=5000)
 
 if __name__ != "__main__":
     configure_logging()
     add_hooks()
+    reconcile_indexes()
@@ -0,0 +1,112 @@
+"""
+Storage of the files of upload jobs in their own collection, one document per file
+keyed by job and file name, with per-status counters kept on the job.
+"""
+import datetime
+from typing import List
+
+from bson import ObjectId
+from pymongo.errors import BulkWriteError
+
+FILES_COLLECTION = "ingestion_files"
+# Counter on the job for each progress value a file can have.
+PROGRESS_COUNTERS = {
+    "In Progress": "files_in_progress",
+    "Completed": "files_completed",
+    "Aborted": "files_aborted",
+}
+DUPLICATE_KEY = 11000
+# Fields of a file document that are not part of the file entry.
+STORAGE_FIELDS = ("_id", "job", "started_by", "_created", "_updated", "_etag")
+
+
+def file_documents(job_id: ObjectId, started_by: str, files: List[dict]) -> List[dict]:
+    """
+    Turns the file entries of a job into documents of the files collection.
+
+    Arguments:
+        job_id {ObjectId} -- Id of the job.
+        started_by {str} -- Email of the user who started the job.
+        files {List[dict]} -- File entries.
+
+    Returns:
+        List[dict] -- Documents to insert.
+    """
+    now = datetime.datetime.utcnow().replace(microsecond=0)
+    return [
+        dict(entry, job=job_id, started_by=started_by, _created=now, _updated=now)
+        for entry in files
+    ]
+
+
+def insert_files(collection, documents: List[dict]) -> List[int]:
+    """
+    Inserts file documents in one unordered bulk write.
+
+    Arguments:
+        collection {pymongo.collection.Collection} -- The files collection.
+        documents {List[dict]} -- Documents from file_documents.
+
+    Raises:
+        BulkWriteError -- If a write failed for another reason than a file already in
+            the job.
+
+    Returns:
+        List[int] -- Positions of the documents not inserted because the job already
+            has a file of that name.
+    """
+    if not documents:
+        return []
+    try:
+        collection.insert_many(documents, ordered=False)
+    except BulkWriteError as error:
+        write_errors = error.details["writeErrors"]
+        if any(write_error["code"] != DUPLICATE_KEY for write_error in write_errors):
+            raise
+        return sorted(write_error["index"] for write_error in write_errors)
+    return []
+
+
+def counter_updates(old_progress: str, new_progress: str) -> dict:
+    """
+    Arguments:
+        old_progress {str} -- Progress of a file before an update, or None.
+        new_progress {str} -- Progress after it, or None.
+
+    Returns:
+        dict -- $inc on the job's counters, empty if nothing changed.
+    """
+    if old_progress == new_progress:
+        return {}
+    increments = {}
+    if old_progress in PROGRESS_COUNTERS:
+        increments[PROGRESS_COUNTERS[old_progress]] = -1
+    if new_progress in PROGRESS_COUNTERS:
+        increments[PROGRESS_COUNTERS[new_progress]] = 1
+    return increments
+
+
+def job_files(collection, job_id: ObjectId) -> List[dict]:
+    """
+    Reads back the file entries of a job, as they were posted, with their status.
+
+    Arguments:
+        collection {pymongo.collection.Collection} -- The files collection.
+        job_id {ObjectId} -- Id of the job.
+
+    Returns:
+        List[dict] -- File entries, in the order they were stored.
+    """
+    projection = {field: 0 for field in STORAGE_FIELDS}
+    return list(collection.find({"job": job_id}, projection=projection).sort("_id", 1))
+
+
+def files_href(job_id: ObjectId) -> str:
+    """
+    Arguments:
+        job_id {ObjectId} -- Id of the job.
+
+    Returns:
+        str -- Path under which the job's files are paged.
+    """
+    return "ingestion/%s/files" % job_id
@@ -0,0 +1,164 @@
+"""
+Streaming ingestion of NDJSON file entries. Each line is validated as soon as it is
+read, and valid entries are checked for trial locks and duplicates and written in
+batches, so memory use does not grow with the size of the manifest.
+"""
+import json
+from typing import Callable, Iterable, Iterator, List, Optional, Set, Tuple
+
+from bson import ObjectId
+
+LOCKED_MESSAGE = "This trial has been locked, you may not upload files to it"
+DUPLICATE_MESSAGE = "Duplicate file, it has already been uploaded"
+IN_JOB_MESSAGE = "Duplicate file, the job already has a file of this name"
+
+
+def read_lines(stream, max_line_bytes: int) -> Iterator[Tuple[int, Optional[bytes]]]:
+    """
+    Reads the non-blank lines of a stream without holding more than one line.
+
+    Arguments:
+        stream {io.BufferedIOBase} -- Request body.
+        max_line_bytes {int} -- Longest line accepted.
+
+    Returns:
+        Iterator[Tuple[int, Optional[bytes]]] -- Line number and line, or None for a
+            line that was too long and skipped.
+    """
+    line_no = 0
+    while True:
+        line = stream.readline(max_line_bytes + 1)
+        if not line:
+            return
+        line_no += 1
+        if len(line) > max_line_bytes and not line.endswith(b"\n"):
+            while line and not line.endswith(b"\n"):
+                line = stream.readline(max_line_bytes + 1)
+            yield line_no, None
+        elif line.strip():
+            yield line_no, line
+
+
+def normalize_ids(entry: dict) -> None:
+    """
+    Converts the trial and assay of an entry to ObjectIds, as Eve does before it
+    validates a request. Values that are not ids are left for validation to reject.
+
+    Arguments:
+        entry {dict} -- File entry.
+    """
+    for field in ("trial", "assay"):
+        if isinstance(entry.get(field), str) and ObjectId.is_valid(entry[field]):
+            entry[field] = ObjectId(entry[field])
+
+
+def _error(line_no: int, issues: dict) -> dict:
+    return {"_line": line_no, "_status": "ERR", "_issues": issues}
+
+
+def _check_batch(
+    batch: List[Tuple[int, dict]],
+    find_locked: Callable[[Iterable[ObjectId]], Set[ObjectId]],
+    find_duplicates: Callable[[List[dict]], Iterable[Tuple[ObjectId, ObjectId, str]]],
+    write_batch: Callable[[List[dict]], Optional[List[int]]],
+) -> Tuple[int, List[dict]]:
+    """
+    Writes the entries of a batch that are not in locked trials or already uploaded,
+    and returns how many were written and errors for the others.
+    """
+    locked = find_locked({entry["trial"] for _, entry in batch})
+    errors, unlocked = [], []
+    for line_no, entry in batch:
+        if entry["trial"] in locked:
+            errors.append(_error(line_no, {"trial": LOCKED_MESSAGE}))
+        else:
+            unlocked.append((line_no, entry))
+
+    duplicates = set(find_duplicates([entry for _, entry in unlocked]))
+    accepted = []
+    for line_no, entry in unlocked:
+        if (entry["trial"], entry["assay"], entry["file_name"]) in duplicates:
+            errors.append(_error(line_no, {"file_name": DUPLICATE_MESSAGE}))
+        else:
+            accepted.append((line_no, entry))
+    if not accepted:
+        return 0, errors
+
+    not_written = write_batch([entry for _, entry in accepted]) or []
+    for index in not_written:
+        errors.append(_error(accepted[index][0], {"file_name": IN_JOB_MESSAGE}))
+    return len(accepted) - len(not_written), errors
+
+
+def ingest(
+    lines: Iterable[Tuple[int, Optional[bytes]]],
+    validate: Callable[[dict], Optional[dict]],
+    find_locked: Callable[[Iterable[ObjectId]], Set[ObjectId]],
+    find_duplicates: Callable[[List[dict]], Iterable[Tuple[ObjectId, ObjectId, str]]],
+    write_batch: Callable[[List[dict]], Optional[List[int]]],
+    batch_size: int = 500,
+) -> Iterator[dict]:
+    """
+    Validates file entries line by line and writes the valid ones in batches. Errors
+    in a line are yielded as soon as the line is read, lock and duplicate errors once
+    its batch is checked, and a summary comes last.
+
+    Arguments:
+        lines {Iterable[Tuple[int, Optional[bytes]]]} -- Lines, as from read_lines.
+        validate {Callable[[dict], Optional[dict]]} -- Returns the schema errors of an
+            entry, or None.
+        find_locked {Callable[[Iterable[ObjectId]], Set[ObjectId]]} -- Returns the
+            locked trials among some trials.
+        find_duplicates {Callable} -- Returns (trial, assay, file_name) of the
+            entries already uploaded.
+        write_batch {Callable[[List[dict]], Optional[List[int]]]} -- Stores entries,
+            and returns the positions of the ones the job already has a file for.
+
+    Keyword Arguments:
+        batch_size {int} -- Entries checked and written together. (default: {500})
+
+    Returns:
+        Iterator[dict] -- Errors as {"_line", "_status", "_issues"}, then a summary
+            with the number of entries accepted and rejected.
+    """
+    accepted = rejected = 0
+    batch = []
+    for line_no, line in lines:
+        if line is None:
+            rejected += 1
+            yield _error(line_no, {"_line": "Line is too long"})
+            continue
+        try:
+            entry = json.loads(line)
+        except ValueError:
+            rejected += 1
+            yield _error(line_no, {"_line": "Line is not valid JSON"})
+            continue
+        if not isinstance(entry, dict):
+            rejected += 1
+            yield _error(line_no, {"_line": "Line is not a JSON object"})
+            continue
+
+        normalize_ids(entry)
+        issues = validate(entry)
+        if issues:
+            rejected += 1
+            yield _error(line_no, issues)
+            continue
+
+        batch.append((line_no, entry))
+        if len(batch) >= batch_size:
+            written, errors = _check_batch(
+                batch, find_locked, find_duplicates, write_batch
+            )
+            batch = []
+            accepted += written
+            rejected += len(errors)
+            yield from errors
+
+    if batch:
+        written, errors = _check_batch(batch, find_locked, find_duplicates, write_batch)
+        accepted += written
+        rejected += len(errors)
+        yield from errors
+    yield {"_status": "OK", "accepted": accepted, "rejected": rejected}
@@ -0,0 +1,101 @@
+"""
+Streaming download manifests: rows of file metadata with signed download links,
+written as NDJSON or TSV while the cursor is read.
+"""
+import json
+from collections import deque
+from concurrent.futures import Executor
+from typing import Callable, Iterable, Iterator, List
+
+from bson import json_util
+
+MANIFEST_FIELDS = [
+    "_id",
+    "file_name",
+    "data_format",
+    "file_size",
+    "trial",
+    "assay",
+    "gs_uri",
+    "download_link",
+]
+CONTENT_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "tsv": "text/tab-separated-values",
+}
+PROJECTION = {field: 1 for field in MANIFEST_FIELDS if field != "download_link"}
+
+
+def _chunks(records: Iterable[dict], size: int) -> Iterator[List[dict]]:
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _sign_chunk(chunk: List[dict], sign_batch: Callable) -> List[dict]:
+    links = sign_batch([record["gs_uri"] for record in chunk])
+    for record, link in zip(chunk, links):
+        record["download_link"] = link
+    return chunk
+
+
+def _format(record: dict, output_format: str) -> str:
+    if output_format == "tsv":
+        return (
+            "\t".join(
+                str(record.get(field, "")).replace("\t", " ").replace("\n", " ")
+                for field in MANIFEST_FIELDS
+            )
+            + "\n"
+        )
+    row = {field: record[field] for field in MANIFEST_FIELDS if field in record}
+    return json.dumps(row, default=json_util.default) + "\n"
+
+
+def stream_manifest(
+    records: Iterable[dict],
+    sign_batch: Callable[[List[str]], List[str]],
+    executor: Executor,
+    output_format: str = "ndjson",
+    chunk_size: int = 200,
+    max_in_flight: int = 4,
+) -> Iterator[str]:
+    """
+    Signs download links for records in chunks on a worker pool and yields manifest
+    lines in the order of the records. At most `max_in_flight` chunks are read ahead,
+    so memory use does not grow with the number of records.
+
+    Arguments:
+        records {Iterable[dict]} -- Data records, usually a Mongo cursor.
+        sign_batch {Callable[[List[str]], List[str]]} -- Signs the links of a list of
+            gs_uris.
+        executor {Executor} -- Pool the chunks are signed on.
+
+    Keyword Arguments:
+        output_format {str} -- "ndjson" or "tsv". (default: {"ndjson"})
+        chunk_size {int} -- Records signed per batch. (default: {200})
+        max_in_flight {int} -- Chunks being signed at once. (default: {4})
+
+    Returns:
+        Iterator[str] -- Manifest lines, starting with a header for TSV.
+    """
+    if output_format == "tsv":
+        yield "\t".join(MANIFEST_FIELDS) + "\n"
+
+    in_flight = deque()
+    for chunk in _chunks(records, chunk_size):
+        in_flight.append(executor.submit(_sign_chunk, chunk, sign_batch))
+        if len(in_flight) >= max_in_flight:
+            yield "".join(
+                _format(record, output_format)
+                for record in in_flight.popleft().result()
+            )
+    while in_flight:
+        yield "".join(
+            _format(record, output_format) for record in in_flight.popleft().result()
+        )
@@ -0,0 +1,121 @@
+"""
+In-process metrics for the API's hot paths, published as structured logs.
+"""
+import bisect
+import logging
+import threading
+
+# Upper bounds of the latency buckets, in milliseconds.
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+
+# Upper bounds of the buckets of sizes, e.g. of the number of ids in a query.
+SIZE_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000)
+
+
+class Histogram:
+    """
+    Cumulative histogram of observed values with fixed buckets.
+    """
+
+    def __init__(self, name: str, buckets: tuple = SIZE_BUCKETS, suffix: str = ""):
+        """
+        Arguments:
+            name {str} -- Name the histogram is published under.
+
+        Keyword Arguments:
+            buckets {tuple} -- Upper bounds of the buckets. (default: {SIZE_BUCKETS})
+            suffix {str} -- Unit suffix of the summary statistics. (default: {""})
+        """
+        self.name = name
+        self.buckets = buckets
+        self.suffix = suffix
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        """
+        Records one value.
+
+        Arguments:
+            value {float} -- Observed value.
+        """
+        with self._lock:
+            self.counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.count += 1
+            self.total += value
+            self.max = max(self.max, value)
+
+    def percentile(self, fraction: float) -> float:
+        """
+        Estimates a percentile as the upper bound of the bucket it falls in.
+
+        Arguments:
+            fraction {float} -- Percentile as a fraction, e.g. 0.95.
+
+        Returns:
+            float -- The value.
+        """
+        if not self.count:
+            return 0.0
+        rank = fraction * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return self.buckets[index] if index < len(self.buckets) else self.max
+        return self.max
+
+    def snapshot(self) -> dict:
+        """
+        Returns:
+            dict -- Counts per bucket and summary statistics.
+        """
+        with self._lock:
+            labels = ["<=%s" % bound for bound in self.buckets] + [
+                ">%s" % self.buckets[-1]
+            ]
+            return {
+                "name": self.name,
+                "count": self.count,
+                "mean" + self.suffix: self.total / self.count if self.count else 0.0,
+                "max" + self.suffix: self.max,
+                "p50" + self.suffix: self.percentile(0.5),
+                "p95" + self.suffix: self.percentile(0.95),
+                "buckets": dict(zip(labels, self.counts)),
+            }
+
+    def log(self) -> None:
+        """
+        Publishes a snapshot as a structured log.
+        """
+        logging.info({"message": self.snapshot(), "category": "INFO-EVE-METRICS"})
+
+
+class LatencyHistogram(Histogram):
+    """
+    Histogram of operation latencies with fixed millisecond buckets.
+    """
+
+    def __init__(self, name: str, buckets: tuple = LATENCY_BUCKETS_MS):
+        """
+        Arguments:
+            name {str} -- Name the histogram is published under.
+
+        Keyword Arguments:
+            buckets {tuple} -- Upper bounds of the buckets in milliseconds.
+                (default: {LATENCY_BUCKETS_MS})
+        """
+        super().__init__(name, buckets, suffix="_ms")
+
+    def observe(self, seconds: float) -> None:
+        """
+        Records one latency.
+
+        Arguments:
+            seconds {float} -- Duration of the operation.
+        """
+        super().observe(seconds * 1000)
@@ -0,0 +1,499 @@
+"""
+Transactional outbox for celery tasks: hooks write tasks to Mongo inside the request
+and a background dispatcher publishes them to the broker.
+"""
+import datetime
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from typing import List
+
+from bson import json_util
+from pymongo import ASCENDING
+from pymongo.errors import DuplicateKeyError, PyMongoError
+
+from task_payloads import JSON, check_serializer, encode
+from task_queue import TaskPublisher
+
+PENDING = "pending"
+DISPATCHING = "dispatching"
+FAILED = "failed"
+
+
+def task_key(task: str, arguments: List[object]) -> str:
+    """
+    Identifies a task by its name and arguments, so that the same task is only queued
+    once while it waits to be dispatched.
+
+    Arguments:
+        task {str} -- Name of the task.
+        arguments {List[object]} -- Arguments of the task.
+
+    Returns:
+        str -- Hex digest.
+    """
+    canonical = json.dumps([task, arguments], sort_keys=True, default=json_util.default)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def _now() -> datetime.datetime:
+    return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+
+
+class TaskOutbox:
+    """
+    Queues task messages in the task_outbox collection and drains them to the broker
+    in batches from a background thread. A failed publish is retried with exponential
+    backoff until `max_attempts` is reached, after which the task is kept with status
+    "failed" for inspection. Tasks claimed by a worker that died are picked up again
+    once their lease runs out.
+    """
+
+    def __init__(
+        self,
+        publisher: TaskPublisher,
+        interval: float = 5,
+        batch_size: int = 100,
+        max_attempts: int = 10,
+        backoff: float = 2,
+        max_backoff: float = 300,
+        lease: float = 60,
+        serializer: str = JSON,
+        send_targets: bool = False,
+        log_every: int = 100,
+        log_interval: float = 60,
+    ):
+        """
+        Arguments:
+            publisher {TaskPublisher} -- Publisher used to reach the broker.
+
+        Keyword Arguments:
+            interval {float} -- Seconds between dispatches when idle. (default: {5})
+            batch_size {int} -- Tasks claimed per batch. (default: {100})
+            max_attempts {int} -- Publish attempts before a task is marked failed.
+                (default: {10})
+            backoff {float} -- Seconds before the first retry, doubled on each
+                attempt. (default: {2})
+            max_backoff {float} -- Longest wait between retries. (default: {300})
+            lease {float} -- Seconds a claimed task is reserved for one worker.
+                (default: {60})
+            serializer {str} -- Serializer of the messages, "json" or "msgpack".
+                (default: {JSON})
+            send_targets {bool} -- Send coalesced tasks their targets, which the
+                tasks must accept as a keyword argument. (default: {False})
+            log_every {int} -- Requests of a coalesced task between logs of its
+                counters. (default: {100})
+            log_interval {float} -- Seconds between logs of the stats, made by the
+                dispatch thread. (default: {60})
+
+        Raises:
+            ValueError -- If the serializer is not available.
+        """
+        check_serializer(serializer)
+        self.publisher = publisher
+        self.interval = interval
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.lease = lease
+        self.serializer = serializer
+        self.send_targets = send_targets
+        self.log_every = log_every
+        self.log_interval = log_interval
+        self.collection = None
+        self.enqueued = 0
+        self.deduplicated = 0
+        self.coalesced = 0
+        self.dispatched = 0
+        self.retried = 0
+        self.failed = 0
+        self.triggers = {}
+        self._indexed = set()
+        self._lock = threading.Lock()
+        self._kick = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._pid = None
+
+    def enqueue(
+        self, collection, task: str, arguments: List[object], task_id: int
+    ) -> bool:
+        """
+        Writes a task to the outbox, unless the same task is already waiting there.
+
+        Arguments:
+            collection {pymongo.collection.Collection} -- The task_outbox collection.
+            task {str} -- Name of the task.
+            arguments {List[object]} -- Arguments of the task.
+            task_id {int} -- Id sent with the task message.
+
+        Returns:
+            bool -- False if the task was already queued.
+        """
+        self._ensure_dispatcher(collection)
+        now = _now()
+        try:
+            result = collection.update_one(
+                {"key": task_key(task, arguments), "status": PENDING},
+                {"$setOnInsert": self._new_task(task, arguments, task_id, now)},
+                upsert=True,
+            )
+            inserted = result.upserted_id is not None
+        except DuplicateKeyError:
+            inserted = False
+
+        if inserted:
+            self.enqueued += 1
+            self._kick.set()
+        else:
+            self.deduplicated += 1
+        return inserted
+
+    def coalesce(
+        self,
+        collection,
+        task: str,
+        targets: List[dict],
+        task_id: int,
+        window: float,
+    ) -> bool:
+        """
+        Requests a task that acts on a set of targets. Requests made while one is
+        waiting out its window are merged into it, and the task is sent once, with the
+        union of their targets in its "targets" keyword argument if send_targets is
+        set.
+
+        Arguments:
+            collection {pymongo.collection.Collection} -- The task_outbox collection.
+            task {str} -- Name of the task.
+            targets {List[dict]} -- Targets of this request.
+            task_id {int} -- Id sent with the task message.
+            window {float} -- Seconds the first request waits to collect others.
+
+        Returns:
+            bool -- False if the request was merged into a waiting one.
+        """
+        self._ensure_dispatcher(collection)
+        now = _now()
+        new_task = self._new_task(task, [], task_id, now)
+        new_task["next_attempt"] = now + datetime.timedelta(seconds=window)
+        update = {
+            "$setOnInsert": new_task,
+            "$addToSet": {"targets": {"$each": targets}},
+            "$inc": {"requests": 1},
+        }
+        key = task_key(task, ["coalesced"])
+        try:
+            result = collection.update_one(
+                {"key": key, "status": PENDING}, update, upsert=True
+            )
+        except DuplicateKeyError:
+            # Another worker created the waiting request first.
+            result = collection.update_one({"key": key, "status": PENDING}, update)
+
+        inserted = result.upserted_id is not None
+        with self._lock:
+            counts = self.triggers.setdefault(task, {"requests": 0, "coalesced": 0})
+            counts["requests"] += 1
+            if inserted:
+                self.enqueued += 1
+            else:
+                self.coalesced += 1
+                counts["coalesced"] += 1
+            log = self.log_every and not counts["requests"] % self.log_every
+            message = dict(counts, task=task)
+        if log:
+            logging.info({"message": message, "category": "INFO-EVE-METRICS"})
+        return inserted
+
+    @staticmethod
+    def _new_task(
+        task: str, arguments: List[object], task_id: int, now: datetime.datetime
+    ) -> dict:
+        """
+        Returns:
+            dict -- Fields of a newly queued task.
+        """
+        return {
+            "task": task,
+            "payload": {
+                "id": task_id,
+                "task": task,
+                "args": arguments,
+                "kwargs": {},
+                "retries": 0,
+            },
+            "attempts": 0,
+            "created": now,
+            "next_attempt": now,
+        }
+
+    def _encode(self, doc: dict) -> tuple:
+        """
+        Returns:
+            tuple -- Body, content type and content encoding of the message to publish
+                for a queued task.
+        """
+        payload = doc["payload"]
+        if "targets" in doc:
+            if self.send_targets:
+                payload["kwargs"]["targets"] = doc["targets"]
+            log = "%s requested %s times for %s targets" % (
+                doc["task"],
+                doc["requests"],
+                len(doc["targets"]),
+            )
+            logging.info({"message": log, "category": "INFO-EVE-CELERY"})
+        return encode(payload, self.serializer)
+
+    def _claim(self, collection) -> list:
+        """
+        Reserves a batch of due tasks for this worker.
+
+        Arguments:
+            collection {pymongo.collection.Collection} -- The task_outbox collection.
+
+        Returns:
+            list -- Claimed task documents, oldest first.
+        """
+        now = _now()
+        due = {
+            "$or": [
+                {"status": PENDING, "next_attempt": {"$lte": now}},
+                {"status": DISPATCHING, "lease_until": {"$lte": now}},
+            ]
+        }
+        candidates = [
+            doc["_id"]
+            for doc in collection.find(due, {"_id": 1})
+            .sort("created", ASCENDING)
+            .limit(self.batch_size)
+        ]
+        if not candidates:
+            return []
+
+        claim = uuid.uuid4().hex
+        lease_until = now + datetime.timedelta(seconds=self.lease)
+        collection.update_many(
+            {"$and": [{"_id": {"$in": candidates}}, due]},
+            {
+                "$set": {
+                    "status": DISPATCHING,
+                    "claim": claim,
+                    "lease_until": lease_until,
+                }
+            },
+        )
+        return list(collection.find({"claim": claim}).sort("created", ASCENDING))
+
+    def _retry(self, collection, doc: dict, error: Exception) -> None:
+        """
+        Schedules another attempt at a task, or marks it failed.
+        """
+        attempts = doc["attempts"] + 1
+        if attempts >= self.max_attempts:
+            self.failed += 1
+            update = {"status": FAILED, "attempts": attempts, "last_error": str(error)}
+            log = "Task %s failed after %s attempts" % (doc["task"], attempts)
+            logging.error({"message": log, "category": "ERROR-EVE-CELERY"})
+        else:
+            self.retried += 1
+            delay = min(self.backoff * 2 ** (attempts - 1), self.max_backoff)
+            update = {
+                "status": PENDING,
+                "attempts": attempts,
+                "last_error": str(error),
+                "next_attempt": _now() + datetime.timedelta(seconds=delay),
+            }
+        try:
+            collection.update_one(
+                {"_id": doc["_id"], "claim": doc["claim"]},
+                {"$set": update, "$unset": {"claim": "", "lease_until": ""}},
+            )
+        except DuplicateKeyError:
+            # The same task was queued again meanwhile, that copy will be dispatched.
+            if "targets" in doc:
+                collection.update_one(
+                    {"key": doc["key"], "status": PENDING},
+                    {
+                        "$addToSet": {"targets": {"$each": doc["targets"]}},
+                        "$inc": {"requests": doc["requests"]},
+                    },
+                )
+            collection.delete_one({"_id": doc["_id"]})
+
+    @staticmethod
+    def _release(collection, docs: list) -> None:
+        """
+        Hands claimed tasks back by ending their lease, without counting an attempt.
+        """
+        if docs:
+            collection.update_many(
+                {"_id": {"$in": [doc["_id"] for doc in docs]}},
+                {"$set": {"lease_until": _now()}, "$unset": {"claim": ""}},
+            )
+
+    def dispatch(self) -> int:
+        """
+        Publishes due tasks until the outbox is drained or the broker fails.
+
+        Returns:
+            int -- Number of tasks published.
+        """
+        collection = self.collection
+        if collection is None:
+            return 0
+
+        published = 0
+        try:
+            while True:
+                batch = self._claim(collection)
+                if not batch:
+                    break
+                sent = []
+                for index, doc in enumerate(batch):
+                    try:
+                        body, content_type, content_encoding = self._encode(doc)
+                        self.publisher.publish(
+                            body,
+                            content_type=content_type,
+                            content_encoding=content_encoding,
+                        )
+                    except Exception as error:  # pylint: disable=broad-except
+                        self._retry(collection, doc, error)
+                        self._release(collection, batch[index + 1 :])
+                        break
+                    sent.append(doc["_id"])
+                if sent:
+                    collection.delete_many({"_id": {"$in": sent}})
+                    published += len(sent)
+                    self.dispatched += len(sent)
+                if len(sent) < len(batch):
+                    break
+        except PyMongoError:
+            logging.error(
+                {
+                    "message": "Failed to dispatch the task outbox",
+                    "category": "ERROR-EVE-CELERY",
+                },
+                exc_info=True,
+            )
+
+        if published:
+            log = "Dispatched %s tasks from the outbox" % published
+            logging.info({"message": log, "category": "INFO-EVE-CELERY"})
+        return published
+
+    def stats(self) -> dict:
+        """
+        Returns:
+            dict -- Backlog size and age, and this worker's counters.
+        """
+        stats = {
+            "enqueued": self.enqueued,
+            "deduplicated": self.deduplicated,
+            "coalesced": self.coalesced,
+            "dispatched": self.dispatched,
+            "retried": self.retried,
+            "failed": self.failed,
+            "triggers": {task: dict(counts) for task, counts in self.triggers.items()},
+        }
+        if self.collection is not None:
+            stats["pending"] = self.collection.count_documents(
+                {"status": {"$in": [PENDING, DISPATCHING]}}
+            )
+            stats["failed_backlog"] = self.collection.count_documents(
+                {"status": FAILED}
+            )
+            oldest = self.collection.find_one(
+                {"status": {"$in": [PENDING, DISPATCHING]}},
+                sort=[("created", ASCENDING)],
+            )
+            stats["oldest_age"] = (
+                (_now() - oldest["created"]).total_seconds() if oldest else 0
+            )
+        return stats
+
+    def log(self) -> None:
+        """
+        Publishes the stats as a structured log.
+        """
+        try:
+            stats = self.stats()
+        except PyMongoError:
+            logging.error(
+                {
+                    "message": "Failed to read the task outbox stats",
+                    "category": "ERROR-EVE-CELERY",
+                },
+                exc_info=True,
+            )
+            return
+        logging.info({"message": stats, "category": "INFO-EVE-METRICS"})
+
+    def _ensure_indexes(self, collection) -> None:
+        """
+        Creates the outbox's indexes once per collection.
+        """
+        if collection.full_name in self._indexed:
+            return
+        collection.create_index(
+            [("key", ASCENDING)],
+            unique=True,
+            partialFilterExpression={"status": PENDING},
+        )
+        collection.create_index([("status", ASCENDING), ("next_attempt", ASCENDING)])
+        collection.create_index([("claim", ASCENDING)], sparse=True)
+        self._indexed.add(collection.full_name)
+
+    def _ensure_dispatcher(self, collection) -> None:
+        """
+        Records the collection and starts the dispatch thread, again in each forked
+        worker.
+        """
+        self.collection = collection
+        if self._pid == os.getpid() and self._thread and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._thread and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def _run(self) -> None:
+        """
+        Dispatches whenever a task is queued, and at least every interval. Logs the
+        stats every log_interval.
+        """
+        logged = time.monotonic()
+        while not self._stopped.is_set():
+            try:
+                self._ensure_indexes(self.collection)
+            except PyMongoError:
+                logging.error(
+                    {
+                        "message": "Failed to create task outbox indexes",
+                        "category": "ERROR-EVE-CELERY",
+                    },
+                    exc_info=True,
+                )
+            self.dispatch()
+            if self.log_interval and time.monotonic() - logged >= self.log_interval:
+                logged = time.monotonic()
+                self.log()
+            self._kick.wait(self.interval)
+            self._kick.clear()
+
+    def stop(self) -> None:
+        """
+        Stops the dispatch thread and publishes what is due.
+        """
+        self._stopped.set()
+        self._kick.set()
+        self.dispatch()
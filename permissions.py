@@ -0,0 +1,288 @@
+"""
+Compilation of a user's permissions into the query condition on trial and assay that
+every GET on a biomarker resource is filtered by, and a cache of compiled conditions
+shared between workers.
+"""
+import copy
+import logging
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, List, Tuple
+
+from bson import json_util
+from redis import RedisError
+
+from auth_cache import TokenCache
+from metrics import Histogram, LatencyHistogram
+
+# Query condition no document meets.
+MATCH_NOTHING = {"_id": {"$in": []}}
+# Roles that give read access to every document of a trial or of an assay.
+TRIAL_WIDE = "trial_r"
+ASSAY_WIDE = "assay_r"
+# Role that gives read access to the documents of one trial and assay.
+PAIR = "read"
+
+
+def may_read(document: dict, permissions: List[dict]) -> bool:
+    """
+    The access rule compile_permissions encodes: a document can be read with read on
+    its trial and assay, with trial_r on its trial or with assay_r on its assay. Write
+    roles give no read access.
+
+    Arguments:
+        document {dict} -- Document with trial and assay.
+        permissions {List[dict]} -- User's permissions list.
+
+    Returns:
+        bool -- True if the user may read the document.
+    """
+    for permission in permissions:
+        trial_match = document.get("trial") == permission["trial"]
+        assay_match = document.get("assay") == permission["assay"]
+        if trial_match and assay_match and permission["role"] == PAIR:
+            return True
+        if trial_match and permission["role"] == TRIAL_WIDE:
+            return True
+        if assay_match and permission["role"] == ASSAY_WIDE:
+            return True
+    return False
+
+
+def _equals_or_in(values: list):
+    return values[0] if len(values) == 1 else {"$in": values}
+
+
+def _group(pairs: Iterable[Tuple[object, object]], key: int) -> Dict[object, list]:
+    groups = OrderedDict()
+    for pair in pairs:
+        groups.setdefault(pair[key], []).append(pair[1 - key])
+    return groups
+
+
+def compile_permissions(permissions: List[dict]) -> dict:
+    """
+    Compiles permissions into a query condition matching the documents may_read
+    allows. Trial-wide and assay-wide grants become one $in each, and the remaining
+    (trial, assay) read grants are grouped under whichever field gives fewer branches.
+    Grants already covered by a trial-wide or assay-wide grant, and repeated grants,
+    are dropped. Every branch is an equality or $in on trial and assay, so it can use
+    the (trial, assay) indexes.
+
+    Arguments:
+        permissions {List[dict]} -- User's permissions list.
+
+    Returns:
+        dict -- Query condition, MATCH_NOTHING if the user may read nothing.
+    """
+    trials = OrderedDict()
+    assays = OrderedDict()
+    for permission in permissions:
+        if permission["role"] == TRIAL_WIDE:
+            trials[permission["trial"]] = None
+        elif permission["role"] == ASSAY_WIDE:
+            assays[permission["assay"]] = None
+
+    pairs = OrderedDict(
+        ((permission["trial"], permission["assay"]), None)
+        for permission in permissions
+        if permission["role"] == PAIR
+        and permission["trial"] not in trials
+        and permission["assay"] not in assays
+    )
+
+    branches = []
+    if trials:
+        branches.append({"trial": _equals_or_in(list(trials))})
+    if assays:
+        branches.append({"assay": _equals_or_in(list(assays))})
+    by_trial, by_assay = _group(pairs, 0), _group(pairs, 1)
+    if len(by_assay) < len(by_trial):
+        branches.extend(
+            {"assay": assay, "trial": _equals_or_in(group)}
+            for assay, group in by_assay.items()
+        )
+    else:
+        branches.extend(
+            {"trial": trial, "assay": _equals_or_in(group)}
+            for trial, group in by_trial.items()
+        )
+
+    if not branches:
+        return copy.deepcopy(MATCH_NOTHING)
+    if len(branches) == 1:
+        return branches[0]
+    return {"$or": branches}
+
+
+def filter_size(condition) -> int:
+    """
+    Arguments:
+        condition {object} -- Compiled condition, or part of one.
+
+    Returns:
+        int -- Number of trial and assay values in the condition.
+    """
+    if isinstance(condition, dict):
+        return sum(filter_size(value) for value in condition.values())
+    if isinstance(condition, list):
+        return sum(filter_size(value) for value in condition)
+    return 1
+
+
+class PermissionFilterCache:
+    """
+    Compiled permission conditions per user, in Redis so workers share them and in a
+    local TokenCache in front of it. Each user has a version counter in Redis, bumped
+    by invalidate when their account changes, and an entry is only used while its
+    version is current. Reading the counter and the shared entry is one MGET.
+    """
+
+    def __init__(
+        self,
+        ttl: int = 3600,
+        maxsize: int = 1024,
+        prefix: str = "permfilter:",
+        log_every: int = 1000,
+    ):
+        """
+        Keyword Arguments:
+            ttl {int} -- Seconds a compiled condition is kept. (default: {3600})
+            maxsize {int} -- Size of the local tier. (default: {1024})
+            prefix {str} -- Prefix of the Redis keys. (default: {"permfilter:"})
+            log_every {int} -- Lookups between logs of the metrics. (default: {1000})
+        """
+        self.ttl = ttl
+        self.prefix = prefix
+        self.log_every = log_every
+        self.local = TokenCache(maxsize=maxsize)
+        self.lookups = 0
+        self.local_hits = 0
+        self.shared_hits = 0
+        self.compiles = 0
+        self.lookup_latency = LatencyHistogram("permission_filter_lookup")
+        self.compile_latency = LatencyHistogram("permission_filter_compile")
+        self.size = Histogram("permission_filter_size")
+
+    def _keys(self, email: str) -> Tuple[str, str]:
+        return self.prefix + "version:" + email, self.prefix + email
+
+    def get(self, redis_client, email: str, load: Callable[[], List[dict]]) -> dict:
+        """
+        Returns a user's compiled condition, compiling it on a miss.
+
+        Arguments:
+            redis_client {redis.StrictRedis} -- Shared Redis connection.
+            email {str} -- User's email.
+            load {Callable[[], List[dict]]} -- Reads the user's current permissions.
+
+        Returns:
+            dict -- Condition from compile_permissions.
+        """
+        start = time.perf_counter()
+        version_key, filter_key = self._keys(email)
+        try:
+            version, shared = redis_client.mget(version_key, filter_key)
+        except RedisError:
+            logging.warning(
+                {
+                    "message": "Permission filter cache unavailable",
+                    "category": "WARNING-EVE-AUTH",
+                },
+                exc_info=True,
+            )
+            version = shared = None
+            available = False
+        else:
+            available = True
+        version = int(version or 0)
+
+        local = self.local.get(email) if available else None
+        if local and local[0] == version:
+            self.local_hits += 1
+            condition = local[1]
+        else:
+            entry = json_util.loads(shared) if shared else None
+            if entry and entry["version"] == version:
+                self.shared_hits += 1
+                condition = entry["filter"]
+            else:
+                condition = self._compile(load)
+                if available:
+                    self._store(redis_client, filter_key, version, condition)
+            if available:
+                self.local.put(email, (version, condition), time.time() + self.ttl)
+
+        self.lookup_latency.observe(time.perf_counter() - start)
+        self.size.observe(filter_size(condition))
+        self.lookups += 1
+        if self.log_every and not self.lookups % self.log_every:
+            self.log()
+        return copy.deepcopy(condition)
+
+    def _compile(self, load: Callable[[], List[dict]]) -> dict:
+        start = time.perf_counter()
+        condition = compile_permissions(load())
+        self.compile_latency.observe(time.perf_counter() - start)
+        self.compiles += 1
+        return condition
+
+    def _store(self, redis_client, filter_key: str, version: int, condition: dict):
+        try:
+            redis_client.set(
+                filter_key,
+                json_util.dumps({"version": version, "filter": condition}),
+                ex=self.ttl,
+            )
+        except RedisError:
+            logging.warning(
+                {
+                    "message": "Permission filter cache unavailable",
+                    "category": "WARNING-EVE-AUTH",
+                },
+                exc_info=True,
+            )
+
+    def invalidate(self, redis_client, email: str) -> None:
+        """
+        Makes every worker recompile a user's condition, by bumping their version.
+        Call it after the account change is written, so that a recompile reads the
+        new permissions.
+
+        Arguments:
+            redis_client {redis.StrictRedis} -- Shared Redis connection.
+            email {str} -- User's email.
+        """
+        self.local.discard(email)
+        try:
+            redis_client.incr(self._keys(email)[0])
+        except RedisError:
+            logging.error(
+                {
+                    "message": "Failed to invalidate the permission filter of %s"
+                    % email,
+                    "category": "ERROR-EVE-AUTH",
+                },
+                exc_info=True,
+            )
+
+    def stats(self) -> dict:
+        """
+        Returns:
+            dict -- Lookup counters, lookup and compile latencies and filter sizes.
+        """
+        return {
+            "lookups": self.lookups,
+            "local_hits": self.local_hits,
+            "shared_hits": self.shared_hits,
+            "compiles": self.compiles,
+            "lookup_latency": self.lookup_latency.snapshot(),
+            "compile_latency": self.compile_latency.snapshot(),
+            "size": self.size.snapshot(),
+        }
+
+    def log(self) -> None:
+        """
+        Publishes the stats as a structured log.
+        """
+        logging.info({"message": self.stats(), "category": "INFO-EVE-METRICS"})
@@ -0,0 +1,316 @@
+"""
+Command monitoring of the API's Mongo queries: latency per command, and for commands
+over a threshold the query shape, with literal values stripped, and a summary of the
+plan the server chose, so slow lookups and collection scans can be found.
+"""
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List
+
+from pymongo import monitoring
+from pymongo.errors import PyMongoError
+
+from metrics import LatencyHistogram
+
+# Field holding the query of each monitored command.
+QUERY_FIELDS = {
+    "find": "filter",
+    "aggregate": "pipeline",
+    "count": "query",
+    "distinct": "query",
+    "findAndModify": "query",
+    "update": "updates",
+    "delete": "deletes",
+}
+# Fields the driver adds to commands, which explain does not take.
+DRIVER_FIELDS = (
+    "lsid",
+    "$db",
+    "$clusterTime",
+    "$readPreference",
+    "txnNumber",
+    "readConcern",
+    "writeConcern",
+)
+LITERAL = "?"
+
+
+def query_shape(value):
+    """
+    Replaces the literal values of a query with "?". Lists keep one copy of each
+    distinct shape, so $in lists and $or branches of any length give the same shape.
+
+    Arguments:
+        value {object} -- Query, pipeline, or part of one.
+
+    Returns:
+        object -- The shape.
+    """
+    if isinstance(value, dict):
+        return {key: query_shape(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        shapes = []
+        for item in value:
+            shape = query_shape(item)
+            if shape not in shapes:
+                shapes.append(shape)
+        return shapes
+    return LITERAL
+
+
+def _find_planner(explain):
+    if isinstance(explain, dict):
+        if "queryPlanner" in explain:
+            return explain["queryPlanner"]
+        explain = list(explain.values())
+    if isinstance(explain, list):
+        for item in explain:
+            planner = _find_planner(item)
+            if planner is not None:
+                return planner
+    return None
+
+
+def _describe(stage: dict) -> str:
+    name = stage.get("stage", "UNKNOWN")
+    if stage.get("indexName"):
+        name += "(%s)" % stage["indexName"]
+    if "inputStage" in stage:
+        return "%s > %s" % (name, _describe(stage["inputStage"]))
+    if stage.get("inputStages"):
+        return "%s > [%s]" % (
+            name,
+            ", ".join(_describe(child) for child in stage["inputStages"]),
+        )
+    return name
+
+
+def plan_summary(explain: dict) -> str:
+    """
+    Summarizes the winning plan of an explain as its stages and index names, without
+    the index bounds, which hold the query's values.
+
+    Arguments:
+        explain {dict} -- Reply of an explain command.
+
+    Returns:
+        str -- E.g. "FETCH > IXSCAN(trial_assay)", or "UNKNOWN".
+    """
+    planner = _find_planner(explain)
+    if planner is None:
+        return "UNKNOWN"
+    plan = planner["winningPlan"]
+    return _describe(plan.get("queryPlan", plan))
+
+
+class SlowQueryMonitor(monitoring.CommandListener):
+    """
+    Records the latency of every command, and keeps per query shape the count and
+    latency of commands over the threshold. The first slow command of a shape, and
+    one per explain_interval after, is explained from a background thread.
+    """
+
+    def __init__(
+        self,
+        threshold_ms: float = 100,
+        explain: Callable[[str, dict], dict] = None,
+        explain_interval: float = 3600,
+        log_every: int = 10000,
+        max_shapes: int = 1000,
+        executor=None,
+    ):
+        """
+        Keyword Arguments:
+            threshold_ms {float} -- Latency from which a command is slow.
+                (default: {100})
+            explain {Callable[[str, dict], dict]} -- Runs an explain of a command on a
+                database, none if None. (default: {None})
+            explain_interval {float} -- Seconds between explains of a shape.
+                (default: {3600})
+            log_every {int} -- Commands between logs of the metrics.
+                (default: {10000})
+            max_shapes {int} -- Slow query shapes kept; further shapes are only
+                logged, as user filters can make any number. (default: {1000})
+            executor {concurrent.futures.Executor} -- Runs the explains.
+                (default: {a single thread})
+        """
+        self.threshold_ms = threshold_ms
+        self.explain = explain
+        self.explain_interval = explain_interval
+        self.log_every = log_every
+        self.max_shapes = max_shapes
+        self.executor = executor or ThreadPoolExecutor(max_workers=1)
+        self.commands = 0
+        self.latencies = {}
+        self.slow = {}
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    def started(self, event) -> None:
+        """
+        Keeps the monitored commands until they finish.
+        """
+        if event.command_name in QUERY_FIELDS:
+            self._in_flight[(event.connection_id, event.request_id)] = (
+                event.database_name,
+                event.command,
+            )
+
+    def succeeded(self, event) -> None:
+        """
+        Records a finished command.
+        """
+        self._finish(event)
+
+    def failed(self, event) -> None:
+        """
+        Records a failed command.
+        """
+        self._finish(event)
+
+    def _finish(self, event) -> None:
+        started = self._in_flight.pop((event.connection_id, event.request_id), None)
+        with self._lock:
+            latency = self.latencies.get(event.command_name)
+            if latency is None:
+                latency = self.latencies[event.command_name] = LatencyHistogram(
+                    "mongo_" + event.command_name
+                )
+            self.commands += 1
+            log = self.log_every and not self.commands % self.log_every
+        latency.observe(event.duration_micros / 1e6)
+        duration_ms = event.duration_micros / 1000
+        if started and duration_ms >= self.threshold_ms:
+            self._record_slow(event.command_name, started[0], started[1], duration_ms)
+        if log:
+            self.log()
+
+    def _record_slow(
+        self, command_name: str, database: str, command: dict, duration_ms: float
+    ) -> None:
+        collection = command.get(command_name)
+        shape = query_shape(command.get(QUERY_FIELDS[command_name]))
+        key = json.dumps([command_name, collection, shape], sort_keys=True)
+        now = time.monotonic()
+        with self._lock:
+            entry = self.slow.get(key)
+            if entry is None:
+                entry = {
+                    "command": command_name,
+                    "collection": collection,
+                    "shape": shape,
+                    "count": 0,
+                    "total_ms": 0.0,
+                    "max_ms": 0.0,
+                    "plan": None,
+                    "collection_scan": None,
+                    "_explained": None,
+                }
+                if len(self.slow) < self.max_shapes:
+                    self.slow[key] = entry
+            entry["count"] += 1
+            entry["total_ms"] += duration_ms
+            entry["max_ms"] = max(entry["max_ms"], duration_ms)
+            explain = (
+                bool(self.explain)
+                and key in self.slow
+                and (
+                    entry["_explained"] is None
+                    or now - entry["_explained"] >= self.explain_interval
+                )
+            )
+            if explain:
+                entry["_explained"] = now
+            published = self._public(entry)
+        logging.warning(
+            {
+                "message": dict(published, duration_ms=duration_ms),
+                "category": "WARNING-EVE-SLOWQUERY",
+            }
+        )
+        if explain:
+            explained = {
+                name: value
+                for name, value in command.items()
+                if name not in DRIVER_FIELDS
+            }
+            self.executor.submit(self._explain, key, database, explained)
+
+    def _explain(self, key: str, database: str, command: dict) -> None:
+        try:
+            plan = plan_summary(self.explain(database, command))
+        except PyMongoError:
+            logging.error(
+                {
+                    "message": "Failed to explain a slow query",
+                    "category": "ERROR-EVE-SLOWQUERY",
+                },
+                exc_info=True,
+            )
+            return
+        with self._lock:
+            entry = self.slow[key]
+            entry["plan"] = plan
+            entry["collection_scan"] = "COLLSCAN" in plan
+            published = self._public(entry)
+        logging.warning({"message": published, "category": "WARNING-EVE-SLOWQUERY"})
+
+    @staticmethod
+    def _public(entry: dict) -> dict:
+        return {
+            name: value for name, value in entry.items() if not name.startswith("_")
+        }
+
+    def slow_queries(self, limit: int = 20) -> List[dict]:
+        """
+        Keyword Arguments:
+            limit {int} -- Number of shapes returned. (default: {20})
+
+        Returns:
+            List[dict] -- Slow query shapes with their counts, latencies and plans,
+                by total time spent.
+        """
+        with self._lock:
+            entries = [self._public(entry) for entry in self.slow.values()]
+        return sorted(entries, key=lambda entry: -entry["total_ms"])[:limit]
+
+    def stats(self) -> Dict[str, object]:
+        """
+        Returns:
+            Dict[str, object] -- Latency per command and the slowest query shapes.
+        """
+        with self._lock:
+            latencies = list(self.latencies.values())
+        return {
+            "commands": self.commands,
+            "latency": [latency.snapshot() for latency in latencies],
+            "slow_queries": self.slow_queries(),
+        }
+
+    def log(self) -> None:
+        """
+        Publishes the stats as a structured log.
+        """
+        logging.info({"message": self.stats(), "category": "INFO-EVE-METRICS"})
+
+
+def explain_with(database_for: Callable[[str], object]) -> Callable[[str, dict], dict]:
+    """
+    Arguments:
+        database_for {Callable[[str], object]} -- Returns the pymongo database of a
+            name.
+
+    Returns:
+        Callable[[str, dict], dict] -- Explain function for SlowQueryMonitor, asking
+            for the chosen plan only, so the query is not run again.
+    """
+
+    def explain(database: str, command: dict) -> dict:
+        return database_for(database).command(
+            "explain", command, verbosity="queryPlanner"
+        )
+
+    return explain
@@ -637,5 +637,9 @@ MAF_PT = {
     'resource_methods': ['GET', 'POST'],
     "allowed_roles": ["admin", "user", "superuser", "uploader", 'system'],
     "allowed_item_roles": ["admin", "user", "superuser", "uploader", 'system'],
+    'background_indexes': {
+        # Permission filter of hooks.filter_on_id.
+        'trial_assay': [('trial', 1), ('assay', 1)],
+    },
     'schema': MAF
 }
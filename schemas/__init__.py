@@ -5,7 +5,7 @@ from schemas.coercers import FLOAT_COERCER as float_coercer, INT_COERCER as int_
 from schemas.analysis import ANALYSIS, ANALYSIS_STATUS
 from schemas.assays import ASSAYS
 from schemas.trials import TRIALS
-from schemas.ingestion import INGESTION
+from schemas.ingestion import INGESTION, INGESTION_FILES
 from schemas.data import DATA, DATA_AGG_INPUTS, DATA_EDIT, DATA_TOGGLE_VIS
 from schemas.MAF_data_model import MAF_PT
 from schemas.hla_schema import HLA
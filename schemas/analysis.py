@@ -7,6 +7,12 @@ ANALYSIS = {
     'item_methods': ['PATCH', 'GET', 'DELETE'],
     'allowed_roles': ['admin', 'superuser', 'system'],
     'allowed_item_roles': ['admin', 'superuser', 'system'],
+    'background_indexes': {
+        # Permission filter of hooks.filter_on_id.
+        'trial_assay': [('trial', 1), ('assay', 1)],
+        # Status events polling for recent changes.
+        'updated': [('_updated', 1)],
+    },
     'schema': {
         'start_date': {
             'type': 'string'
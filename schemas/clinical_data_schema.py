@@ -6,6 +6,10 @@ CLINICAL_1021 = {
     'resource_methods': ['GET', 'POST'],
     'allowed_roles': ['user', 'admin', 'uploader', 'superuser', 'system'],
     'allowed_item_roles': ['user', 'admin', 'uploader', 'superuser', 'system'],
+    'background_indexes': {
+        # Permission filter of hooks.filter_on_id.
+        'trial_assay': [('trial', 1), ('assay', 1)],
+    },
     'schema': {
         'trial': {
             'type': 'string',
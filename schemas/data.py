@@ -16,6 +16,17 @@ DATA = {
             'visibility': True
         },
     },
+    'mongo_indexes': {
+        # Duplicate detection in hooks.find_duplicates.
+        'visible_trial_assay_file': (
+            [('trial', 1), ('assay', 1), ('file_name', 1)],
+            {'partialFilterExpression': {'visibility': True}}
+        ),
+    },
+    'background_indexes': {
+        # Permission filter of hooks.filter_on_id and the visibility filter.
+        'trial_assay_visibility': [('trial', 1), ('assay', 1), ('visibility', 1)],
+    },
     'schema': {
         'data_format': {
             "type": "string",
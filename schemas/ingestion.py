@@ -3,8 +3,77 @@ Validator for data about jobs.
 """
 from schemas.fastq_schema import FASTQ_SCHEMA
 
+# A file of an upload job.
+INGESTION_FILE = {
+    "assay": {
+        "type": "objectid",
+        "required": True
+    },
+    "experimental_strategy": {
+        "type": "string",
+        "required": False
+    },
+    "data_format": {
+        "type": "string",
+        "required": False
+    },
+    "file_size": {
+        "type": "integer",
+        "required": False
+    },
+    "number_of_samples": {
+        "type": "integer",
+        "required": False
+    },
+    "trial": {
+        "type": "objectid",
+        "required": True
+    },
+    "file_name": {
+        "type": "string",
+        "required": True
+    },
+    "trial_name": {
+        "type": "string",
+        "required": False
+    },
+    "sample_ids": {
+        "type": "list",
+        "schema": {
+            "type": "string"
+        },
+        "required": False
+    },
+    "mapping": {
+        "type": "string",
+        "required": False
+    },
+    "uuid_alias": {
+        "type": "string",
+        "required": True,
+    },
+    "fastq_properties": {
+        "type": "dict",
+        "nullable": True,
+        "schema": FASTQ_SCHEMA
+    },
+}
+
+PROGRESS_SCHEMA = {
+    "type": "dict",
+    "schema": {
+        "progress": {
+            "type": "string",
+            "allowed": ["In Progress", "Completed", "Aborted"]
+        },
+        "message": {
+            "type": "string"
+        },
+    }
+}
+
 # Schema that keeps track of jobs that users have started, as well as their ultimate status and
-# fate
+# fate. The files of a job are posted with it, and stored in INGESTION_FILES.
 INGESTION = {
     "public_methods": [],
     "resource_methods": ["GET", "POST"],
@@ -12,26 +81,31 @@ INGESTION = {
     "allowed_roles": ["user", "superuser", "admin", "uploader", "system"],
     "allowed_item_roles": ["user", "superuser", "admin", "uploader", "system"],
     "allowed_filters": ["started_by"],
+    "background_indexes": {
+        # Users only see the jobs they started.
+        "started_by": [("started_by", 1)],
+    },
     "schema": {
         "number_of_files": {
             "type": "integer",
             "required": True,
         },
+        "files_in_progress": {
+            "type": "integer",
+            "readonly": True,
+        },
+        "files_completed": {
+            "type": "integer",
+            "readonly": True,
+        },
+        "files_aborted": {
+            "type": "integer",
+            "readonly": True,
+        },
         "started_by": {
             "type": "string",
         },
-        "status": {
-            "type": "dict",
-            "schema": {
-                "progress": {
-                    "type": "string",
-                    "allowed": ["In Progress", "Completed", "Aborted"]
-                },
-                "message": {
-                    "type": "string"
-                },
-            }
-        },
+        "status": PROGRESS_SCHEMA,
         "start_time": {
             "type": "string"
         },
@@ -42,61 +116,39 @@ INGESTION = {
             "type": "list",
             "schema": {
                 "type": "dict",
-                "schema": {
-                    "assay": {
-                        "type": "objectid",
-                        "required": True
-                    },
-                    "experimental_strategy": {
-                        "type": "string",
-                        "required": False
-                    },
-                    "data_format": {
-                        "type": "string",
-                        "required": False
-                    },
-                    "file_size": {
-                        "type": "integer",
-                        "required": False
-                    },
-                    "number_of_samples": {
-                        "type": "integer",
-                        "required": False
-                    },
-                    "trial": {
-                        "type": "objectid",
-                        "required": True
-                    },
-                    "file_name": {
-                        "type": "string",
-                        "required": True
-                    },
-                    "trial_name": {
-                        "type": "string",
-                        "required": False
-                    },
-                    "sample_ids": {
-                        "type": "list",
-                        "schema": {
-                            "type": "string"
-                        },
-                        "required": False
-                    },
-                    "mapping": {
-                        "type": "string",
-                        "required": False
-                    },
-                    "uuid_alias": {
-                        "type": "string",
-                        "required": True,
-                    },
-                    "fastq_properties": {
-                        "type": "dict",
-                        "nullable": True,
-                        "schema": FASTQ_SCHEMA
-                    },
-                },
+                "schema": INGESTION_FILE,
             },
         },
     },
 }
+
+# The files of upload jobs, paged under /ingestion/<job>/files and updated one at a time.
+INGESTION_FILES = {
+    "url": 'ingestion/<regex("[a-f0-9]{24}"):job>/files',
+    "datasource": {
+        "source": "ingestion_files",
+    },
+    "public_methods": [],
+    "resource_methods": ["GET"],
+    "item_methods": ["GET", "PATCH"],
+    "allowed_roles": ["user", "superuser", "admin", "uploader", "system"],
+    "allowed_item_roles": ["user", "superuser", "admin", "uploader", "system"],
+    "background_indexes": {
+        "job_file_name": ([("job", 1), ("file_name", 1)], {"unique": True}),
+    },
+    "schema": dict(
+        INGESTION_FILE,
+        job={
+            "type": "objectid",
+            "readonly": True,
+            "data_relation": {
+                "resource": "ingestion",
+            },
+        },
+        started_by={
+            "type": "string",
+            "readonly": True,
+        },
+        status=PROGRESS_SCHEMA,
+    ),
+}
@@ -12,6 +12,10 @@ LAST_ACCESS = {
     "resource_methods": ["GET"],
     "allowed_roles": ["admin", "system"],
     "allowed_item_roles": ["admin", "system"],
+    "background_indexes": {
+        # Upserts of write_behind.LastAccessBuffer.
+        "email": ([("email", 1)], {"unique": True}),
+    },
     "schema": {},
 }
 
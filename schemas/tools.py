@@ -18,6 +18,11 @@ def create_biomarker_schema(schema: dict) -> dict:
         "resource_methods": ["GET", "POST"],
         "allowed_roles": ["user", "uploader", "admin", 'system'],
         "allowed_item_roles": ["user", "uploader", "admin", 'system'],
+        "background_indexes": {
+            # Permission filter of hooks.filter_on_id.
+            "trial_assay": [("trial", 1), ("assay", 1)],
+            "record_id": [("record_id", 1)],
+        },
         "schema": {
             "trial": {"type": "objectid", "required": True},
             "assay": {"type": "objectid", "required": True},
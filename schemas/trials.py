@@ -15,6 +15,11 @@ TRIALS = {
     'allowed_item_roles': ['admin', 'superuser', 'system'],
     'allowed_filters': ['collaborators', 'principal_investigator', '_id',
                         'assays.assay_id'],
+    'background_indexes': {
+        'trial_name': ([('trial_name', 1)], {'unique': True}),
+        # Lock checks of uploads.
+        'locked': [('locked', 1)],
+    },
     'schema': {
         'trial_name': {
             'type': 'string',
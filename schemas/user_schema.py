@@ -10,6 +10,14 @@ DB_USER = {
     'item_methods': ['GET', 'PATCH', 'DELETE'],
     'allowed_roles': ['admin', 'system'],
     'allowed_item_roles': ['admin', 'system'],
+    'background_indexes': {
+        # Account lookups by email on every authenticated request. Accounts_create
+        # may store documents without one.
+        'email': (
+            [('email', 1)],
+            {'unique': True, 'partialFilterExpression': {'email': {'$type': 'string'}}}
+        ),
+    },
     'schema': {
         'email': {
             'type': 'string',
@@ -0,0 +1,178 @@
+"""
+Short lived, locally signed session tokens issued after a full Auth0 verification.
+"""
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import time
+from typing import Optional
+
+from redis import RedisError
+
+SESSION_PREFIX = "cidc-session."
+
+
+def _b64encode(raw: bytes) -> str:
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode("ascii")
+
+
+def _b64decode(value: str) -> bytes:
+    return base64.urlsafe_b64decode(value + "=" * (-len(value) % 4))
+
+
+def version_key(email: str) -> str:
+    """
+    Arguments:
+        email {str} -- Account email.
+
+    Returns:
+        str -- Redis key of the account's session version counter.
+    """
+    return "session_version:" + email
+
+
+def account_version(redis_client, email: str) -> Optional[int]:
+    """
+    Reads an account's version counter, which revoke_sessions bumps.
+
+    Arguments:
+        redis_client {redis.StrictRedis} -- Shared Redis connection.
+        email {str} -- Account email.
+
+    Returns:
+        Optional[int] -- The version, or None if Redis is unavailable.
+    """
+    try:
+        return int(redis_client.get(version_key(email)) or 0)
+    except RedisError:
+        logging.warning(
+            {
+                "message": "Session store unavailable",
+                "category": "WARNING-EVE-AUTH",
+            },
+            exc_info=True,
+        )
+        return None
+
+
+def revoke_sessions(redis_client, email: str) -> None:
+    """
+    Invalidates every session token issued for an account by bumping its version.
+
+    Arguments:
+        redis_client {redis.StrictRedis} -- Shared Redis connection.
+        email {str} -- Account email.
+    """
+    try:
+        redis_client.incr(version_key(email))
+    except RedisError:
+        logging.error(
+            {
+                "message": "Failed to revoke sessions for %s" % email,
+                "category": "ERROR-EVE-AUTH",
+            },
+            exc_info=True,
+        )
+
+
+class SessionTokens:
+    """
+    Issues and verifies HMAC-SHA256 signed session tokens carrying a user's email and
+    role. A token is only accepted while the account's version counter in Redis still
+    matches the one it was issued with. Permissions are not carried, as every change
+    to them bumps the version.
+    """
+
+    def __init__(self, secret: str, redis_client, ttl: int = 300):
+        """
+        Arguments:
+            secret {str} -- Signing secret shared by all workers.
+            redis_client {redis.StrictRedis} -- Shared Redis connection.
+
+        Keyword Arguments:
+            ttl {int} -- Seconds a session token is valid for. (default: {300})
+        """
+        self.secret = secret.encode("utf-8")
+        self.redis = redis_client
+        self.ttl = ttl
+
+    @staticmethod
+    def is_session_token(token: str) -> bool:
+        """
+        Arguments:
+            token {str} -- Bearer token.
+
+        Returns:
+            bool -- True if the token was issued by this API rather than Auth0.
+        """
+        return bool(token) and token.startswith(SESSION_PREFIX)
+
+    def _version(self, email: str) -> int:
+        return int(self.redis.get(version_key(email)) or 0)
+
+    def _sign(self, body: str) -> str:
+        return _b64encode(
+            hmac.new(self.secret, body.encode("utf-8"), hashlib.sha256).digest()
+        )
+
+    def issue(self, email: str, role: str, version: Optional[int]) -> Optional[str]:
+        """
+        Issues a session token for an authenticated user.
+
+        Arguments:
+            email {str} -- User's email.
+            role {str} -- User's role.
+            version {Optional[int]} -- Version of the account the role was read from,
+                from account_version before the account was read. A token signed
+                under a newer version could carry a role that was already revoked.
+
+        Returns:
+            Optional[str] -- The token, or None if the version counter is unavailable.
+        """
+        if version is None:
+            return None
+        claims = {
+            "email": email,
+            "role": role,
+            "ver": version,
+            "exp": int(time.time()) + self.ttl,
+        }
+        body = _b64encode(json.dumps(claims, separators=(",", ":")).encode("utf-8"))
+        return "%s%s.%s" % (SESSION_PREFIX, body, self._sign(body))
+
+    def verify(self, token: str) -> Optional[dict]:
+        """
+        Checks a session token's signature, expiry and version.
+
+        Arguments:
+            token {str} -- Session token.
+
+        Returns:
+            Optional[dict] -- The token's claims, or None if it is not valid.
+        """
+        try:
+            body, signature = token[len(SESSION_PREFIX) :].split(".")
+        except ValueError:
+            return None
+        expected = self._sign(body)
+        if not hmac.compare_digest(signature.encode("utf-8"), expected.encode("ascii")):
+            return None
+
+        claims = json.loads(_b64decode(body))
+        if claims["exp"] <= time.time():
+            return None
+        try:
+            if claims["ver"] != self._version(claims["email"]):
+                return None
+        except RedisError:
+            logging.warning(
+                {
+                    "message": "Session store unavailable",
+                    "category": "WARNING-EVE-AUTH",
+                },
+                exc_info=True,
+            )
+            return None
+        return claims
@@ -15,11 +15,56 @@ AUTH0_CLIENT_ID = env.get('AUTH0_CLIENT_ID')
 AUTH0_CLIENT_SECRET = env.get('AUTH0_CLIENT_SECRET')
 AUTH0_DOMAIN = env.get('AUTH0_DOMAIN')
 AUTH0_PORTAL_AUDIENCE = env.get('AUTH0_PORTAL_AUDIENCE')
+AUTH0_TIMEOUT = float(env.get('AUTH0_TIMEOUT', 5))
+JWKS_CACHE_TTL = int(env.get('JWKS_CACHE_TTL', 3600))
+TOKEN_CACHE_SIZE = int(env.get('TOKEN_CACHE_SIZE', 1024))
+TOKEN_CACHE_LOG_EVERY = int(env.get('TOKEN_CACHE_LOG_EVERY', 1000))
+ACCOUNT_CACHE_TTL = int(env.get('ACCOUNT_CACHE_TTL', 60))
+TRIAL_LOCK_CACHE_TTL = float(env.get('TRIAL_LOCK_CACHE_TTL', 10))
+PERMISSION_FILTER_TTL = int(env.get('PERMISSION_FILTER_TTL', 3600))
+PERMISSION_FILTER_CACHE_SIZE = int(env.get('PERMISSION_FILTER_CACHE_SIZE', 1024))
+LAST_ACCESS_FLUSH_INTERVAL = float(env.get('LAST_ACCESS_FLUSH_INTERVAL', 30))
+SESSION_SECRET = env.get('SESSION_SECRET')
+SESSION_TOKEN_TTL = int(env.get('SESSION_TOKEN_TTL', 300))
 GOOGLE_URL = env.get('GOOGLE_URL')
 GOOGLE_FOLDER_PATH = env.get('GOOGLE_FOLDER_PATH')
 GOOGLE_BUCKET_NAME = env.get('GOOGLE_BUCKET_NAME')
 GOOGLE_UPLOAD_BUCKET = env.get("GOOGLE_UPLOAD_BUCKET")
 RABBIT_MQ_ADDRESS = 'amqp://rabbitmq'
+RABBIT_MQ_POOL_LIMIT = int(env.get('RABBIT_MQ_POOL_LIMIT', 10))
+OUTBOX_DISPATCH_INTERVAL = float(env.get('OUTBOX_DISPATCH_INTERVAL', 5))
+OUTBOX_MAX_ATTEMPTS = int(env.get('OUTBOX_MAX_ATTEMPTS', 10))
+WORKFLOW_TRIGGER_WINDOW = float(env.get('WORKFLOW_TRIGGER_WINDOW', 30))
+# 'true' sends manage_workflows the trial/assay pairs it runs for as a 'targets'
+# keyword argument, once the workers accept it.
+WORKFLOW_TRIGGER_TARGETS = env.get('WORKFLOW_TRIGGER_TARGETS', 'false') == 'true'
+# 'full' sends documents to celery tasks, 'reference' sends their ids and etags.
+TASK_PAYLOAD_MODE = env.get('TASK_PAYLOAD_MODE', 'full')
+# 'true' sends upload jobs whose files would take the task past TASK_INLINE_MAX_BYTES
+# with a link to page the files instead, once the workers follow it.
+TASK_FILES_BY_LINK = env.get('TASK_FILES_BY_LINK', 'false') == 'true'
+TASK_INLINE_MAX_BYTES = int(env.get('TASK_INLINE_MAX_BYTES', 15 * 1024 * 1024))
+# 'json' or 'msgpack', which needs the msgpack package here and in the workers.
+TASK_SERIALIZER = env.get('TASK_SERIALIZER', 'json')
+BATCH_FETCH_LIMIT = int(env.get('BATCH_FETCH_LIMIT', 1000))
+SIGNED_URL_LIFETIME = int(env.get('SIGNED_URL_LIFETIME', 1000))
+SIGNED_URL_WINDOW = int(env.get('SIGNED_URL_WINDOW', 300))
+SIGNED_URL_CACHE_SIZE = int(env.get('SIGNED_URL_CACHE_SIZE', 4096))
+SIGNING_WORKERS = int(env.get('SIGNING_WORKERS', 4))
+MANIFEST_CHUNK_SIZE = int(env.get('MANIFEST_CHUNK_SIZE', 200))
+DUPLICATE_CHECK_CHUNK_SIZE = int(env.get('DUPLICATE_CHECK_CHUNK_SIZE', 500))
+INGESTION_STREAM_BATCH_SIZE = int(env.get('INGESTION_STREAM_BATCH_SIZE', 500))
+INGESTION_STREAM_MAX_LINE = int(env.get('INGESTION_STREAM_MAX_LINE', 1048576))
+# 'change_stream' (falls back to polling where MongoDB is not a replica set) or 'poll'.
+# Each /events stream holds a worker for at most EVENTS_MAX_DURATION seconds.
+EVENTS_MODE = env.get('EVENTS_MODE', 'change_stream')
+EVENTS_POLL_INTERVAL = float(env.get('EVENTS_POLL_INTERVAL', 2))
+EVENTS_HEARTBEAT = int(env.get('EVENTS_HEARTBEAT', 15))
+EVENTS_MAX_DURATION = int(env.get('EVENTS_MAX_DURATION', 300))
+SLOW_QUERY_MS = float(env.get('SLOW_QUERY_MS', 100))
+SLOW_QUERY_EXPLAIN_INTERVAL = float(env.get('SLOW_QUERY_EXPLAIN_INTERVAL', 3600))
+# 'create' builds missing indexes at startup, 'report' only logs them, 'off' skips both.
+INDEX_RECONCILE = env.get('INDEX_RECONCILE', 'create')
 SENDGRID_API_KEY = env.get('SENDGRID_API_KEY')
 
 # Default credentials for a local mongodb, do NOT use for production
@@ -93,6 +138,7 @@ ITEM_METHODS = []
 X_DOMAINS = '*'
 
 X_HEADERS = ['Content-Type', 'If-Match', 'Authorization', 'X-HTTP-Method-Override']
+X_EXPOSE_HEADERS = ['X-Session-Token']
 X_ALLOW_CREDENTIALS = True
 BANDWIDTH_SAVER = False
 CACHE_CONTROL = 'no-cache'
@@ -110,6 +156,7 @@ DOMAIN = {
     'data/query': schemas.DATA_AGG_INPUTS,
     'gene_symbols': schemas.IDENTIFIER_SCHEMA,
     'ingestion': schemas.INGESTION,
+    'ingestion_files': schemas.INGESTION_FILES,
     'last_access': schemas.LAST_ACCESS,
     'olink': schemas.OLINK,
     'olink_meta': schemas.BIOREPOSITORY,
@@ -0,0 +1,311 @@
+"""
+Server-sent events for status changes of upload jobs and analyses. Changes are read
+from a Mongo change stream, or by polling where change streams are not available,
+with the subscriber's permission filter applied in the query.
+"""
+import datetime
+import json
+import logging
+import time
+from typing import Callable, Iterator, List
+
+from bson import json_util
+from pymongo.errors import OperationFailure
+
+CHANGE_STREAM = "change_stream"
+POLL = "poll"
+# Status field watched for each collection.
+EVENT_FIELDS = {"ingestion": "status.progress", "analysis": "status"}
+WATCHED_OPERATIONS = ["insert", "update", "replace"]
+
+
+def prefix_query(query: dict, prefix: str) -> dict:
+    """
+    Rewrites a query on documents into one on a field holding them, e.g. on the
+    fullDocument of change events.
+
+    Arguments:
+        query {dict} -- Mongo query.
+        prefix {str} -- Field holding the documents.
+
+    Returns:
+        dict -- The query with every field path prefixed.
+    """
+    prefixed = {}
+    for key, value in query.items():
+        if key in ("$and", "$or", "$nor"):
+            prefixed[key] = [prefix_query(clause, prefix) for clause in value]
+        else:
+            prefixed["%s.%s" % (prefix, key)] = value
+    return prefixed
+
+
+def get_field(document: dict, field: str):
+    """
+    Arguments:
+        document {dict} -- Document.
+        field {str} -- Dotted path.
+
+    Returns:
+        object -- Value at the path, or None.
+    """
+    for key in field.split("."):
+        if not isinstance(document, dict):
+            return None
+        document = document.get(key)
+    return document
+
+
+def _event(_id, field: str, value, event_id: str = None) -> dict:
+    data = {"_id": _id}
+    keys = field.split(".")
+    target = data
+    for key in keys[:-1]:
+        target = target.setdefault(key, {})
+    target[keys[-1]] = value
+    return {"id": event_id, "data": data}
+
+
+class ChangeStreamWatcher:
+    """
+    Reads changes of a status field from a change stream on a collection, restricted
+    to the documents matching a query.
+    """
+
+    def __init__(
+        self,
+        collection,
+        query: dict,
+        field: str,
+        resume_after: str = None,
+        max_await_ms: int = 1000,
+    ):
+        """
+        Arguments:
+            collection {pymongo.collection.Collection} -- Watched collection.
+            query {dict} -- Documents the subscriber may see.
+            field {str} -- Dotted path of the status field.
+
+        Keyword Arguments:
+            resume_after {str} -- Id of the last event received, to resume from.
+                (default: {None})
+            max_await_ms {int} -- Longest wait for a change per poll.
+                (default: {1000})
+        """
+        self.field = field
+        top_level = field.split(".")[0]
+        pipeline = [
+            {
+                "$match": dict(
+                    prefix_query(query, "fullDocument"),
+                    operationType={"$in": WATCHED_OPERATIONS},
+                )
+            },
+            {
+                "$project": {
+                    "operationType": 1,
+                    "documentKey": 1,
+                    "updateDescription.updatedFields": 1,
+                    "fullDocument." + top_level: 1,
+                }
+            },
+        ]
+        self._stream = collection.watch(
+            pipeline,
+            full_document="updateLookup",
+            resume_after={"_data": resume_after} if resume_after else None,
+            max_await_time_ms=max_await_ms,
+        )
+
+    def _changed(self, change: dict) -> bool:
+        if change["operationType"] != "update":
+            return True
+        return any(
+            key == self.field
+            or self.field.startswith(key + ".")
+            or key.startswith(self.field + ".")
+            for key in change["updateDescription"]["updatedFields"]
+        )
+
+    def poll(self) -> List[dict]:
+        """
+        Returns:
+            List[dict] -- Status changes received within max_await_ms.
+        """
+        events = []
+        while True:
+            change = self._stream.try_next()
+            if change is None:
+                return events
+            if self._changed(change):
+                value = get_field(change.get("fullDocument") or {}, self.field)
+                events.append(
+                    _event(
+                        change["documentKey"]["_id"],
+                        self.field,
+                        value,
+                        change["_id"]["_data"],
+                    )
+                )
+
+    def close(self) -> None:
+        """
+        Closes the change stream.
+        """
+        self._stream.close()
+
+
+class PollingWatcher:
+    """
+    Stand-in for ChangeStreamWatcher on servers without change streams: queries the
+    documents Eve updated since the last poll and reports the ones whose status
+    changed.
+    """
+
+    def __init__(
+        self,
+        collection,
+        query: dict,
+        field: str,
+        interval: float = 2,
+        sleep: Callable[[float], None] = time.sleep,
+    ):
+        """
+        Arguments:
+            collection {pymongo.collection.Collection} -- Watched collection.
+            query {dict} -- Documents the subscriber may see.
+            field {str} -- Dotted path of the status field.
+
+        Keyword Arguments:
+            interval {float} -- Seconds between queries. (default: {2})
+            sleep {Callable[[float], None]} -- Waits between queries.
+                (default: {time.sleep})
+        """
+        self.collection = collection
+        self.query = query
+        self.field = field
+        self.interval = interval
+        self._sleep = sleep
+        self._since = datetime.datetime.utcnow().replace(microsecond=0)
+        self._seen = {}
+
+    def poll(self) -> List[dict]:
+        """
+        Returns:
+            List[dict] -- Status changes since the last poll.
+        """
+        self._sleep(self.interval)
+        # Eve stores _updated to the second, so documents of the last second are
+        # read again and told apart by their status.
+        query = {"$and": [self.query, {"_updated": {"$gte": self._since}}]}
+        projection = {"_updated": 1, self.field.split(".")[0]: 1}
+        events = []
+        for document in self.collection.find(query, projection).sort("_updated", 1):
+            value = get_field(document, self.field)
+            if self._seen.get(document["_id"], object()) != value:
+                self._seen[document["_id"]] = value
+                events.append(_event(document["_id"], self.field, value))
+            self._since = max(self._since, document["_updated"])
+        return events
+
+    def close(self) -> None:
+        """
+        Nothing to release.
+        """
+
+
+def open_watcher(
+    mode: str,
+    collection,
+    query: dict,
+    field: str,
+    resume_after: str = None,
+    interval: float = 2,
+):
+    """
+    Opens a watcher for the configured mode. Change streams need a replica set, so on
+    a standalone server the watcher falls back to polling.
+
+    Arguments:
+        mode {str} -- CHANGE_STREAM or POLL.
+        collection {pymongo.collection.Collection} -- Watched collection.
+        query {dict} -- Documents the subscriber may see.
+        field {str} -- Dotted path of the status field.
+
+    Keyword Arguments:
+        resume_after {str} -- Id of the last event received. (default: {None})
+        interval {float} -- Seconds between queries when polling. (default: {2})
+
+    Returns:
+        ChangeStreamWatcher -- Or PollingWatcher.
+    """
+    if mode == CHANGE_STREAM:
+        try:
+            return ChangeStreamWatcher(
+                collection, query, field, resume_after=resume_after
+            )
+        except OperationFailure:
+            logging.warning(
+                {
+                    "message": "Change streams unavailable, polling instead",
+                    "category": "WARNING-EVE-EVENTS",
+                },
+                exc_info=True,
+            )
+    return PollingWatcher(collection, query, field, interval)
+
+
+def format_event(resource: str, event: dict) -> str:
+    """
+    Arguments:
+        resource {str} -- Resource the document belongs to, sent as the event type.
+        event {dict} -- Event from a watcher.
+
+    Returns:
+        str -- The event in the text/event-stream format.
+    """
+    lines = ["event: %s" % resource]
+    if event.get("id"):
+        lines.append("id: %s" % event["id"])
+    lines.append("data: %s" % json.dumps(event["data"], default=json_util.default))
+    return "\n".join(lines) + "\n\n"
+
+
+def stream_events(
+    watcher,
+    resource: str,
+    heartbeat: float = 15,
+    max_duration: float = 300,
+    clock: Callable[[], float] = time.monotonic,
+) -> Iterator[str]:
+    """
+    Streams a watcher's events, with a comment line when nothing was sent for
+    `heartbeat` seconds so dead connections are noticed. The stream ends after
+    `max_duration` seconds and clients reconnect, resuming from the last event id.
+
+    Arguments:
+        watcher {ChangeStreamWatcher} -- Source of events.
+        resource {str} -- Resource name sent as the event type.
+
+    Keyword Arguments:
+        heartbeat {float} -- Seconds between keep-alive comments. (default: {15})
+        max_duration {float} -- Seconds the stream stays open. (default: {300})
+        clock {Callable[[], float]} -- Monotonic clock. (default: {time.monotonic})
+
+    Returns:
+        Iterator[str] -- text/event-stream chunks.
+    """
+    start = last_sent = clock()
+    try:
+        yield "retry: 1000\n\n"
+        while clock() - start < max_duration:
+            events = watcher.poll()
+            for event in events:
+                yield format_event(resource, event)
+            if events:
+                last_sent = clock()
+            elif clock() - last_sent >= heartbeat:
+                last_sent = clock()
+                yield ": keep-alive\n\n"
+    finally:
+        watcher.close()
@@ -0,0 +1,126 @@
+"""
+Encoding of celery task payloads: JSON, or msgpack with extension types for BSON
+values, and reference-only arguments that name documents instead of embedding them.
+"""
+import datetime
+import json
+import struct
+from typing import List, Tuple
+
+from bson import BSON, ObjectId, json_util
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover
+    msgpack = None
+
+JSON = "json"
+MSGPACK = "msgpack"
+SERIALIZERS = (JSON, MSGPACK)
+
+# Largest document Mongo stores, which bounds a task queued in the outbox.
+MAX_DOCUMENT_SIZE = 16 * 1024 * 1024
+
+# msgpack extension type codes for BSON values.
+OBJECTID_EXT = 1
+DATETIME_EXT = 2
+
+_EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+def reference(resource: str, documents: List[dict]) -> dict:
+    """
+    Replaces documents by their ids and etags. Workers resolve them through the batch
+    fetch endpoint, and can tell from the etag whether a document changed since.
+
+    Arguments:
+        resource {str} -- Resource the documents belong to.
+        documents {List[dict]} -- Documents as stored by Eve.
+
+    Returns:
+        dict -- The reference.
+    """
+    return {
+        "resource": resource,
+        "refs": [{"_id": doc["_id"], "_etag": doc.get("_etag")} for doc in documents],
+    }
+
+
+def document_size(document: dict) -> int:
+    """
+    Arguments:
+        document {dict} -- Document, e.g. a task argument.
+
+    Returns:
+        int -- Bytes the document takes encoded as BSON, as Mongo stores it.
+    """
+    return len(BSON.encode(document))
+
+
+def _msgpack_default(value):
+    if isinstance(value, ObjectId):
+        return msgpack.ExtType(OBJECTID_EXT, value.binary)
+    if isinstance(value, datetime.datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=datetime.timezone.utc)
+        millis = (value - _EPOCH) // datetime.timedelta(milliseconds=1)
+        return msgpack.ExtType(DATETIME_EXT, struct.pack(">q", millis))
+    raise TypeError("Cannot serialize %r" % type(value))
+
+
+def _msgpack_ext_hook(code: int, data: bytes):
+    if code == OBJECTID_EXT:
+        return ObjectId(data)
+    if code == DATETIME_EXT:
+        millis = struct.unpack(">q", data)[0]
+        return _EPOCH + datetime.timedelta(milliseconds=millis)
+    return msgpack.ExtType(code, data)
+
+
+def check_serializer(serializer: str) -> None:
+    """
+    Arguments:
+        serializer {str} -- Name of a serializer.
+
+    Raises:
+        ValueError -- If the serializer is unknown or its package is not installed.
+    """
+    if serializer not in SERIALIZERS:
+        raise ValueError("Unknown task serializer: %s" % serializer)
+    if serializer == MSGPACK and msgpack is None:
+        raise ValueError("The msgpack task serializer needs the msgpack package")
+
+
+def encode(payload: dict, serializer: str = JSON) -> Tuple[object, str, str]:
+    """
+    Serializes a task payload.
+
+    Arguments:
+        payload {dict} -- Task message.
+
+    Keyword Arguments:
+        serializer {str} -- "json" or "msgpack". (default: {JSON})
+
+    Returns:
+        Tuple[object, str, str] -- Body, content type and content encoding.
+    """
+    if serializer == MSGPACK:
+        body = msgpack.packb(payload, default=_msgpack_default, use_bin_type=True)
+        return body, "application/x-msgpack", "binary"
+    return json.dumps(payload, default=json_util.default), "application/json", "utf-8"
+
+
+def decode(body, content_type: str) -> dict:
+    """
+    Reverses encode.
+
+    Arguments:
+        body {object} -- Message body.
+        content_type {str} -- Content type it was sent with.
+
+    Returns:
+        dict -- Task message.
+    """
+    if content_type == "application/x-msgpack":
+        return msgpack.unpackb(body, ext_hook=_msgpack_ext_hook, raw=False)
+    return json.loads(body, object_hook=json_util.object_hook)
@@ -0,0 +1,154 @@
+"""
+Long lived, pooled publisher of celery tasks.
+"""
+import logging
+import os
+import threading
+import time
+
+from kombu import Connection, Exchange
+from kombu.pools import ProducerPool
+
+from metrics import LatencyHistogram
+
+TASK_EXCHANGE = Exchange("", type="direct")
+TASK_ROUTING_KEY = "celery"
+RETRY_POLICY = {
+    "max_retries": 3,
+    "interval_start": 0,
+    "interval_step": 0.5,
+    "interval_max": 2,
+}
+
+
+class TaskPublisher:
+    """
+    Publishes task messages over a pool of connections kept open between requests.
+    Connections are reestablished when the broker drops them, publishes wait for the
+    broker to confirm them and the pools are created again in forked workers.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        pool_limit: int = 10,
+        acquire_timeout: float = 5,
+        retry_policy: dict = None,
+        log_every: int = 100,
+    ):
+        """
+        Arguments:
+            url {str} -- Broker url.
+
+        Keyword Arguments:
+            pool_limit {int} -- Connections and producers kept per worker.
+                (default: {10})
+            acquire_timeout {float} -- Seconds to wait for a free producer.
+                (default: {5})
+            retry_policy {dict} -- kombu retry policy for publishing.
+                (default: {RETRY_POLICY})
+            log_every {int} -- Publishes between logs of the latency histogram.
+                (default: {100})
+        """
+        self.url = url
+        self.pool_limit = pool_limit
+        self.acquire_timeout = acquire_timeout
+        self.retry_policy = retry_policy or RETRY_POLICY
+        self.log_every = log_every
+        self.latency = LatencyHistogram("task_publish")
+        self.published = 0
+        self.errors = 0
+        self._producers = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    @property
+    def producers(self) -> ProducerPool:
+        """
+        Returns:
+            ProducerPool -- The producer pool, created again in forked workers.
+        """
+        if self._producers is None or self._pid != os.getpid():
+            with self._lock:
+                if self._producers is None or self._pid != os.getpid():
+                    connection = Connection(
+                        self.url, transport_options={"confirm_publish": True}
+                    )
+                    connections = connection.Pool(limit=self.pool_limit)
+                    self._producers = ProducerPool(connections, limit=self.pool_limit)
+                    self._pid = os.getpid()
+        return self._producers
+
+    def publish(
+        self,
+        body,
+        routing_key: str = TASK_ROUTING_KEY,
+        content_type: str = "application/json",
+        content_encoding: str = "utf-8",
+    ) -> None:
+        """
+        Publishes a serialized task message, retrying on connection errors.
+
+        Arguments:
+            body {str} -- Encoded message.
+
+        Keyword Arguments:
+            routing_key {str} -- Queue to route to. (default: {TASK_ROUTING_KEY})
+            content_type {str} -- MIME type of the body.
+                (default: {"application/json"})
+            content_encoding {str} -- Character encoding of the body, or "binary".
+                (default: {"utf-8"})
+
+        Raises:
+            kombu.exceptions.OperationalError -- If the broker stays unreachable.
+        """
+        start = time.monotonic()
+        try:
+            with self.producers.acquire(
+                block=True, timeout=self.acquire_timeout
+            ) as producer:
+                producer.publish(
+                    body,
+                    exchange=TASK_EXCHANGE,
+                    routing_key=routing_key,
+                    content_type=content_type,
+                    content_encoding=content_encoding,
+                    retry=True,
+                    retry_policy=self.retry_policy,
+                )
+        except Exception:  # pylint: disable=broad-except
+            self.errors += 1
+            logging.error(
+                {
+                    "message": "Failed to publish task to %s" % routing_key,
+                    "category": "ERROR-EVE-CELERY",
+                },
+                exc_info=True,
+            )
+            raise
+        finally:
+            self.latency.observe(time.monotonic() - start)
+        self.published += 1
+        if self.log_every and not self.published % self.log_every:
+            self.latency.log()
+
+    def stats(self) -> dict:
+        """
+        Returns:
+            dict -- Publish counters and the publish latency histogram.
+        """
+        return {
+            "published": self.published,
+            "errors": self.errors,
+            "latency": self.latency.snapshot(),
+        }
+
+    def close(self) -> None:
+        """
+        Closes every pooled producer and connection of this worker.
+        """
+        with self._lock:
+            if self._producers is not None and self._pid == os.getpid():
+                self._producers.connections.force_close_all()
+                self._producers.force_close_all()
+            self._producers = None
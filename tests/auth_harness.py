@@ -0,0 +1,301 @@
+"""
+Offline stand-ins for benchmarking authentication and testing the API: an Auth0
+JWKS/userinfo server, an RS256 token factory, an accounts database that counts its
+calls, and requests made as a given user against a given database.
+"""
+import base64
+import json
+import os
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from types import SimpleNamespace
+from unittest import mock
+
+import mongomock
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from jose import jwt
+
+from permissions import PermissionFilterCache
+
+
+def _int_to_b64(value: int) -> str:
+    """
+    Encodes an integer the way JWKs do.
+    """
+    raw = value.to_bytes((value.bit_length() + 7) // 8, "big")
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode("ascii")
+
+
+def make_key(kid: str):
+    """
+    Generates an RSA key.
+
+    Arguments:
+        kid {str} -- Key id.
+
+    Returns:
+        Tuple[bytes, dict] -- PEM of the private key and the JWK of the public key.
+    """
+    private_key = rsa.generate_private_key(65537, 2048, default_backend())
+    numbers = private_key.public_key().public_numbers()
+    jwk = {
+        "kty": "RSA",
+        "kid": kid,
+        "use": "sig",
+        "n": _int_to_b64(numbers.n),
+        "e": _int_to_b64(numbers.e),
+    }
+    pem = private_key.private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption(),
+    )
+    return pem, jwk
+
+
+class TokenFactory:
+    """
+    Issues RS256 tokens the way the Auth0 tenant does.
+    """
+
+    def __init__(self, domain: str, kid: str = "bench"):
+        self.issuer = "https://%s/" % domain
+        self.kid = kid
+        self.pem, self.jwk = make_key(kid)
+
+    def issue(self, sub: str, audience: str, expires_in: int = 3600, **claims) -> str:
+        """
+        Arguments:
+            sub {str} -- Subject.
+            audience {str} -- Audience.
+
+        Keyword Arguments:
+            expires_in {int} -- Seconds until the token expires. (default: {3600})
+
+        Returns:
+            str -- Signed token.
+        """
+        now = int(time.time())
+        claims.update(
+            {
+                "sub": sub,
+                "aud": audience,
+                "iss": self.issuer,
+                "iat": now,
+                "exp": now + expires_in,
+                "jti": uuid.uuid4().hex,
+            }
+        )
+        return jwt.encode(
+            claims, self.pem, algorithm="RS256", headers={"kid": self.kid}
+        )
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class StandInAuth0:
+    """
+    Local server answering /.well-known/jwks.json and /userinfo, counting requests
+    per path.
+    """
+
+    def __init__(self, jwks: dict, emails: dict):
+        """
+        Arguments:
+            jwks {dict} -- Key set to publish.
+            emails {dict} -- Email returned by /userinfo for each token subject.
+        """
+        self.jwks = jwks
+        self.emails = emails
+        self.calls = Counter()
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            """
+            Serves the stand-in's endpoints.
+            """
+
+            def do_GET(self):  # pylint: disable=invalid-name
+                stand_in.calls[self.path] += 1
+                if self.path == "/.well-known/jwks.json":
+                    self._reply(200, stand_in.jwks)
+                elif self.path == "/userinfo":
+                    token = self.headers["Authorization"].split(" ", 1)[1]
+                    sub = jwt.get_unverified_claims(token)["sub"]
+                    self._reply(200, {"sub": sub, "email": stand_in.emails[sub]})
+                else:
+                    self._reply(404, {})
+
+            def _reply(self, status, body):
+                raw = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(raw)))
+                self.end_headers()
+                self.wfile.write(raw)
+
+            def log_message(self, *args):  # pylint: disable=arguments-differ
+                pass
+
+        self.server = _ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = "http://127.0.0.1:%s" % self.server.server_port
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+    @property
+    def total_calls(self) -> int:
+        return sum(self.calls.values())
+
+
+class FakeRedis:
+    """
+    In-memory stand-in for the Redis commands the API uses.
+    """
+
+    def __init__(self):
+        self.store = {}
+        self.calls = Counter()
+
+    def get(self, key):
+        self.calls["get"] += 1
+        return self.store.get(key)
+
+    def mget(self, *keys):
+        self.calls["mget"] += 1
+        return [self.store.get(key) for key in keys]
+
+    def set(self, key, value, ex=None):  # pylint: disable=unused-argument
+        self.calls["set"] += 1
+        self.store[key] = value
+
+    def incr(self, key):
+        self.calls["incr"] += 1
+        self.store[key] = int(self.store.get(key, 0)) + 1
+        return self.store[key]
+
+    @property
+    def total_calls(self) -> int:
+        return sum(self.calls.values())
+
+
+class CountingCollection:
+    """
+    Proxy for a collection that counts every method call made on it.
+    """
+
+    def __init__(self, collection, calls: Counter):
+        self._collection = collection
+        self._calls = calls
+
+    def __getattr__(self, name):
+        attribute = getattr(self._collection, name)
+        if not callable(attribute):
+            return attribute
+
+        def counted(*args, **kwargs):
+            self._calls["%s.%s" % (self._collection.name, name)] += 1
+            return attribute(*args, **kwargs)
+
+        return counted
+
+
+class CountingDatabase:
+    """
+    mongomock database whose collections count their calls.
+    """
+
+    def __init__(self):
+        self.database = mongomock.MongoClient().db
+        self.calls = Counter()
+
+    def __getitem__(self, name):
+        return CountingCollection(self.database[name], self.calls)
+
+    @property
+    def total_calls(self) -> int:
+        return sum(self.calls.values())
+
+
+def import_app():
+    """
+    Imports the API offline: with cloud style settings pointing at placeholder hosts
+    and without creating or reconciling Mongo indexes.
+
+    Returns:
+        module -- The ingestion_api module.
+    """
+    environment = {
+        "IN_CLOUD": "1",
+        "MONGO_HOST": "localhost",
+        "MONGO_USERNAME": "",
+        "MONGO_PASSWORD": "",
+        "MONGO_DBNAME": "benchmark",
+        "RABBITMQ_SERVICE_HOST": "localhost",
+        "RABBITMQ_SERVICE_PORT": "5672",
+    }
+    with mock.patch.dict(os.environ, environment), mock.patch(
+        "eve.flaskapp.ensure_mongo_indexes"
+    ), mock.patch("indexes.reconcile_in_background"):
+        import ingestion_api  # pylint: disable=import-outside-toplevel
+
+    return ingestion_api
+
+
+@contextmanager
+def as_user(api, email: str, database):
+    """
+    Makes requests to the API authenticate as a user and read a database, with
+    fresh account and permission filter caches and an in-memory Redis.
+
+    Arguments:
+        api {module} -- The ingestion_api module, from import_app.
+        email {str} -- Email of the user.
+        database {object} -- Database the API reads, e.g. a mongomock database.
+    """
+
+    def check_auth(auth, token, allowed_roles, resource, method):
+        api._request_ctx_stack.top.current_user = {"email": email}
+        return True
+
+    mongo = SimpleNamespace(db=database)
+    with ExitStack() as stack:
+        for target, name, value in [
+            (api.BearerAuth, "check_auth", check_auth),
+            (api.APP.data, "driver", mongo),
+            (api.APP.data, "pymongo", lambda *args, **kwargs: mongo),
+            (api.hooks, "ACCOUNT_CACHE", api.hooks.AccountCache()),
+            (api.hooks, "PERMISSION_FILTERS", PermissionFilterCache()),
+        ]:
+            stack.enter_context(mock.patch.object(target, name, value))
+        stack.enter_context(
+            mock.patch.object(api.APP, "redis", FakeRedis(), create=True)
+        )
+        yield
+
+
+def percentile(samples: list, fraction: float) -> float:
+    """
+    Arguments:
+        samples {list} -- Measurements.
+        fraction {float} -- Percentile as a fraction, e.g. 0.95.
+
+    Returns:
+        float -- The percentile of the samples.
+    """
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
@@ -0,0 +1,214 @@
+"""
+Offline benchmark of BearerAuth.check_auth. Runs every kind of token through the full
+authentication path against local stand-ins for Auth0 and Mongo, reports latency and
+the number of HTTP and Mongo calls per request, and fails when a request makes more
+calls than its budget allows.
+"""
+import os
+import sys
+import time
+import unittest
+from contextlib import ExitStack
+from functools import partial
+from types import SimpleNamespace
+from unittest import mock
+
+import pytest
+
+pytest.importorskip("cidc_utils")
+pytest.importorskip("eve_swagger")
+
+# pylint: disable=wrong-import-position
+from auth_cache import AccountCache, JWKSCache, TokenCache, UserInfoCache, fetch_jwks
+from auth_harness import (
+    CountingDatabase,
+    FakeRedis,
+    StandInAuth0,
+    TokenFactory,
+    import_app,
+    percentile,
+)
+from http_client import OutboundClient
+
+DOMAIN = "cidc.auth.test"
+AUDIENCE = "https://api.cidc.test"
+PORTAL_AUDIENCE = "https://portal.cidc.test"
+ALLOWED_ROLES = ["reader", "uploader", "admin", "system"]
+WARM_REQUESTS = int(os.environ.get("AUTH_BENCH_REQUESTS", 200))
+
+# Maximum outbound calls a single request may make, by phase. "cold" is the first
+# request of a worker, "warm" repeats the same token and "new_token" is a fresh token
+# for a user the worker has already seen.
+# Every request reads the account's version counter, so cached accounts are dropped
+# as soon as another worker changes them.
+CALL_BUDGETS = {
+    "cold": {"http": 2, "mongo": 1, "redis": 3},
+    "warm": {"http": 0, "mongo": 0, "redis": 1},
+    "new_token": {"http": 0, "mongo": 0, "redis": 1},
+}
+
+
+class TestAuthBenchmark(unittest.TestCase):
+    """
+    Latency and call counts of check_auth per kind of token.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.api = import_app()
+        cls.tokens = TokenFactory(DOMAIN)
+        cls.report = []
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.api.hooks.LAST_ACCESS_BUFFER.flush()
+        lines = ["", "auth benchmark (latency in ms, calls per request)"]
+        lines.append(
+            "%-8s %-10s %8s %8s %8s %6s %6s %6s"
+            % ("token", "phase", "p50", "p95", "max", "http", "mongo", "redis")
+        )
+        for row in cls.report:
+            lines.append("%-8s %-10s %8.3f %8.3f %8.3f %6.2f %6.2f %6.2f" % row)
+        sys.stderr.write("\n".join(lines) + "\n")
+
+    def setUp(self):
+        self.database = CountingDatabase()
+        self.database.database["accounts"].insert_many(
+            [
+                {
+                    "email": email,
+                    "approved": True,
+                    "role": role,
+                    "permissions": [],
+                }
+                for email, role in [
+                    ("api@cidc.test", "reader"),
+                    ("portal@cidc.test", "reader"),
+                    ("celery-taskmanager", "system"),
+                ]
+            ]
+        )
+        self.redis = FakeRedis()
+
+    def offline_api(self, stand_in: StandInAuth0) -> ExitStack:
+        """
+        Points the API's module level clients and caches at the stand-ins, with every
+        cache empty.
+        """
+        client = OutboundClient(stand_in.url)
+        stack = ExitStack()
+        for name, value in [
+            ("AUTH0_DOMAIN", DOMAIN),
+            ("AUTH0_AUDIENCE", AUDIENCE),
+            ("AUTH0_PORTAL_AUDIENCE", PORTAL_AUDIENCE),
+            ("AUTH0_CLIENT", client),
+            ("JWKS_CACHE", JWKSCache(partial(fetch_jwks, client))),
+            ("TOKEN_CACHE", TokenCache()),
+            ("USERINFO_CACHE", UserInfoCache(self.redis)),
+            ("SESSION_TOKENS", None),
+        ]:
+            stack.enter_context(mock.patch.object(self.api, name, value))
+        stack.enter_context(
+            mock.patch.object(self.api.hooks, "ACCOUNT_CACHE", AccountCache())
+        )
+        stack.enter_context(
+            mock.patch.object(self.api.APP, "redis", self.redis, create=True)
+        )
+        stack.enter_context(
+            mock.patch.object(
+                self.api.APP.data, "driver", SimpleNamespace(db=self.database)
+            )
+        )
+        return stack
+
+    def authenticate(self, token: str) -> float:
+        """
+        Runs one token through check_auth inside a request.
+
+        Returns:
+            float -- Seconds taken.
+        """
+        with self.api.APP.test_request_context("/trials"):
+            start = time.perf_counter()
+            authorized = self.api.BearerAuth().check_auth(
+                token, ALLOWED_ROLES, "trials", "GET"
+            )
+            elapsed = time.perf_counter() - start
+        self.assertTrue(authorized)
+        return elapsed
+
+    def measure(self, kind, phase, stand_in, tokens):
+        """
+        Authenticates each token, records the results and checks the call budget.
+        """
+        before = (
+            stand_in.total_calls,
+            self.database.total_calls,
+            self.redis.total_calls,
+        )
+        latencies = [self.authenticate(token) for token in tokens]
+        calls = {
+            "http": (stand_in.total_calls - before[0]) / len(tokens),
+            "mongo": (self.database.total_calls - before[1]) / len(tokens),
+            "redis": (self.redis.total_calls - before[2]) / len(tokens),
+        }
+        self.report.append(
+            (
+                kind,
+                phase,
+                percentile(latencies, 0.5) * 1000,
+                percentile(latencies, 0.95) * 1000,
+                max(latencies) * 1000,
+                calls["http"],
+                calls["mongo"],
+                calls["redis"],
+            )
+        )
+        for source, budget in CALL_BUDGETS[phase].items():
+            self.assertLessEqual(
+                calls[source],
+                budget,
+                "%s %s requests made %.2f %s calls each, budget is %s"
+                % (kind, phase, calls[source], source, budget),
+            )
+
+    def run_scenario(self, kind, issue):
+        """
+        Measures the cold, warm and new token phases for one kind of token.
+        """
+        emails = {"api-user": "api@cidc.test"}
+        with StandInAuth0({"keys": [self.tokens.jwk]}, emails) as stand_in:
+            with self.offline_api(stand_in):
+                token = issue()
+                self.measure(kind, "cold", stand_in, [token])
+                self.measure(kind, "warm", stand_in, [token] * WARM_REQUESTS)
+                fresh = [issue() for _ in range(10)]
+                self.measure(kind, "new_token", stand_in, fresh)
+
+    def test_api_tokens(self):
+        """
+        Tokens for the API audience, which resolve their email through /userinfo.
+        """
+        self.run_scenario("api", lambda: self.tokens.issue("api-user", AUDIENCE))
+
+    def test_portal_tokens(self):
+        """
+        Tokens issued to the portal, which carry the user's email.
+        """
+        self.run_scenario(
+            "portal",
+            lambda: self.tokens.issue(
+                "portal-user", PORTAL_AUDIENCE, email="portal@cidc.test"
+            ),
+        )
+
+    def test_machine_tokens(self):
+        """
+        Client credential tokens used by the celery task manager.
+        """
+        self.run_scenario(
+            "machine",
+            lambda: self.tokens.issue(
+                "celery@clients", AUDIENCE, gty="client-credentials"
+            ),
+        )
@@ -0,0 +1,231 @@
+"""
+Tests for the authentication caches in auth_cache.py
+"""
+import time
+import unittest
+from unittest import mock
+
+from jose import jwt
+
+from auth_cache import AccountCache, JWKSCache, TokenCache, UserInfoCache
+from auth_harness import FakeRedis, make_key
+
+
+class TestJWKSCache(unittest.TestCase):
+    """
+    Tests for JWKSCache.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.pem_a, cls.jwk_a = make_key("a")
+        cls.pem_b, cls.jwk_b = make_key("b")
+
+    def setUp(self):
+        self.key_set = {"keys": [self.jwk_a]}
+        self.fetches = 0
+
+    def fetch(self):
+        self.fetches += 1
+        return self.key_set
+
+    def test_keys_are_fetched_once(self):
+        """
+        Repeated lookups are served from memory.
+        """
+        cache = JWKSCache(self.fetch)
+        for _ in range(5):
+            self.assertIsNotNone(cache.get_key("a"))
+        self.assertEqual(self.fetches, 1)
+
+    def test_parsed_key_verifies_tokens(self):
+        """
+        The cached key object can be handed to jwt.decode directly.
+        """
+        cache = JWKSCache(self.fetch)
+        token = jwt.encode(
+            {"sub": "x"}, self.pem_a, algorithm="RS256", headers={"kid": "a"}
+        )
+        payload = jwt.decode(token, [cache.get_key("a")], algorithms=["RS256"])
+        self.assertEqual(payload["sub"], "x")
+
+    def test_unknown_kid_forces_one_refetch(self):
+        """
+        An unknown kid refetches the key set, but not more than once per interval.
+        """
+        cache = JWKSCache(self.fetch, min_refetch_interval=0)
+        cache.get_key("a")
+        self.key_set = {"keys": [self.jwk_a, self.jwk_b]}
+        self.assertIsNotNone(cache.get_key("b"))
+        self.assertEqual(self.fetches, 2)
+
+        cache.min_refetch_interval = 60
+        self.assertIsNone(cache.get_key("c"))
+        self.assertEqual(self.fetches, 2)
+
+    def test_failed_refresh_keeps_keys(self):
+        """
+        A failing key endpoint does not drop keys that are already cached.
+        """
+        cache = JWKSCache(self.fetch, ttl=0)
+        cache.get_key("a")
+
+        def fail():
+            raise OSError("unreachable")
+
+        cache.fetch = fail
+        self.assertFalse(cache.refresh())
+        self.assertIsNotNone(cache.get_key("a"))
+
+    def test_stale_keys_refresh_in_background(self):
+        """
+        Lookups on a stale cache return immediately and refresh behind the scenes.
+        """
+        cache = JWKSCache(self.fetch, ttl=0)
+        cache.get_key("a")
+        self.assertIsNotNone(cache.get_key("a"))
+        deadline = time.monotonic() + 5
+        while self.fetches < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(self.fetches, 2)
+
+
+class TestTokenCache(unittest.TestCase):
+    """
+    Tests for TokenCache.
+    """
+
+    def test_hit_and_miss_counters(self):
+        """
+        Lookups are counted.
+        """
+        cache = TokenCache()
+        self.assertIsNone(cache.get("token"))
+        cache.put("token", {"sub": "x"}, time.time() + 60)
+        self.assertEqual(cache.get("token"), {"sub": "x"})
+        self.assertEqual(cache.stats()["hits"], 1)
+        self.assertEqual(cache.stats()["misses"], 1)
+
+    def test_stats_are_logged_every_n_lookups(self):
+        """
+        The counters are published as metrics once every log_every lookups.
+        """
+        cache = TokenCache(name="tokens", log_every=2)
+        cache.put("token", {"sub": "x"}, time.time() + 60)
+        with mock.patch("auth_cache.logging.info") as info:
+            for _ in range(5):
+                cache.get("token")
+            cache.get("other")
+        self.assertEqual(info.call_count, 3)
+        self.assertEqual(info.call_args[0][0]["category"], "INFO-EVE-METRICS")
+        self.assertEqual(info.call_args[0][0]["message"]["name"], "tokens")
+        self.assertEqual(info.call_args[0][0]["message"]["misses"], 1)
+
+    def test_expired_entries_are_evicted(self):
+        """
+        Entries are dropped once the token expires and tokens without exp are skipped.
+        """
+        cache = TokenCache()
+        cache.put("token", {"sub": "x"}, time.time() + 0.05)
+        cache.put("no-exp", {"sub": "y"}, None)
+        self.assertEqual(len(cache), 1)
+        time.sleep(0.1)
+        self.assertIsNone(cache.get("token"))
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.stats()["evictions"], 1)
+
+    def test_least_recently_used_is_evicted(self):
+        """
+        The cache stays within maxsize by dropping the least recently used token.
+        """
+        cache = TokenCache(maxsize=2)
+        expires = time.time() + 60
+        cache.put("a", 1, expires)
+        cache.put("b", 2, expires)
+        cache.get("a")
+        cache.put("c", 3, expires)
+        self.assertEqual(cache.get("a"), 1)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("c"), 3)
+
+
+class TestUserInfoCache(unittest.TestCase):
+    """
+    Tests for UserInfoCache.
+    """
+
+    def test_entries_are_shared_through_redis(self):
+        """
+        An email cached by one worker is found by another, then served locally.
+        """
+        shared = FakeRedis()
+        UserInfoCache(shared).put("sub", "a@b.com", time.time() + 60)
+
+        other_worker = UserInfoCache(shared)
+        self.assertEqual(other_worker.get("sub"), "a@b.com")
+        self.assertEqual(other_worker.get("sub"), "a@b.com")
+        self.assertEqual(shared.calls["get"], 1)
+
+    def test_expired_tokens_are_not_cached(self):
+        """
+        Nothing is stored for tokens that are already expired.
+        """
+        shared = FakeRedis()
+        UserInfoCache(shared).put("sub", "a@b.com", time.time() - 1)
+        self.assertFalse(shared.store)
+
+
+class TestAccountCache(unittest.TestCase):
+    """
+    Tests for AccountCache.
+    """
+
+    def test_accounts_are_loaded_once_until_invalidated(self):
+        """
+        An account is read once, and again after it is invalidated.
+        """
+        loads = []
+
+        def load(email):
+            loads.append(email)
+            return {"email": email, "permissions": []}
+
+        cache = AccountCache()
+        cache.get("a@b.com", load)
+        cache.get("a@b.com", load)
+        self.assertEqual(len(loads), 1)
+
+        cache.invalidate("a@b.com")
+        cache.get("a@b.com", load)
+        self.assertEqual(len(loads), 2)
+
+    def test_accounts_are_reloaded_when_their_version_changes(self):
+        """
+        An account cached under one version is reloaded once another worker bumps
+        it, without an invalidation on this worker.
+        """
+        loads = []
+
+        def load(email):
+            loads.append(email)
+            return {"email": email, "role": "reader" if len(loads) == 1 else "disabled"}
+
+        cache = AccountCache()
+        self.assertEqual(cache.get("a@b.com", load, 0)["role"], "reader")
+        self.assertEqual(cache.get("a@b.com", load, 0)["role"], "reader")
+        self.assertEqual(cache.get("a@b.com", load, 1)["role"], "disabled")
+        self.assertEqual(len(loads), 2)
+
+    def test_missing_accounts_are_not_cached(self):
+        """
+        Lookups for unregistered users always go to the database.
+        """
+        loads = []
+
+        def load(email):
+            loads.append(email)
+
+        cache = AccountCache()
+        self.assertIsNone(cache.get("a@b.com", load))
+        self.assertIsNone(cache.get("a@b.com", load))
+        self.assertEqual(len(loads), 2)
@@ -0,0 +1,126 @@
+"""
+Tests for the /batch/<resource> endpoint in ingestion_api.py
+"""
+import json
+import unittest
+
+import mongomock
+import pytest
+from bson import ObjectId
+
+pytest.importorskip("cidc_utils")
+pytest.importorskip("eve_swagger")
+
+# pylint: disable=wrong-import-position
+from auth_harness import as_user, import_app
+
+
+class TestBatchFetch(unittest.TestCase):
+    """
+    Tests for batch_fetch.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.api = import_app()
+
+    def setUp(self):
+        self.database = mongomock.MongoClient().db
+        self.trial, self.assay = ObjectId(), ObjectId()
+        self.ids = (
+            self.database["data"]
+            .insert_many(
+                [
+                    {"trial": self.trial, "assay": self.assay, "visibility": True},
+                    {"trial": ObjectId(), "assay": self.assay, "visibility": True},
+                    {"trial": self.trial, "assay": self.assay, "visibility": False},
+                ]
+            )
+            .inserted_ids
+        )
+        self.account = (
+            self.database["accounts"]
+            .insert_one(
+                {
+                    "email": "reader@cidc.test",
+                    "organization": "CIDC",
+                    "permissions": [
+                        {"trial": self.trial, "assay": self.assay, "role": "read"}
+                    ],
+                }
+            )
+            .inserted_id
+        )
+        self.client = self.api.APP.test_client()
+
+    def fetch(self, email: str, ids: list, resource: str = "data"):
+        """
+        Posts ids to /batch/<resource> as the given user.
+        """
+        with as_user(self.api, email, self.database):
+            return self.client.post(
+                "/batch/%s" % resource,
+                data=json.dumps({"ids": ids}),
+                content_type="application/json",
+                headers={"Authorization": "Bearer token"},
+            )
+
+    def test_workers_fetch_many_documents(self):
+        """
+        The task manager resolves every id in one call, and learns which are gone
+        or hidden.
+        """
+        gone = str(ObjectId())
+        response = self.fetch(
+            "celery-taskmanager", [str(_id) for _id in self.ids] + [gone]
+        )
+        self.assertEqual(response.status_code, 200)
+        body = response.get_json()
+        self.assertEqual(
+            sorted(item["_id"] for item in body["_items"]),
+            sorted(str(_id) for _id in self.ids[:2]),
+        )
+        self.assertEqual(body["_missing"], [str(self.ids[2]), gone])
+
+    def test_permissions_apply(self):
+        """
+        Other users only receive the documents they may read.
+        """
+        response = self.fetch("reader@cidc.test", [str(_id) for _id in self.ids])
+        self.assertEqual(
+            [item["_id"] for item in response.get_json()["_items"]], [str(self.ids[0])]
+        )
+
+    def test_invalid_ids_are_rejected(self):
+        """
+        Malformed requests are refused.
+        """
+        self.assertEqual(self.fetch("celery-taskmanager", ["nope"]).status_code, 400)
+        self.assertEqual(self.fetch("celery-taskmanager", "nope").status_code, 400)
+
+    def test_projection_applies(self):
+        """
+        Documents come back with the fields a GET on the resource returns.
+        """
+        response = self.fetch(
+            "celery-taskmanager", [str(self.account)], resource="accounts_info"
+        )
+        (account,) = response.get_json()["_items"]
+        self.assertEqual(account["organization"], "CIDC")
+        self.assertNotIn("permissions", account)
+
+        response = self.fetch(
+            "celery-taskmanager", [str(self.ids[0])], resource="data_vis"
+        )
+        (document,) = response.get_json()["_items"]
+        self.assertEqual(document["visibility"], True)
+        self.assertNotIn("trial", document)
+
+    def test_resources_without_get_are_refused(self):
+        """
+        Resources that cannot be listed are not served.
+        """
+        response = self.fetch(
+            "someone@cidc.test", [str(self.account)], resource="accounts_create"
+        )
+        self.assertEqual(response.status_code, 405)
@@ -0,0 +1,135 @@
+"""
+Tests for the /manifest/<resource> endpoint in ingestion_api.py
+"""
+import json
+import unittest
+from unittest import mock
+
+import mongomock
+import pytest
+from bson import ObjectId
+
+pytest.importorskip("cidc_utils")
+pytest.importorskip("eve_swagger")
+
+# pylint: disable=wrong-import-position
+from auth_harness import as_user, import_app
+
+
+class TestDownloadManifest(unittest.TestCase):
+    """
+    Tests for download_manifest.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.api = import_app()
+
+    def setUp(self):
+        self.database = mongomock.MongoClient().db
+        self.database["data"].delete_many({})
+        self.trial, self.assay, self.other = ObjectId(), ObjectId(), ObjectId()
+        self.database["data"].insert_many(
+            [
+                {
+                    "trial": self.trial,
+                    "assay": assay,
+                    "file_name": "%s_%s" % (name, index),
+                    "gs_uri": "gs://bucket/%s_%s" % (name, index),
+                    "visibility": True,
+                }
+                for assay, name in [(self.assay, "wes"), (self.other, "olink")]
+                for index in range(250)
+            ]
+        )
+        self.database["accounts"].delete_many({})
+        self.database["accounts"].insert_one(
+            {
+                "email": "reader@cidc.test",
+                "permissions": [
+                    {"trial": self.trial, "assay": self.assay, "role": "read"}
+                ],
+            }
+        )
+        self.client = self.api.APP.test_client()
+
+    def get(self, email: str, query: str, resource: str = "data"):
+        """
+        Requests a manifest of a resource as the given user.
+        """
+
+        def sign_many(bucket, blobs):
+            return ["https://signed/%s" % blob for blob in blobs]
+
+        with as_user(self.api, email, self.database), mock.patch.object(
+            self.api.hooks.SIGNED_URL_CACHE, "get_many", side_effect=sign_many
+        ), mock.patch.object(self.api, "GOOGLE_URL", "gs://"), mock.patch.object(
+            self.api, "GOOGLE_BUCKET_NAME", "bucket"
+        ):
+            response = self.client.get(
+                "/manifest/%s?%s" % (resource, query),
+                headers={"Authorization": "Bearer token"},
+            )
+            response.body = response.get_data(as_text=True)
+        return response
+
+    def test_ndjson_manifest(self):
+        """
+        The manifest lists every permitted file of the trial with a download link.
+        """
+        response = self.get("reader@cidc.test", "trial=%s" % self.trial)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, "application/x-ndjson")
+        rows = [json.loads(line) for line in response.body.splitlines()]
+        self.assertEqual(len(rows), 250)
+        self.assertTrue(all(row["file_name"].startswith("wes_") for row in rows))
+        self.assertTrue(rows[0]["download_link"].startswith("https://signed/"))
+
+    def test_tsv_manifest_for_assay(self):
+        """
+        Selecting an assay narrows the manifest, and TSV adds a header.
+        """
+        response = self.get(
+            "celery-taskmanager",
+            "trial=%s&assay=%s&format=tsv" % (self.trial, self.other),
+        )
+        lines = response.body.splitlines()
+        self.assertEqual(response.mimetype, "text/tab-separated-values")
+        self.assertEqual(len(lines), 251)
+        self.assertTrue(lines[0].startswith("_id\tfile_name"))
+
+    def test_invalid_requests(self):
+        """
+        A trial is required, and ids and formats are checked.
+        """
+        self.assertEqual(self.get("celery-taskmanager", "").status_code, 400)
+        self.assertEqual(self.get("celery-taskmanager", "trial=x").status_code, 400)
+        self.assertEqual(
+            self.get(
+                "celery-taskmanager", "trial=%s&format=csv" % self.trial
+            ).status_code,
+            400,
+        )
+
+    def test_hidden_files_are_not_listed(self):
+        """
+        Hidden files are left out, and resources that would list them are refused.
+        """
+        self.database["data"].insert_one(
+            {
+                "trial": self.trial,
+                "assay": self.assay,
+                "file_name": "hidden",
+                "gs_uri": "gs://bucket/hidden",
+                "visibility": False,
+            }
+        )
+        query = "trial=%s&assay=%s" % (self.trial, self.assay)
+        response = self.get("reader@cidc.test", query)
+        self.assertEqual(len(response.body.splitlines()), 250)
+        self.assertNotIn("hidden", response.body)
+        for resource, status in [("data_vis", 404), ("data_edit", 405)]:
+            with self.subTest(resource=resource):
+                response = self.get("reader@cidc.test", query, resource=resource)
+                self.assertEqual(response.status_code, status)
+                self.assertNotIn("hidden", response.body)
@@ -0,0 +1,83 @@
+"""
+Tests for duplicate detection in duplicates.py
+"""
+import unittest
+
+import mongomock
+from bson import ObjectId
+
+from auth_harness import CountingDatabase
+from duplicates import find_duplicate_files, group_by_trial_assay
+
+
+class TestFindDuplicateFiles(unittest.TestCase):
+    """
+    Tests for find_duplicate_files.
+    """
+
+    def setUp(self):
+        self.database = CountingDatabase()
+        self.data = self.database["data"]
+        self.trial, self.assay, self.other = ObjectId(), ObjectId(), ObjectId()
+        self.database.database["data"].insert_many(
+            [
+                {
+                    "trial": self.trial,
+                    "assay": self.assay,
+                    "file_name": "a",
+                    "visibility": True,
+                },
+                {
+                    "trial": self.trial,
+                    "assay": self.assay,
+                    "file_name": "b",
+                    "visibility": False,
+                },
+                {
+                    "trial": self.trial,
+                    "assay": self.other,
+                    "file_name": "c",
+                    "visibility": True,
+                },
+            ]
+        )
+        self.database.calls.clear()
+
+    def upload(self, assay, *names):
+        return [
+            {"trial": str(self.trial), "assay": str(assay), "file_name": name}
+            for name in names
+        ]
+
+    def test_only_visible_files_in_same_trial_and_assay(self):
+        """
+        Hidden files and files of another assay are not duplicates.
+        """
+        items = self.upload(self.assay, "a", "b", "c") + self.upload(
+            self.other, "a", "c"
+        )
+        self.assertEqual(sorted(find_duplicate_files(self.data, items)), ["a", "c"])
+        self.assertEqual(self.database.total_calls, 2)
+
+    def test_large_uploads_are_chunked(self):
+        """
+        Each query carries at most chunk_size file names.
+        """
+        names = ["f%s" % index for index in range(25)] + ["a"]
+        self.assertEqual(
+            find_duplicate_files(self.data, self.upload(self.assay, *names), 10), ["a"]
+        )
+        self.assertEqual(self.database.total_calls, 3)
+
+    def test_grouping_drops_repeats(self):
+        """
+        A file named twice in an upload is looked up once.
+        """
+        groups = group_by_trial_assay(self.upload(self.assay, "x", "y", "x"))
+        self.assertEqual(list(groups.values()), [["x", "y"]])
+
+    def test_empty_upload(self):
+        """
+        Nothing is queried for an empty upload.
+        """
+        self.assertEqual(find_duplicate_files(mongomock.MongoClient().db.data, []), [])
@@ -0,0 +1,129 @@
+"""
+Benchmark of duplicate detection for uploads of 10 to 10k files: the previous single
+$or query against the grouped $in queries of find_duplicate_files. Runs on mongomock,
+or against a real server when DUPLICATES_BENCH_MONGO_URI is set, in which case the
+indexes from the data schema are created first.
+"""
+import os
+import sys
+import time
+import unittest
+
+import mongomock
+import pymongo
+from bson import ObjectId
+
+from duplicates import find_duplicate_files
+from indexes import declared_indexes
+from schemas.data import DATA
+
+SIZES = [10, 100, 1000, 10000]
+MONGO_URI = os.environ.get("DUPLICATES_BENCH_MONGO_URI")
+# The $or query is evaluated clause by clause on mongomock, keep it to sizes that
+# finish quickly there.
+LEGACY_MAX = 10000 if MONGO_URI else 100
+TRIALS, ASSAYS = 3, 4
+EXISTING = int(os.environ.get("DUPLICATES_BENCH_EXISTING", 100))
+
+
+def legacy_find_duplicates(collection, items):
+    """
+    The query hooks.find_duplicates made before find_duplicate_files.
+    """
+    query = {
+        "$or": [
+            {
+                "assay": ObjectId(record["assay"]),
+                "trial": ObjectId(record["trial"]),
+                "file_name": record["file_name"],
+                "visibility": True,
+            }
+            for record in items
+        ]
+    }
+    return [x["file_name"] for x in collection.find(query, projection=["file_name"])]
+
+
+class TestDuplicatesBenchmark(unittest.TestCase):
+    """
+    Latency of duplicate detection by upload size.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        if MONGO_URI:
+            cls.client = pymongo.MongoClient(MONGO_URI)
+        else:
+            cls.client = mongomock.MongoClient()
+        cls.collection = cls.client["duplicates_benchmark"]["data"]
+        cls.collection.drop()
+        for name, (keys, options) in declared_indexes({"data": DATA})["data"].items():
+            cls.collection.create_index(keys, name=name, **options)
+
+        cls.pairs = [(ObjectId(), ObjectId()) for _ in range(TRIALS * ASSAYS)]
+        cls.collection.insert_many(
+            [
+                {
+                    "trial": trial,
+                    "assay": assay,
+                    "file_name": "existing_%s.fastq" % index,
+                    "visibility": index % 10 != 0,
+                }
+                for trial, assay in cls.pairs
+                for index in range(EXISTING)
+            ]
+        )
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.collection.drop()
+
+    def upload(self, size: int) -> list:
+        """
+        Builds an upload spread over every trial and assay, with one file in five
+        named like an existing one.
+        """
+        items = []
+        for index in range(size):
+            trial, assay = self.pairs[index % len(self.pairs)]
+            name = "existing_%s.fastq" if index % 5 == 0 else "new_%s.fastq"
+            items.append(
+                {
+                    "trial": str(trial),
+                    "assay": str(assay),
+                    "file_name": name % (index // len(self.pairs) % EXISTING),
+                }
+            )
+        return items
+
+    @staticmethod
+    def timed(function, *args) -> tuple:
+        start = time.perf_counter()
+        result = function(*args)
+        return time.perf_counter() - start, result
+
+    def test_latency_by_upload_size(self):
+        """
+        Reports the latency of both queries per upload size and checks they agree.
+        """
+        lines = [
+            "",
+            "duplicate detection (ms, %s)" % ("mongod" if MONGO_URI else "mongomock"),
+        ]
+        lines.append("%8s %12s %12s %10s" % ("files", "$or", "grouped $in", "dups"))
+        for size in SIZES:
+            items = self.upload(size)
+            grouped, duplicates = self.timed(
+                find_duplicate_files, self.collection, items
+            )
+            legacy = "-"
+            if size <= LEGACY_MAX:
+                elapsed, expected = self.timed(
+                    legacy_find_duplicates, self.collection, items
+                )
+                self.assertEqual(sorted(set(duplicates)), sorted(set(expected)))
+                legacy = "%.2f" % (elapsed * 1000)
+            lines.append(
+                "%8s %12s %12.2f %10s" % (size, legacy, grouped * 1000, len(duplicates))
+            )
+        sys.stderr.write("\n".join(lines) + "\n")
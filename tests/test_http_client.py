@@ -0,0 +1,116 @@
+"""
+Tests for the outbound HTTP client in http_client.py
+"""
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from unittest import mock
+
+import requests
+
+from http_client import CircuitBreaker, CircuitOpenError, OutboundClient
+
+
+class Handler(BaseHTTPRequestHandler):
+    """
+    Answers /ok with 200 and anything else with 503.
+    """
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        self.send_response(200 if self.path == "/ok" else 503)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        pass
+
+
+class TestCircuitBreaker(unittest.TestCase):
+    """
+    Tests for CircuitBreaker.
+    """
+
+    def test_opens_after_threshold_and_allows_one_trial(self):
+        """
+        The circuit opens after consecutive failures, then lets one trial call through.
+        """
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0)
+        breaker.record_failure()
+        self.assertEqual(breaker.state, "closed")
+        breaker.record_failure()
+        self.assertEqual(breaker.state, "half-open")
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+        breaker.record_success()
+        self.assertEqual(breaker.state, "closed")
+
+    def test_stays_open_until_reset_timeout(self):
+        """
+        Calls are rejected while the circuit is open.
+        """
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=60)
+        breaker.record_failure()
+        self.assertEqual(breaker.state, "open")
+        self.assertFalse(breaker.allow())
+
+
+class TestOutboundClient(unittest.TestCase):
+    """
+    Tests for OutboundClient against a local server.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = HTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.base_url = "http://127.0.0.1:%s" % cls.server.server_port
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def test_server_errors_open_the_circuit(self):
+        """
+        Repeated 5xx responses open the circuit, after which calls fail fast.
+        """
+        client = OutboundClient(
+            self.base_url, failure_threshold=2, reset_timeout=60, log_every=3
+        )
+        with mock.patch("http_client.logging.info") as info:
+            self.assertEqual(client.get("/ok").status_code, 200)
+            client.get("/down")
+            client.get("/down")
+        with self.assertRaises(CircuitOpenError):
+            client.get("/ok")
+        stats = client.stats()
+        self.assertEqual(stats["calls"], 3)
+        self.assertEqual(stats["errors"], 2)
+        self.assertEqual(stats["rejected"], 1)
+        self.assertEqual(stats["circuit"], "open")
+        self.assertEqual(stats["latency"]["name"], "outbound_127.0.0.1")
+        self.assertEqual(stats["latency"]["count"], 3)
+        self.assertEqual(info.call_count, 1)
+        self.assertEqual(info.call_args[0][0]["category"], "INFO-EVE-METRICS")
+
+    def test_connection_errors_are_failures(self):
+        """
+        Unreachable hosts raise and count against the circuit.
+        """
+        client = OutboundClient("http://127.0.0.1:1", timeout=1, failure_threshold=1)
+        with self.assertRaises(requests.RequestException):
+            client.get("/")
+        self.assertEqual(client.stats()["circuit"], "open")
+
+    def test_other_exceptions_end_the_trial(self):
+        """
+        An unexpected exception during the half-open trial reopens the circuit
+        instead of leaving the trial in flight.
+        """
+        client = OutboundClient(self.base_url, failure_threshold=1, reset_timeout=0)
+        client.get("/down")
+        with mock.patch.object(client.session, "get", side_effect=ValueError):
+            with self.assertRaises(ValueError):
+                client.get("/ok")
+        self.assertEqual(client.get("/ok").status_code, 200)
+        self.assertEqual(client.stats()["circuit"], "closed")
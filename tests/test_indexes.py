@@ -0,0 +1,188 @@
+"""
+Tests for the index reconciler in indexes.py. Runs on mongomock, or against a real
+server when INDEXES_TEST_MONGO_URI is set.
+"""
+import os
+import unittest
+from unittest import mock
+
+import mongomock
+import pymongo
+
+import settings
+from indexes import declared_indexes, reconcile, reconcile_in_background
+
+MONGO_URI = os.environ.get("INDEXES_TEST_MONGO_URI")
+
+
+class TestDeclaredIndexes(unittest.TestCase):
+    """
+    Tests for declared_indexes.
+    """
+
+    def test_domain_declares_hot_lookups(self):
+        """
+        The lookups every request makes have an index, and resources sharing a
+        collection declare them once.
+        """
+        declared = declared_indexes(settings.DOMAIN)
+        expected = {
+            "accounts": [("email", 1)],
+            "last_access": [("email", 1)],
+            "data": [("trial", 1), ("assay", 1), ("visibility", 1)],
+            "ingestion": [("started_by", 1)],
+            "trials": [("locked", 1)],
+            "olink": [("trial", 1), ("assay", 1)],
+        }
+        for source, keys in expected.items():
+            with self.subTest(source=source):
+                self.assertIn(keys, [index[0] for index in declared[source].values()])
+        self.assertNotIn("accounts_info", declared)
+        self.assertNotIn("data_vis", declared)
+
+    def test_eve_builds_no_unique_index(self):
+        """
+        Unique indexes are only built by the reconciler, so duplicates cannot keep
+        the API from starting.
+        """
+        for resource, resource_settings in settings.DOMAIN.items():
+            if resource == "gene_symbols":
+                # Static reference data, whose index predates the reconciler.
+                continue
+            for name, value in resource_settings.get("mongo_indexes", {}).items():
+                options = value[1] if isinstance(value, tuple) else {}
+                with self.subTest(resource=resource, index=name):
+                    self.assertFalse(options.get("unique"))
+
+    def test_both_keys_are_read(self):
+        """
+        Declarations of mongo_indexes and background_indexes are collected
+        together.
+        """
+        domain = {
+            "a": {
+                "mongo_indexes": {"x": [("x", 1)]},
+                "background_indexes": {"y": ([("y", 1)], {"unique": True})},
+            }
+        }
+        self.assertEqual(
+            declared_indexes(domain),
+            {"a": {"x": ([("x", 1)], {}), "y": ([("y", 1)], {"unique": True})}},
+        )
+
+    def test_conflicting_declarations(self):
+        """
+        Two resources may not declare one index name differently.
+        """
+        domain = {
+            "a": {"mongo_indexes": {"index": [("x", 1)]}},
+            "b": {
+                "datasource": {"source": "a"},
+                "mongo_indexes": {"index": [("y", 1)]},
+            },
+        }
+        with self.assertRaises(ValueError):
+            declared_indexes(domain)
+
+    def test_conflicts_are_logged_at_startup(self):
+        """
+        A conflicting declaration is logged by the startup thread rather than lost
+        with it.
+        """
+        app = mock.MagicMock()
+        app.config = {
+            "DOMAIN": {
+                "a": {"mongo_indexes": {"index": [("x", 1)]}},
+                "b": {
+                    "datasource": {"source": "a"},
+                    "mongo_indexes": {"index": [("y", 1)]},
+                },
+            }
+        }
+        with mock.patch("indexes.logging.error") as error:
+            reconcile_in_background(app).join()
+        self.assertEqual(error.call_args[0][0]["category"], "ERROR-EVE-INDEXES")
+
+
+class TestReconcile(unittest.TestCase):
+    """
+    Tests for reconcile.
+    """
+
+    def setUp(self):
+        if MONGO_URI:
+            client = pymongo.MongoClient(MONGO_URI)
+            client.drop_database("indexes_test")
+            self.addCleanup(client.drop_database, "indexes_test")
+        else:
+            client = mongomock.MongoClient()
+            # mongomock has no $indexStats; a server without it fails the same way.
+            patcher = mock.patch.object(
+                mongomock.collection.Collection,
+                "aggregate",
+                side_effect=pymongo.errors.OperationFailure("$indexStats"),
+            )
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.database = client["indexes_test"]
+        self.declared = declared_indexes(settings.DOMAIN)
+
+    def test_missing_indexes_are_built_once(self):
+        """
+        The first run builds every declared index, and the next one finds nothing to
+        do.
+        """
+        report = reconcile(self.database, self.declared)
+        for source, indexes in self.declared.items():
+            with self.subTest(source=source):
+                self.assertEqual(report[source]["created"], sorted(indexes))
+                self.assertLessEqual(
+                    set(indexes), set(self.database[source].index_information())
+                )
+        self.assertTrue(
+            self.database["accounts"].index_information()["email"]["unique"]
+        )
+        report = reconcile(self.database, self.declared)
+        self.assertFalse(
+            any(entry["created"] or entry["missing"] for entry in report.values())
+        )
+
+    def test_dry_run_reports_missing(self):
+        """
+        Without create, missing indexes are only reported.
+        """
+        report = reconcile(self.database, self.declared, create=False)
+        self.assertEqual(report["trials"]["missing"], ["locked", "trial_name"])
+        self.assertEqual(self.database["trials"].index_information().keys(), set())
+
+    def test_undeclared_and_conflicting(self):
+        """
+        Indexes nobody declared, and declared ones built with other keys, are reported
+        and left in place.
+        """
+        trials = self.database["trials"]
+        trials.create_index([("principal_investigator", 1)], name="pi")
+        trials.create_index([("locked", -1)], name="locked")
+        report = reconcile(self.database, self.declared)
+        self.assertEqual(report["trials"]["undeclared"], ["pi"])
+        self.assertEqual(report["trials"]["conflicting"], ["locked"])
+        self.assertEqual(report["trials"]["created"], ["trial_name"])
+        self.assertEqual(trials.index_information()["locked"]["key"], [("locked", -1)])
+
+    def test_unused_indexes(self):
+        """
+        Indexes without operations since the server started are reported as unused.
+        """
+        if MONGO_URI:
+            self.skipTest("Usage counts of a real server are not controlled here")
+        reconcile(self.database, self.declared)
+        stats = [
+            {"name": "_id_", "accesses": {"ops": 0}},
+            {"name": "locked", "accesses": {"ops": 12}},
+            {"name": "trial_name", "accesses": {"ops": 0}},
+        ]
+        with mock.patch.object(
+            mongomock.collection.Collection, "aggregate", return_value=stats
+        ):
+            report = reconcile(self.database, self.declared)
+        self.assertEqual(report["trials"]["unused"], ["trial_name"])
@@ -0,0 +1,69 @@
+"""
+Tests for the upload job files collection in ingestion_files.py
+"""
+import unittest
+
+import mongomock
+from bson import ObjectId
+
+from ingestion_files import (
+    counter_updates,
+    file_documents,
+    files_href,
+    insert_files,
+    job_files,
+)
+
+
+class TestIngestionFiles(unittest.TestCase):
+    """
+    Tests for storing and reading the files of a job.
+    """
+
+    def setUp(self):
+        self.files = mongomock.MongoClient().db["ingestion_files"]
+        self.files.create_index([("job", 1), ("file_name", 1)], unique=True)
+        self.job = ObjectId()
+
+    def test_files_round_trip(self):
+        """
+        Entries read back as posted, without storage fields.
+        """
+        entries = [{"file_name": "a", "trial": ObjectId()}, {"file_name": "b"}]
+        documents = file_documents(self.job, "uploader@cidc.test", entries)
+        self.assertEqual(insert_files(self.files, documents), [])
+        self.assertEqual(job_files(self.files, self.job), entries)
+        self.assertEqual(job_files(self.files, ObjectId()), [])
+
+    def test_files_href(self):
+        """
+        Files are paged under their job.
+        """
+        self.assertEqual(files_href(self.job), "ingestion/%s/files" % self.job)
+
+    def test_duplicate_names_in_a_job(self):
+        """
+        Files the job already has are reported, the rest are written.
+        """
+        insert_files(self.files, file_documents(self.job, "u", [{"file_name": "a"}]))
+        documents = file_documents(
+            self.job, "u", [{"file_name": "b"}, {"file_name": "a"}, {"file_name": "c"}]
+        )
+        self.assertEqual(insert_files(self.files, documents), [1])
+        self.assertEqual(
+            [entry["file_name"] for entry in job_files(self.files, self.job)],
+            ["a", "b", "c"],
+        )
+        other_job = file_documents(ObjectId(), "u", [{"file_name": "a"}])
+        self.assertEqual(insert_files(self.files, other_job), [])
+
+    def test_counter_updates(self):
+        """
+        A status change moves a file from one counter to another.
+        """
+        self.assertEqual(counter_updates(None, "In Progress"), {"files_in_progress": 1})
+        self.assertEqual(
+            counter_updates("In Progress", "Completed"),
+            {"files_in_progress": -1, "files_completed": 1},
+        )
+        self.assertEqual(counter_updates("Completed", "Completed"), {})
@@ -0,0 +1,145 @@
+"""
+Tests for upload jobs and their files sub-resource, through the API.
+"""
+import json
+import unittest
+from unittest import mock
+
+import mongomock
+import pytest
+from bson import ObjectId
+
+pytest.importorskip("cidc_utils")
+pytest.importorskip("eve_swagger")
+
+# pylint: disable=wrong-import-position
+from auth_harness import as_user, import_app
+from trial_locks import TrialLockCache
+
+
+class TestIngestionJobs(unittest.TestCase):
+    """
+    Tests for /ingestion and /ingestion/<job>/files.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.api = import_app()
+
+    def setUp(self):
+        self.database = mongomock.MongoClient().db
+        self.database["ingestion_files"].create_index(
+            [("job", 1), ("file_name", 1)], unique=True
+        )
+        self.trial, self.assay = ObjectId(), ObjectId()
+        self.database["trials"].insert_one({"_id": self.trial, "locked": False})
+        self.client = self.api.APP.test_client()
+        self.email = "uploader@cidc.test"
+        patches = [
+            mock.patch.object(self.api.hooks, "TRIAL_LOCK_CACHE", TrialLockCache()),
+            mock.patch.object(self.api.hooks, "start_celery_task"),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def request(self, method: str, url: str, body: dict = None, **headers):
+        headers["Authorization"] = "Bearer token"
+        with as_user(self.api, self.email, self.database):
+            return self.client.open(
+                url,
+                method=method,
+                data=json.dumps(body) if body is not None else None,
+                content_type="application/json",
+                headers=headers,
+            )
+
+    def post_job(self, names: list):
+        files = [
+            {
+                "trial": str(self.trial),
+                "assay": str(self.assay),
+                "file_name": name,
+                "uuid_alias": name,
+            }
+            for name in names
+        ]
+        return self.request(
+            "POST", "/ingestion", {"number_of_files": len(files), "files": files}
+        )
+
+    def test_files_are_stored_apart_and_paged(self):
+        """
+        The job keeps counters, and its files are paged under the job.
+        """
+        response = self.post_job(["f%s" % number for number in range(5)])
+        self.assertEqual(response.status_code, 201, response.get_data())
+        job_id = response.get_json()["_id"]
+
+        job = self.database["ingestion"].find_one({"_id": ObjectId(job_id)})
+        self.assertNotIn("files", job)
+        self.assertEqual((job["number_of_files"], job["files_completed"]), (5, 0))
+        self.assertEqual(self.database["ingestion_files"].count_documents({}), 5)
+
+        page = self.request(
+            "GET", "/ingestion/%s/files?max_results=2&page=3" % job_id
+        ).get_json()
+        self.assertEqual([item["file_name"] for item in page["_items"]], ["f4"])
+        self.assertEqual(page["_meta"]["total"], 5)
+
+        self.email = "someone@cidc.test"
+        page = self.request("GET", "/ingestion/%s/files" % job_id).get_json()
+        self.assertEqual(page["_items"], [])
+
+    def test_file_status_updates_job_counters(self):
+        """
+        Patching a file's status moves it between the job's counters.
+        """
+        job_id = self.post_job(["a", "b"]).get_json()["_id"]
+        url = "/ingestion/%s/files" % job_id
+        item = self.request("GET", url).get_json()["_items"][0]
+
+        for progress in ["In Progress", "Completed"]:
+            response = self.request(
+                "PATCH",
+                "%s/%s" % (url, item["_id"]),
+                {"status": {"progress": progress}},
+                **{"If-Match": item["_etag"]}
+            )
+            self.assertEqual(response.status_code, 200, response.get_data())
+            item["_etag"] = response.get_json()["_etag"]
+
+        job = self.database["ingestion"].find_one({"_id": ObjectId(job_id)})
+        self.assertEqual((job["files_in_progress"], job["files_completed"]), (0, 1))
+
+    def test_duplicate_names_are_refused(self):
+        """
+        A job cannot list the same file twice.
+        """
+        self.assertEqual(self.post_job(["a", "a"]).status_code, 409)
+        self.assertEqual(self.database["ingestion"].count_documents({}), 0)
+
+    def test_large_jobs_are_sent_with_a_link_to_their_files(self):
+        """
+        Tasks get the files of jobs, and with TASK_FILES_BY_LINK set, a link to page
+        those of jobs past TASK_INLINE_MAX_BYTES.
+        """
+        job_id = ObjectId(self.post_job(["a", "b", "c"]).get_json()["_id"])
+        job = self.database["ingestion"].find_one({"_id": job_id})
+        start = self.api.hooks.start_celery_task
+        config = {"GOOGLE_URL": "gs://", "GOOGLE_FOLDER_PATH": "bucket"}
+        with as_user(
+            self.api, self.email, self.database
+        ), self.api.APP.app_context(), mock.patch.dict(self.api.APP.config, config):
+            self.api.hooks.process_data_upload({}, job)
+            with mock.patch.object(self.api.hooks, "TASK_INLINE_MAX_BYTES", 100):
+                with mock.patch("hooks.logging.warning") as warning:
+                    self.api.hooks.process_data_upload({}, job)
+                with mock.patch.object(self.api.hooks, "TASK_FILES_BY_LINK", True):
+                    self.api.hooks.process_data_upload({}, job)
+        small, unlinked, large = [call[0][1][0] for call in start.call_args_list]
+        self.assertEqual([entry["file_name"] for entry in small["files"]], list("abc"))
+        self.assertEqual(unlinked, small)
+        self.assertEqual(warning.call_count, 1)
+        self.assertNotIn("files", large)
+        self.assertEqual(large["files_href"], "ingestion/%s/files" % job_id)
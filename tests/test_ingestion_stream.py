@@ -0,0 +1,191 @@
+"""
+Tests for streaming ingestion in ingestion_stream.py
+"""
+import io
+import json
+import unittest
+
+from bson import ObjectId
+
+from ingestion_stream import (
+    DUPLICATE_MESSAGE,
+    IN_JOB_MESSAGE,
+    LOCKED_MESSAGE,
+    ingest,
+    read_lines,
+)
+
+
+def validate(entry: dict) -> dict:
+    """
+    Requires a file name and ObjectId trial and assay.
+    """
+    issues = {
+        field: "required field"
+        for field in ("trial", "assay", "file_name")
+        if field not in entry
+    }
+    issues.update(
+        {
+            field: "must be of objectid type"
+            for field in ("trial", "assay")
+            if field in entry and not isinstance(entry[field], ObjectId)
+        }
+    )
+    return issues or None
+
+
+class TestReadLines(unittest.TestCase):
+    """
+    Tests for read_lines.
+    """
+
+    def test_long_lines_are_skipped(self):
+        """
+        Lines over the limit are reported without being kept, blank lines are
+        dropped and numbering follows the body.
+        """
+        body = b'{"a": 1}\n\n' + b"x" * 100 + b'\n{"b": 2}'
+        self.assertEqual(
+            list(read_lines(io.BytesIO(body), 16)),
+            [(1, b'{"a": 1}\n'), (3, None), (4, b'{"b": 2}')],
+        )
+
+
+class TestIngest(unittest.TestCase):
+    """
+    Tests for ingest.
+    """
+
+    def setUp(self):
+        self.trial, self.locked, self.assay = ObjectId(), ObjectId(), ObjectId()
+        self.batches = []
+        self.lock_checks = []
+        self.duplicate_checks = []
+
+    def find_locked(self, trials):
+        self.lock_checks.append(set(trials))
+        return {self.locked} & set(trials)
+
+    def find_duplicates(self, entries):
+        self.duplicate_checks.append(len(entries))
+        return [
+            (entry["trial"], entry["assay"], entry["file_name"])
+            for entry in entries
+            if entry["file_name"].startswith("dup")
+        ]
+
+    def run_lines(self, entries, batch_size=2):
+        lines = [
+            (number, entry if isinstance(entry, bytes) else json.dumps(entry).encode())
+            for number, entry in enumerate(entries, 1)
+        ]
+        return list(
+            ingest(
+                lines,
+                validate,
+                self.find_locked,
+                self.find_duplicates,
+                self.batches.append,
+                batch_size=batch_size,
+            )
+        )
+
+    def entry(self, name, trial=None):
+        return {
+            "trial": str(trial or self.trial),
+            "assay": str(self.assay),
+            "file_name": name,
+        }
+
+    def test_errors_per_line(self):
+        """
+        Each bad line gets its own error, and the rest are written in batches.
+        """
+        events = self.run_lines(
+            [
+                self.entry("a"),
+                b"{not json",
+                {"file_name": "b"},
+                self.entry("dup"),
+                self.entry("c", self.locked),
+                self.entry("d"),
+                [1],
+            ]
+        )
+        errors = {event["_line"]: event["_issues"] for event in events[:-1]}
+        self.assertEqual(sorted(errors), [2, 3, 4, 5, 7])
+        self.assertEqual(errors[3]["trial"], "required field")
+        self.assertEqual(errors[4], {"file_name": DUPLICATE_MESSAGE})
+        self.assertEqual(errors[5], {"trial": LOCKED_MESSAGE})
+        self.assertEqual(events[-1], {"_status": "OK", "accepted": 2, "rejected": 5})
+        self.assertEqual(
+            [[entry["file_name"] for entry in batch] for batch in self.batches],
+            [["a"], ["d"]],
+        )
+        self.assertIsInstance(self.batches[0][0]["trial"], ObjectId)
+
+    def test_first_error_before_later_lines_are_read(self):
+        """
+        A schema error is yielded before the lines after it are read.
+        """
+        read = []
+
+        def lines():
+            for number, entry in enumerate([{"file_name": "x"}, self.entry("a")], 1):
+                read.append(number)
+                yield number, json.dumps(entry).encode()
+
+        events = ingest(
+            lines(),
+            validate,
+            self.find_locked,
+            self.find_duplicates,
+            self.batches.append,
+        )
+        self.assertEqual(next(events)["_line"], 1)
+        self.assertEqual(read, [1])
+
+    def test_checks_are_batched(self):
+        """
+        Locks and duplicates are checked once per batch, and batches stay bounded.
+        """
+        self.run_lines([self.entry("f%s" % number) for number in range(10)], 4)
+        self.assertEqual([len(batch) for batch in self.batches], [4, 4, 2])
+        self.assertEqual(self.lock_checks, [{self.trial}] * 3)
+        self.assertEqual(self.duplicate_checks, [4, 4, 2])
+
+    def test_files_already_in_the_job(self):
+        """
+        Entries the writer could not store are reported by line.
+        """
+        stored = set()
+
+        def write_batch(entries):
+            not_written = [
+                index
+                for index, entry in enumerate(entries)
+                if entry["file_name"] in stored
+            ]
+            stored.update(entry["file_name"] for entry in entries)
+            return not_written
+
+        lines = [
+            (number, json.dumps(self.entry(name)).encode())
+            for number, name in enumerate(["a", "b", "a", "c"], 1)
+        ]
+        events = list(
+            ingest(
+                lines,
+                validate,
+                self.find_locked,
+                self.find_duplicates,
+                write_batch,
+                batch_size=2,
+            )
+        )
+        self.assertEqual(
+            events[0],
+            {"_line": 3, "_status": "ERR", "_issues": {"file_name": IN_JOB_MESSAGE}},
+        )
+        self.assertEqual(events[-1], {"_status": "OK", "accepted": 3, "rejected": 1})
@@ -0,0 +1,95 @@
+"""
+Tests for document-level permission filtering of item requests.
+"""
+import json
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+import pytest
+from bson import ObjectId
+
+pytest.importorskip("cidc_utils")
+pytest.importorskip("eve_swagger")
+
+# pylint: disable=wrong-import-position
+from auth_harness import CountingDatabase, as_user, import_app
+
+
+class TestItemPermissions(unittest.TestCase):
+    """
+    Tests for item GETs through filter_on_id.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.api = import_app()
+
+    def setUp(self):
+        self.counting = CountingDatabase()
+        database = self.counting.database
+        self.trial, self.assay, self.other = ObjectId(), ObjectId(), ObjectId()
+        self.documents = {
+            name: database["data"]
+            .insert_one(dict(fields, visibility=True, file_name=name, gs_uri=name))
+            .inserted_id
+            for name, fields in {
+                "own": {"trial": self.trial, "assay": self.assay},
+                "trial_wide": {"trial": self.other, "assay": self.other},
+                "assay_wide": {"trial": ObjectId(), "assay": self.assay},
+                "hidden": {"trial": ObjectId(), "assay": ObjectId()},
+            }.items()
+        }
+        database["accounts"].insert_many(
+            [
+                {
+                    "email": "reader@cidc.test",
+                    "permissions": [
+                        {"trial": self.trial, "assay": self.assay, "role": "read"},
+                        {"trial": self.other, "assay": ObjectId(), "role": "trial_r"},
+                        {"trial": ObjectId(), "assay": self.assay, "role": "assay_r"},
+                    ],
+                },
+                {"email": "nobody@cidc.test", "permissions": []},
+            ]
+        )
+        self.client = self.api.APP.test_client()
+
+    def get(self, email: str, name: str):
+        """
+        GETs a data document as the given user.
+        """
+
+        with as_user(self.api, email, self.counting), mock.patch.object(
+            self.api.hooks,
+            "SIGNED_URL_CACHE",
+            SimpleNamespace(get=lambda bucket, blob: "https://signed/" + blob),
+        ), mock.patch.object(self.api.hooks, "GOOGLE_URL", "gs://"):
+            self.counting.calls.clear()
+            return self.client.get(
+                "/data/%s" % self.documents[name],
+                headers={"Authorization": "Bearer token"},
+            )
+
+    def test_permitted_documents(self):
+        """
+        Documents of a permitted trial and assay, or of a trial_r trial or assay_r
+        assay, are found, with a single lookup on the collection.
+        """
+        for name in ["own", "trial_wide", "assay_wide"]:
+            response = self.get("reader@cidc.test", name)
+            self.assertEqual(response.status_code, 200, name)
+            self.assertEqual(json.loads(response.get_data())["file_name"], name)
+            data_calls = {
+                call: count
+                for call, count in self.counting.calls.items()
+                if call.startswith("data.")
+            }
+            self.assertEqual(sum(data_calls.values()), 1, data_calls)
+
+    def test_other_documents_are_not_found(self):
+        """
+        Documents outside the user's permissions look missing.
+        """
+        self.assertEqual(self.get("reader@cidc.test", "hidden").status_code, 404)
+        self.assertEqual(self.get("nobody@cidc.test", "own").status_code, 404)
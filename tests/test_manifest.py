@@ -0,0 +1,98 @@
+"""
+Tests for the download manifest streaming in manifest.py
+"""
+import json
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from bson import ObjectId
+
+from manifest import MANIFEST_FIELDS, stream_manifest
+
+
+def records(count: int, consumed: list):
+    """
+    Generates data records, counting how many were read.
+    """
+    trial, assay = ObjectId(), ObjectId()
+    for index in range(count):
+        consumed.append(index)
+        yield {
+            "_id": ObjectId(),
+            "file_name": "file_%s.bam" % index,
+            "data_format": "BAM",
+            "file_size": index,
+            "trial": trial,
+            "assay": assay,
+            "gs_uri": "gs://bucket/file_%s.bam" % index,
+        }
+
+
+class TestStreamManifest(unittest.TestCase):
+    """
+    Tests for stream_manifest.
+    """
+
+    def setUp(self):
+        self.executor = ThreadPoolExecutor(max_workers=4)
+        self.batches = []
+        self.threads = set()
+
+    def tearDown(self):
+        self.executor.shutdown()
+
+    def sign_batch(self, gs_uris):
+        self.batches.append(len(gs_uris))
+        self.threads.add(threading.current_thread().name)
+        return ["https://signed/%s" % gs_uri for gs_uri in gs_uris]
+
+    def test_ndjson_keeps_order(self):
+        """
+        Every record is written once, in cursor order, with its signed link.
+        """
+        lines = "".join(
+            stream_manifest(
+                records(1000, []), self.sign_batch, self.executor, chunk_size=64
+            )
+        ).splitlines()
+        rows = [json.loads(line) for line in lines]
+        self.assertEqual(
+            [row["file_name"] for row in rows],
+            ["file_%s.bam" % index for index in range(1000)],
+        )
+        self.assertEqual(
+            rows[0]["download_link"], "https://signed/gs://bucket/file_0.bam"
+        )
+        self.assertEqual(max(self.batches), 64)
+        self.assertEqual(sum(self.batches), 1000)
+        self.assertNotIn(threading.current_thread().name, self.threads)
+
+    def test_tsv_has_header(self):
+        """
+        TSV manifests start with a header row.
+        """
+        lines = "".join(
+            stream_manifest(
+                records(3, []), self.sign_batch, self.executor, output_format="tsv"
+            )
+        ).splitlines()
+        self.assertEqual(lines[0].split("\t"), MANIFEST_FIELDS)
+        self.assertEqual(len(lines), 4)
+        self.assertEqual(lines[1].split("\t")[1], "file_0.bam")
+
+    def test_reads_ahead_a_bounded_number_of_chunks(self):
+        """
+        The first lines are written before the whole cursor has been read.
+        """
+        consumed = []
+        lines = stream_manifest(
+            records(100000, consumed),
+            self.sign_batch,
+            self.executor,
+            chunk_size=100,
+            max_in_flight=4,
+        )
+        next(lines)
+        self.assertLessEqual(len(consumed), 4 * 100)
+        lines.close()
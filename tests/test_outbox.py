@@ -0,0 +1,245 @@
+"""
+Tests for the task outbox in outbox.py
+"""
+import datetime
+import unittest
+from unittest import mock
+
+import mongomock
+from bson import ObjectId
+from kombu import Connection
+
+from outbox import DISPATCHING, FAILED, PENDING, TaskOutbox
+from task_queue import TaskPublisher
+
+
+class TestTaskOutbox(unittest.TestCase):
+    """
+    Tests for TaskOutbox, with kombu's in-memory transport standing in for RabbitMQ.
+    """
+
+    def setUp(self):
+        self.collection = mongomock.MongoClient().db.task_outbox
+        self.publisher = TaskPublisher("memory://")
+        self.outbox = TaskOutbox(self.publisher, interval=3600, backoff=0)
+        self.outbox._ensure_indexes(self.collection)
+        self.consumer = Connection("memory://")
+        self.queue = self.consumer.SimpleQueue("celery")
+
+    def tearDown(self):
+        self.outbox.stop()
+        self.queue.clear()
+        self.queue.close()
+        self.consumer.release()
+        self.publisher.close()
+
+    def received(self) -> list:
+        """
+        Drains the celery queue.
+        """
+        messages = []
+        while self.queue.qsize():
+            message = self.queue.get(timeout=1)
+            messages.append(message.payload)
+            message.ack()
+        return messages
+
+    def test_enqueue_does_not_publish(self):
+        """
+        Enqueueing only writes to Mongo, the dispatcher publishes the message.
+        """
+        with mock.patch.object(self.outbox, "_ensure_dispatcher"):
+            self.outbox.enqueue(self.collection, "tasks.a", [1], 5)
+        self.assertEqual(self.queue.qsize(), 0)
+        self.assertEqual(self.collection.count_documents({"status": PENDING}), 1)
+
+        self.outbox.collection = self.collection
+        self.assertEqual(self.outbox.dispatch(), 1)
+        self.assertEqual(
+            self.received(),
+            [{"id": 5, "task": "tasks.a", "args": [1], "kwargs": {}, "retries": 0}],
+        )
+        self.assertEqual(self.collection.count_documents({}), 0)
+
+    def test_duplicate_tasks_are_queued_once(self):
+        """
+        The same task with the same arguments waits in the outbox only once.
+        """
+        trial = ObjectId()
+        with mock.patch.object(self.outbox, "_ensure_dispatcher"):
+            self.assertTrue(self.outbox.enqueue(self.collection, "t", [trial], 1))
+            self.assertFalse(self.outbox.enqueue(self.collection, "t", [trial], 1))
+            self.assertTrue(self.outbox.enqueue(self.collection, "t", [ObjectId()], 1))
+        self.outbox.collection = self.collection
+        self.assertEqual(self.outbox.dispatch(), 2)
+        self.assertEqual(self.outbox.stats()["deduplicated"], 1)
+
+    def test_failed_publish_is_retried(self):
+        """
+        A publish failure leaves the task queued with a counted attempt, and the rest
+        of the batch untouched.
+        """
+        with mock.patch.object(self.outbox, "_ensure_dispatcher"):
+            for index in range(3):
+                self.outbox.enqueue(self.collection, "t", [index], 1)
+        self.outbox.collection = self.collection
+        with mock.patch.object(
+            self.publisher, "publish", side_effect=ConnectionError("down")
+        ):
+            self.assertEqual(self.outbox.dispatch(), 0)
+        first = self.collection.find_one({"attempts": 1})
+        self.assertEqual(first["status"], PENDING)
+        self.assertEqual(first["last_error"], "down")
+        self.assertEqual(self.collection.count_documents({"attempts": 0}), 2)
+
+        self.assertEqual(self.outbox.dispatch(), 3)
+        self.assertEqual(len(self.received()), 3)
+        self.assertEqual(self.outbox.stats()["pending"], 0)
+
+    def test_task_fails_after_max_attempts(self):
+        """
+        A task that never publishes is kept as failed.
+        """
+        self.outbox.max_attempts = 2
+        with mock.patch.object(self.outbox, "_ensure_dispatcher"):
+            self.outbox.enqueue(self.collection, "t", [], 1)
+        self.outbox.collection = self.collection
+        with mock.patch.object(self.publisher, "publish", side_effect=ConnectionError):
+            self.outbox.dispatch()
+            self.outbox.dispatch()
+        self.assertEqual(self.collection.find_one()["status"], FAILED)
+        self.assertEqual(self.outbox.stats()["failed_backlog"], 1)
+
+    def test_expired_claims_are_dispatched(self):
+        """
+        Tasks claimed by a worker that died are published once their lease ends.
+        """
+        self.collection.insert_one(
+            {
+                "key": "k",
+                "task": "t",
+                "payload": {"id": 1, "task": "t", "args": [], "kwargs": {}},
+                "status": DISPATCHING,
+                "attempts": 0,
+                "claim": "dead-worker",
+                "created": datetime.datetime.utcnow(),
+                "lease_until": datetime.datetime.utcnow()
+                - datetime.timedelta(seconds=1),
+            }
+        )
+        self.outbox.collection = self.collection
+        self.assertEqual(self.outbox.dispatch(), 1)
+        self.assertEqual(self.received()[0]["task"], "t")
+
+    def test_dispatcher_thread_publishes_enqueued_tasks(self):
+        """
+        The background dispatcher wakes up when a task is enqueued.
+        """
+        self.outbox.enqueue(self.collection, "t", [], 1)
+        message = self.queue.get(timeout=5)
+        self.assertEqual(message.payload["task"], "t")
+        message.ack()
+
+    def test_stats_are_logged_periodically(self):
+        """
+        The dispatch thread logs the stats once log_interval has passed.
+        """
+        self.outbox.log_interval = 60
+        self.outbox.collection = self.collection
+        waits = []
+
+        def wait(timeout):
+            waits.append(timeout)
+            if len(waits) == 2:
+                self.outbox._stopped.set()
+
+        with mock.patch(
+            "outbox.time.monotonic", side_effect=[0, 30, 90, 90]
+        ), mock.patch("outbox.logging.info") as info, mock.patch.object(
+            self.outbox._kick, "wait", wait
+        ):
+            self.outbox._run()
+        self.assertEqual(info.call_count, 1)
+        message = info.call_args[0][0]
+        self.assertEqual(message["category"], "INFO-EVE-METRICS")
+        self.assertEqual(message["message"]["pending"], 0)
+
+    def test_requests_within_window_are_coalesced(self):
+        """
+        Requests made while one waits out its window become a single task carrying
+        the union of their targets.
+        """
+        trial, assay, other = ObjectId(), ObjectId(), ObjectId()
+        self.outbox.send_targets = True
+        with mock.patch.object(self.outbox, "_ensure_dispatcher"), mock.patch(
+            "outbox.logging.info"
+        ) as info:
+            self.assertTrue(
+                self.outbox.coalesce(
+                    self.collection, "w", [{"trial": trial, "assay": assay}], 1, 0
+                )
+            )
+            for _ in range(499):
+                self.assertFalse(
+                    self.outbox.coalesce(
+                        self.collection,
+                        "w",
+                        [
+                            {"trial": trial, "assay": assay},
+                            {"trial": trial, "assay": other},
+                        ],
+                        1,
+                        0,
+                    )
+                )
+        self.outbox.collection = self.collection
+        self.assertEqual(self.outbox.dispatch(), 1)
+        (message,) = self.received()
+        self.assertEqual(
+            message["kwargs"]["targets"],
+            [
+                {"trial": {"$oid": str(trial)}, "assay": {"$oid": str(assay)}},
+                {"trial": {"$oid": str(trial)}, "assay": {"$oid": str(other)}},
+            ],
+        )
+        stats = self.outbox.stats()
+        self.assertEqual(stats["coalesced"], 499)
+        self.assertEqual(stats["triggers"], {"w": {"requests": 500, "coalesced": 499}})
+        self.assertEqual(info.call_count, 5)
+        self.assertEqual(
+            info.call_args[0][0],
+            {
+                "message": {"task": "w", "requests": 500, "coalesced": 499},
+                "category": "INFO-EVE-METRICS",
+            },
+        )
+
+    def test_targets_are_only_sent_when_enabled(self):
+        """
+        By default a coalesced task keeps the arguments of an uncoalesced one.
+        """
+        with mock.patch.object(self.outbox, "_ensure_dispatcher"):
+            self.outbox.coalesce(self.collection, "w", [{"trial": 1}], 1, 0)
+        self.outbox.collection = self.collection
+        self.assertEqual(self.outbox.dispatch(), 1)
+        (message,) = self.received()
+        self.assertEqual((message["args"], message["kwargs"]), ([], {}))
+
+    def test_coalesced_task_waits_for_window(self):
+        """
+        A coalesced task is not sent before its window ends, and requests after it
+        was sent start a new one.
+        """
+        with mock.patch.object(self.outbox, "_ensure_dispatcher"):
+            self.outbox.coalesce(self.collection, "w", [{"trial": 1}], 1, 3600)
+        self.outbox.collection = self.collection
+        self.assertEqual(self.outbox.dispatch(), 0)
+
+        self.collection.update_one(
+            {}, {"$set": {"next_attempt": datetime.datetime(2000, 1, 1)}}
+        )
+        self.assertEqual(self.outbox.dispatch(), 1)
+        with mock.patch.object(self.outbox, "_ensure_dispatcher"):
+            self.assertTrue(
+                self.outbox.coalesce(self.collection, "w", [{"trial": 2}], 1, 3600)
+            )
@@ -0,0 +1,311 @@
+"""
+Tests for the permission compiler and filter cache in permissions.py
+"""
+import itertools
+import random
+import unittest
+from typing import List
+from unittest import mock
+
+import mongomock
+from bson import ObjectId
+from redis import RedisError
+
+from auth_harness import FakeRedis
+from permissions import (
+    MATCH_NOTHING,
+    PermissionFilterCache,
+    compile_permissions,
+    filter_size,
+    may_read,
+)
+
+ROLES = ["read", "write", "trial_r", "trial_w", "assay_r", "assay_w"]
+SEEDS = range(300)
+
+
+def baseline_get_resource(lookup: dict, permissions: List[dict]) -> None:
+    """
+    Copy of hooks.get_resource, the list GET filter compile_permissions replaced.
+    """
+    conditions = []
+    assay_read = []
+    trial_read = []
+
+    for permission in permissions:
+        # If they have a broad role.
+        if permission["role"] == "trial_r":
+            # note the ID.
+            conditions.append({"trial": permission["trial"]})
+        if permission["role"] == "assay_r":
+            assay_read.append(permission["assay"])
+            if "assay" in lookup and lookup["assay"] != permission["assay"]:
+                conditions.append({"assay": permission["assay"]})
+
+    for permission in permissions:
+        if permission["role"] == "read":
+            # Check to see if rule is redundant.
+            if (
+                permission["trial"] not in trial_read
+                and permission["assay"] not in assay_read
+            ):
+                conditions.append(
+                    {"trial": permission["trial"], "assay": permission["assay"]}
+                )
+
+    # Only add the lookup key if there are any conditions to add.
+    if conditions:
+        lookup["$or"] = conditions
+    else:
+        lookup["find"] = "nothing"
+
+
+def branches(condition: dict) -> list:
+    """
+    Returns the $or branches of a compiled condition.
+    """
+    return condition.get("$or", [condition])
+
+
+class TestCompilePermissions(unittest.TestCase):
+    """
+    Tests for compile_permissions.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.trials = [ObjectId() for _ in range(4)] + [None]
+        cls.assays = [ObjectId() for _ in range(4)] + [None]
+        cls.data = mongomock.MongoClient().db["data"]
+        cls.data.insert_many(
+            [
+                {"trial": trial, "assay": assay}
+                for trial, assay in itertools.product(cls.trials, cls.assays)
+            ]
+        )
+        cls.documents = list(cls.data.find())
+
+    def random_permissions(self, rng: random.Random) -> list:
+        return [
+            {
+                "trial": rng.choice(self.trials),
+                "assay": rng.choice(self.assays),
+                "role": rng.choice(ROLES),
+            }
+            for _ in range(rng.randint(0, 12))
+        ]
+
+    def test_equivalent_to_the_access_rule(self):
+        """
+        For random permissions, the compiled query finds exactly the documents
+        may_read allows.
+        """
+        for seed in SEEDS:
+            permissions = self.random_permissions(random.Random(seed))
+            with self.subTest(seed=seed):
+                found = {
+                    document["_id"]
+                    for document in self.data.find(compile_permissions(permissions))
+                }
+                allowed = {
+                    document["_id"]
+                    for document in self.documents
+                    if may_read(document, permissions)
+                }
+                self.assertEqual(found, allowed)
+
+    def test_differences_from_the_baseline_filter(self):
+        """
+        For random permissions and lookups, the compiled query finds what the
+        baseline get_resource found, except where intended:
+
+        - assay_r gives read access to every document of its assay. The baseline
+          skipped assay_r grants without an assay in the lookup, added them in a
+          branch the lookup's own assay contradicted otherwise, and dropped read
+          grants on an assay_r assay.
+
+        Only read grants give access to a (trial, assay) pair, in both.
+        """
+        lookups = [{}] + [{"assay": assay} for assay in self.assays]
+        lookups += [{"trial": trial} for trial in self.trials]
+        for seed in SEEDS:
+            rng = random.Random(seed)
+            permissions = self.random_permissions(rng)
+            lookup = rng.choice(lookups)
+            with self.subTest(seed=seed, lookup=lookup):
+                baseline = dict(lookup)
+                baseline_get_resource(baseline, permissions)
+                before = {document["_id"] for document in self.data.find(baseline)}
+                compiled = {"$and": [lookup, compile_permissions(permissions)]}
+                after = {document["_id"] for document in self.data.find(compiled)}
+                assay_wide = {p["assay"] for p in permissions if p["role"] == "assay_r"}
+                widened = {
+                    document["_id"]
+                    for document in self.documents
+                    if document["assay"] in assay_wide
+                }
+                self.assertEqual(after - widened, before - widened)
+                self.assertLessEqual(before, after)
+
+    def test_write_roles_give_no_read_access(self):
+        """
+        A write grant on a pair does not give read access to it.
+        """
+        trial, assay = self.trials[0], self.assays[0]
+        for role in ["write", "trial_w", "assay_w"]:
+            with self.subTest(role=role):
+                permissions = [{"trial": trial, "assay": assay, "role": role}]
+                self.assertEqual(compile_permissions(permissions), MATCH_NOTHING)
+                self.assertFalse(
+                    may_read({"trial": trial, "assay": assay}, permissions)
+                )
+
+    def test_subsumed_grants_are_dropped(self):
+        """
+        No branch is covered by a trial-wide or assay-wide grant, and no trial or
+        assay value is listed twice.
+        """
+        for seed in SEEDS:
+            permissions = self.random_permissions(random.Random(seed))
+            with self.subTest(seed=seed):
+                wide_trials = {
+                    p["trial"] for p in permissions if p["role"] == "trial_r"
+                }
+                wide_assays = {
+                    p["assay"] for p in permissions if p["role"] == "assay_r"
+                }
+                for branch in branches(compile_permissions(permissions)):
+                    if set(branch) != {"trial", "assay"}:
+                        continue
+                    for field, wide in [("trial", wide_trials), ("assay", wide_assays)]:
+                        values = branch[field]
+                        values = values["$in"] if isinstance(values, dict) else [values]
+                        self.assertEqual(len(values), len(set(values)))
+                        self.assertFalse(wide & set(values))
+
+    def test_grouping(self):
+        """
+        Grants are grouped into $in conditions on the field with fewer values.
+        """
+        trial, other = ObjectId(), ObjectId()
+        assays = [ObjectId() for _ in range(3)]
+        permissions = [
+            {"trial": trial, "assay": assay, "role": "read"} for assay in assays
+        ] + [
+            {"trial": other, "assay": assays[0], "role": "trial_r"},
+            {"trial": other, "assay": assays[1], "role": "read"},
+            {"trial": trial, "assay": assays[0], "role": "read"},
+        ]
+        self.assertEqual(
+            compile_permissions(permissions),
+            {
+                "$or": [
+                    {"trial": other},
+                    {"trial": trial, "assay": {"$in": assays}},
+                ]
+            },
+        )
+        self.assertEqual(compile_permissions([]), MATCH_NOTHING)
+        self.assertIsNot(compile_permissions([]), MATCH_NOTHING)
+
+    def test_hundreds_of_grants_stay_small(self):
+        """
+        Grants of a power user compile to a branch per trial.
+        """
+        trials = [ObjectId() for _ in range(5)]
+        assays = [ObjectId() for _ in range(100)]
+        permissions = [
+            {"trial": trial, "assay": assay, "role": "read"}
+            for trial in trials
+            for assay in assays
+        ]
+        self.assertEqual(len(branches(compile_permissions(permissions))), 5)
+
+
+class TestPermissionFilterCache(unittest.TestCase):
+    """
+    Tests for PermissionFilterCache.
+    """
+
+    def setUp(self):
+        self.redis = FakeRedis()
+        self.permissions = [{"trial": ObjectId(), "assay": ObjectId(), "role": "read"}]
+        self.loads = 0
+
+    def load(self) -> list:
+        """
+        Stands in for reading the account.
+        """
+        self.loads += 1
+        return self.permissions
+
+    def test_compiled_once_per_worker_and_shared(self):
+        """
+        A filter is compiled once, then served locally, and other workers read it
+        from Redis. Every lookup is one Redis round trip.
+        """
+        first, second = PermissionFilterCache(), PermissionFilterCache()
+        expected = compile_permissions(self.permissions)
+        for _ in range(3):
+            self.assertEqual(first.get(self.redis, "a@cidc.test", self.load), expected)
+        self.assertEqual(second.get(self.redis, "a@cidc.test", self.load), expected)
+        self.assertEqual(self.loads, 1)
+        self.assertEqual(self.redis.calls["mget"], 4)
+        self.assertEqual(self.redis.calls["set"], 1)
+        self.assertEqual(
+            [first.stats()["local_hits"], second.stats()["shared_hits"]], [2, 1]
+        )
+
+    def test_invalidate_reaches_every_worker(self):
+        """
+        After an invalidation every worker recompiles from the new permissions.
+        """
+        first, second = PermissionFilterCache(), PermissionFilterCache()
+        first.get(self.redis, "a@cidc.test", self.load)
+        second.get(self.redis, "a@cidc.test", self.load)
+        self.permissions = [{"trial": ObjectId(), "assay": ObjectId(), "role": "read"}]
+        first.invalidate(self.redis, "a@cidc.test")
+        expected = compile_permissions(self.permissions)
+        self.assertEqual(second.get(self.redis, "a@cidc.test", self.load), expected)
+        self.assertEqual(first.get(self.redis, "a@cidc.test", self.load), expected)
+        self.assertEqual(self.loads, 2)
+
+    def test_returned_filters_are_copies(self):
+        """
+        Changing a returned filter does not change the cached one.
+        """
+        cache = PermissionFilterCache()
+        cache.get(self.redis, "a@cidc.test", self.load)["trial"] = "changed"
+        self.assertEqual(
+            cache.get(self.redis, "a@cidc.test", self.load),
+            compile_permissions(self.permissions),
+        )
+
+    def test_redis_outage_compiles_every_time(self):
+        """
+        Without Redis the filter is compiled on every lookup, as nothing could tell
+        the cache it is stale.
+        """
+        cache = PermissionFilterCache()
+        with mock.patch.object(self.redis, "mget", side_effect=RedisError):
+            for _ in range(2):
+                self.assertEqual(
+                    cache.get(self.redis, "a@cidc.test", self.load),
+                    compile_permissions(self.permissions),
+                )
+        self.assertEqual(self.loads, 2)
+
+    def test_metrics(self):
+        """
+        Lookups record latency and filter size, and are logged periodically.
+        """
+        cache = PermissionFilterCache(log_every=2)
+        with mock.patch("permissions.logging.info") as info:
+            cache.get(self.redis, "a@cidc.test", self.load)
+            cache.get(self.redis, "a@cidc.test", self.load)
+        stats = cache.stats()
+        self.assertEqual(stats["lookup_latency"]["count"], 2)
+        self.assertEqual(stats["compile_latency"]["count"], 1)
+        self.assertEqual(stats["size"]["max"], 2)
+        self.assertEqual(info.call_count, 1)
+        self.assertEqual(filter_size(MATCH_NOTHING), 0)
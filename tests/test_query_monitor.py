@@ -0,0 +1,226 @@
+"""
+Tests for the slow query monitor in query_monitor.py
+"""
+import json
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+from bson import ObjectId
+from pymongo.errors import OperationFailure
+
+from permissions import compile_permissions
+from query_monitor import SlowQueryMonitor, plan_summary, query_shape
+
+COLLECTION_SCAN = {
+    "queryPlanner": {"winningPlan": {"stage": "COLLSCAN", "direction": "forward"}}
+}
+INDEXED = {
+    "stages": [
+        {
+            "$cursor": {
+                "queryPlanner": {
+                    "winningPlan": {
+                        "stage": "FETCH",
+                        "inputStage": {
+                            "stage": "OR",
+                            "inputStages": [
+                                {
+                                    "stage": "IXSCAN",
+                                    "indexName": "trial_assay",
+                                    "indexBounds": {"trial": ["[ObjectId('a'), ...]"]},
+                                },
+                                {"stage": "IXSCAN", "indexName": "trial_assay"},
+                            ],
+                        },
+                    }
+                }
+            }
+        }
+    ]
+}
+
+
+class ImmediateExecutor:
+    """
+    Runs submitted calls in the calling thread.
+    """
+
+    def submit(self, function, *args):
+        function(*args)
+
+
+def permissions(count: int) -> list:
+    """
+    Returns count grants on distinct trials and assays.
+    """
+    return [
+        {"trial": ObjectId(), "assay": ObjectId(), "role": "read"} for _ in range(count)
+    ]
+
+
+class TestShapes(unittest.TestCase):
+    """
+    Tests for query_shape and plan_summary.
+    """
+
+    def test_literals_are_stripped(self):
+        """
+        Values are replaced, and field names and operators kept.
+        """
+        email = "reader@cidc.test"
+        shape = query_shape({"started_by": email, "_updated": {"$gte": 5}})
+        self.assertEqual(shape, {"started_by": "?", "_updated": {"$gte": "?"}})
+        self.assertNotIn(email, json.dumps(shape))
+
+    def test_permission_filters_share_a_shape(self):
+        """
+        Permission filters of users with different grants have one shape.
+        """
+        shapes = [
+            query_shape(compile_permissions(permissions(count))) for count in (2, 40)
+        ]
+        self.assertEqual(shapes[0], shapes[1])
+        self.assertEqual(shapes[0], {"$or": [{"trial": "?", "assay": "?"}]})
+
+    def test_plan_summary(self):
+        """
+        Plans are summarized by stage and index, without index bounds.
+        """
+        self.assertEqual(plan_summary(COLLECTION_SCAN), "COLLSCAN")
+        summary = plan_summary(INDEXED)
+        self.assertEqual(
+            summary, "FETCH > OR > [IXSCAN(trial_assay), IXSCAN(trial_assay)]"
+        )
+        self.assertEqual(plan_summary({"ok": 1}), "UNKNOWN")
+
+
+class TestSlowQueryMonitor(unittest.TestCase):
+    """
+    Tests for SlowQueryMonitor.
+    """
+
+    def setUp(self):
+        self.explained = []
+        self.request_id = 0
+
+    def explain(self, database: str, command: dict) -> dict:
+        """
+        Stands in for the explain command.
+        """
+        self.explained.append((database, command))
+        return COLLECTION_SCAN
+
+    def send(self, monitor, command: dict, micros: int, failed: bool = False):
+        """
+        Sends the events of one command to the monitor.
+        """
+        self.request_id += 1
+        name = next(iter(command))
+        event = SimpleNamespace(
+            command_name=name,
+            command=command,
+            database_name="CIDC",
+            connection_id=("localhost", 27017),
+            request_id=self.request_id,
+            duration_micros=micros,
+        )
+        monitor.started(event)
+        (monitor.failed if failed else monitor.succeeded)(event)
+
+    def find(self, trial) -> dict:
+        """
+        Returns a find command as the driver sends it.
+        """
+        return {
+            "find": "data",
+            "filter": {"trial": trial, "visibility": True},
+            "lsid": {"id": "session"},
+            "$db": "CIDC",
+        }
+
+    def monitor(self, **kwargs) -> SlowQueryMonitor:
+        """
+        Returns a monitor explaining in the calling thread.
+        """
+        return SlowQueryMonitor(
+            threshold_ms=100,
+            explain=self.explain,
+            executor=ImmediateExecutor(),
+            **kwargs
+        )
+
+    def test_slow_shapes_are_explained_once(self):
+        """
+        Slow commands are grouped by shape, the shape is explained once without the
+        driver's fields, and fast commands only count towards latency.
+        """
+        monitor = self.monitor()
+        with mock.patch("query_monitor.logging.warning") as warning:
+            self.send(monitor, self.find(ObjectId()), 250000)
+            self.send(monitor, self.find(ObjectId()), 150000)
+            self.send(monitor, self.find(ObjectId()), 5000)
+        self.assertEqual(len(self.explained), 1)
+        self.assertEqual(list(self.explained[0][1]), ["find", "filter"])
+        [entry] = monitor.slow_queries()
+        self.assertEqual(entry["count"], 2)
+        self.assertEqual(entry["max_ms"], 250)
+        self.assertEqual(entry["shape"], {"trial": "?", "visibility": "?"})
+        self.assertEqual(entry["plan"], "COLLSCAN")
+        self.assertTrue(entry["collection_scan"])
+        self.assertEqual(monitor.stats()["latency"][0]["count"], 3)
+        # One log per slow command and one with the plan.
+        self.assertEqual(warning.call_count, 3)
+        for call in warning.call_args_list:
+            self.assertNotIn("ObjectId", str(call))
+
+    def test_shapes_are_explained_again_after_the_interval(self):
+        """
+        A shape is explained again once explain_interval has passed.
+        """
+        monitor = self.monitor(explain_interval=60)
+        with mock.patch("query_monitor.logging.warning"), mock.patch(
+            "query_monitor.time.monotonic", side_effect=[0, 30, 90]
+        ):
+            for _ in range(3):
+                self.send(monitor, self.find(ObjectId()), 200000)
+        self.assertEqual(len(self.explained), 2)
+
+    def test_failed_explains_are_logged(self):
+        """
+        A failed explain leaves the plan unknown.
+        """
+
+        def explain(database, command):
+            raise OperationFailure("not authorized")
+
+        monitor = SlowQueryMonitor(explain=explain, executor=ImmediateExecutor())
+        with mock.patch("query_monitor.logging.warning"), mock.patch(
+            "query_monitor.logging.error"
+        ) as error:
+            self.send(monitor, self.find(ObjectId()), 200000, failed=True)
+        self.assertEqual(error.call_count, 1)
+        self.assertIsNone(monitor.slow_queries()[0]["plan"])
+
+    def test_shapes_are_bounded(self):
+        """
+        Past max_shapes, new shapes are logged but neither kept nor explained.
+        """
+        monitor = self.monitor(max_shapes=1)
+        with mock.patch("query_monitor.logging.warning") as warning:
+            self.send(monitor, self.find(ObjectId()), 200000)
+            self.send(monitor, {"count": "data", "query": {"assay": 1}}, 200000)
+        self.assertEqual(len(monitor.slow_queries()), 1)
+        self.assertEqual(len(self.explained), 1)
+        self.assertEqual(warning.call_count, 3)
+
+    def test_metrics_are_logged_periodically(self):
+        """
+        Latency per command and the slow shapes are logged every log_every commands.
+        """
+        monitor = self.monitor(log_every=2)
+        with mock.patch("query_monitor.logging.info") as info:
+            self.send(monitor, {"insert": "data", "documents": []}, 1000)
+            self.send(monitor, {"insert": "data", "documents": []}, 1000)
+        self.assertEqual(info.call_count, 1)
+        self.assertEqual(info.call_args[0][0]["message"]["commands"], 2)
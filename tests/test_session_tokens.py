@@ -0,0 +1,83 @@
+"""
+Tests for the session tokens in session_tokens.py
+"""
+import unittest
+
+from auth_harness import FakeRedis
+from session_tokens import SessionTokens, account_version, revoke_sessions
+
+
+class TestSessionTokens(unittest.TestCase):
+    """
+    Tests for SessionTokens.
+    """
+
+    def setUp(self):
+        self.redis = FakeRedis()
+        self.sessions = SessionTokens("secret", self.redis)
+
+    def issue(self, email: str, role: str) -> str:
+        """
+        Issues a token under the account's current version.
+        """
+        return self.sessions.issue(email, role, account_version(self.redis, email))
+
+    def test_round_trip(self):
+        """
+        An issued token verifies and carries the user's claims.
+        """
+        token = self.issue("a@b.com", "reader")
+        self.assertTrue(SessionTokens.is_session_token(token))
+        claims = self.sessions.verify(token)
+        self.assertEqual(claims["email"], "a@b.com")
+        self.assertEqual(claims["role"], "reader")
+        self.assertNotIn("perms", claims)
+
+    def test_tampered_and_foreign_tokens_are_rejected(self):
+        """
+        Tokens with a modified body or signed with another secret do not verify.
+        """
+        token = self.issue("a@b.com", "reader")
+        body, signature = token.split(".")[1:]
+        forged = SessionTokens("other", self.redis).issue("a@b.com", "admin", 0)
+        self.assertIsNone(self.sessions.verify(forged))
+        self.assertIsNone(
+            self.sessions.verify("cidc-session.%s.%s" % (body[:-2] + "xx", signature))
+        )
+        self.assertIsNone(self.sessions.verify("cidc-session.garbage"))
+
+    def test_expired_tokens_are_rejected(self):
+        """
+        Tokens stop verifying once their ttl passes.
+        """
+        sessions = SessionTokens("secret", self.redis, ttl=-1)
+        self.assertIsNone(sessions.verify(sessions.issue("a@b.com", "reader", 0)))
+
+    def test_revocation(self):
+        """
+        Bumping an account's version revokes its outstanding tokens only.
+        """
+        token = self.issue("a@b.com", "reader")
+        other = self.issue("c@d.com", "reader")
+        revoke_sessions(self.redis, "a@b.com")
+        self.assertIsNone(self.sessions.verify(token))
+        self.assertIsNotNone(self.sessions.verify(other))
+        fresh = self.issue("a@b.com", "reader")
+        self.assertIsNotNone(self.sessions.verify(fresh))
+
+    def test_roles_read_before_a_revocation_are_not_signed(self):
+        """
+        A role read under the old version does not verify, even when the token is
+        issued after the revocation.
+        """
+        version = account_version(self.redis, "a@b.com")
+        revoke_sessions(self.redis, "a@b.com")
+        self.assertIsNone(
+            self.sessions.verify(self.sessions.issue("a@b.com", "admin", version))
+        )
+
+    def test_no_token_without_a_version(self):
+        """
+        Without the version counter no token is issued.
+        """
+        self.assertIsNone(self.sessions.issue("a@b.com", "reader", None))
@@ -0,0 +1,251 @@
+"""
+Tests for status change events in status_events.py
+"""
+import datetime
+import unittest
+
+from unittest import mock
+
+import mongomock
+from bson import ObjectId
+from pymongo.errors import OperationFailure
+
+from status_events import (
+    CHANGE_STREAM,
+    POLL,
+    ChangeStreamWatcher,
+    PollingWatcher,
+    format_event,
+    open_watcher,
+    prefix_query,
+    stream_events,
+)
+
+
+class FakeChangeStream:
+    """
+    Change stream returning queued changes, then None.
+    """
+
+    def __init__(self, changes):
+        self.changes = list(changes)
+        self.closed = False
+
+    def try_next(self):
+        return self.changes.pop(0) if self.changes else None
+
+    def close(self):
+        self.closed = True
+
+
+class FakeCollection:
+    """
+    Records the arguments of watch.
+    """
+
+    def __init__(self, changes):
+        self.stream = FakeChangeStream(changes)
+        self.watch_args = None
+
+    def watch(self, pipeline, **kwargs):
+        self.watch_args = (pipeline, kwargs)
+        return self.stream
+
+
+class StandaloneCollection:
+    """
+    Collection of a server without a replica set.
+    """
+
+    def watch(self, pipeline, **kwargs):
+        raise OperationFailure(
+            "The $changeStream stage is only supported on replica sets", 40573
+        )
+
+
+class TestOpenWatcher(unittest.TestCase):
+    """
+    Tests for open_watcher.
+    """
+
+    def test_modes(self):
+        """
+        Each mode opens its watcher.
+        """
+        self.assertIsInstance(
+            open_watcher(CHANGE_STREAM, FakeCollection([]), {}, "status"),
+            ChangeStreamWatcher,
+        )
+        self.assertIsInstance(
+            open_watcher(POLL, FakeCollection([]), {}, "status"), PollingWatcher
+        )
+
+    def test_standalone_servers_fall_back_to_polling(self):
+        """
+        Without a replica set, change streams fall back to polling.
+        """
+        with mock.patch("status_events.logging.warning") as warning:
+            watcher = open_watcher(
+                CHANGE_STREAM, StandaloneCollection(), {}, "status", interval=5
+            )
+        self.assertIsInstance(watcher, PollingWatcher)
+        self.assertEqual(watcher.interval, 5)
+        self.assertEqual(warning.call_count, 1)
+
+
+class TestPrefixQuery(unittest.TestCase):
+    """
+    Tests for prefix_query.
+    """
+
+    def test_nested_clauses(self):
+        """
+        Fields are prefixed inside logical operators, values are left alone.
+        """
+        trial = ObjectId()
+        self.assertEqual(
+            prefix_query(
+                {"$or": [{"trial": trial}, {"assay": {"$in": [1]}}], "started_by": "a"},
+                "fullDocument",
+            ),
+            {
+                "$or": [
+                    {"fullDocument.trial": trial},
+                    {"fullDocument.assay": {"$in": [1]}},
+                ],
+                "fullDocument.started_by": "a",
+            },
+        )
+
+
+class TestChangeStreamWatcher(unittest.TestCase):
+    """
+    Tests for ChangeStreamWatcher.
+    """
+
+    def change(self, token, _id, updated_fields, progress):
+        return {
+            "_id": {"_data": token},
+            "operationType": "update",
+            "documentKey": {"_id": _id},
+            "updateDescription": {"updatedFields": updated_fields},
+            "fullDocument": {"status": {"progress": progress}},
+        }
+
+    def test_only_status_changes(self):
+        """
+        Updates of other fields are skipped, and the permission filter is part of the
+        pipeline.
+        """
+        _id = ObjectId()
+        collection = FakeCollection(
+            [
+                self.change("1", _id, {"number_of_files": 3}, "In Progress"),
+                self.change("2", _id, {"status.progress": "Completed"}, "Completed"),
+                self.change("3", _id, {"status": {"progress": "Aborted"}}, "Aborted"),
+            ]
+        )
+        watcher = ChangeStreamWatcher(
+            collection, {"started_by": "a"}, "status.progress", resume_after="0"
+        )
+        events = watcher.poll()
+        self.assertEqual([event["id"] for event in events], ["2", "3"])
+        self.assertEqual(
+            events[0]["data"], {"_id": _id, "status": {"progress": "Completed"}}
+        )
+
+        pipeline, kwargs = collection.watch_args
+        self.assertEqual(pipeline[0]["$match"]["fullDocument.started_by"], "a")
+        self.assertEqual(kwargs["resume_after"], {"_data": "0"})
+        watcher.close()
+        self.assertTrue(collection.stream.closed)
+
+
+class TestPollingWatcher(unittest.TestCase):
+    """
+    Tests for PollingWatcher.
+    """
+
+    def setUp(self):
+        self.analysis = mongomock.MongoClient().db["analysis"]
+        self.trial = ObjectId()
+        self.watcher = PollingWatcher(
+            self.analysis, {"trial": self.trial}, "status", sleep=lambda _: None
+        )
+
+    def update(self, _id, status, trial=None):
+        later = datetime.datetime.utcnow() + datetime.timedelta(seconds=1)
+        self.analysis.update_one(
+            {"_id": _id},
+            {
+                "$set": {
+                    "trial": trial or self.trial,
+                    "status": status,
+                    "_updated": later.replace(microsecond=0),
+                }
+            },
+            upsert=True,
+        )
+
+    def test_transitions_of_visible_documents(self):
+        """
+        Each status change is reported once, for the documents the query matches.
+        """
+        first, second, hidden = ObjectId(), ObjectId(), ObjectId()
+        self.update(first, "In Progress")
+        self.update(hidden, "In Progress", ObjectId())
+        self.assertEqual(
+            [event["data"] for event in self.watcher.poll()],
+            [{"_id": first, "status": "In Progress"}],
+        )
+        self.assertEqual(self.watcher.poll(), [])
+
+        self.update(first, "Completed")
+        self.update(second, "Failed")
+        self.assertEqual(
+            sorted(event["data"]["status"] for event in self.watcher.poll()),
+            ["Completed", "Failed"],
+        )
+
+
+class TestStreamEvents(unittest.TestCase):
+    """
+    Tests for stream_events.
+    """
+
+    def test_heartbeats_and_duration(self):
+        """
+        Quiet periods send keep-alives, and the stream ends after max_duration.
+        """
+        ticks = iter(range(100))
+        _id = ObjectId()
+        polls = iter([[{"id": "7", "data": {"_id": _id, "status": "Completed"}}]])
+
+        class Watcher:
+            closed = False
+
+            def poll(self):
+                return next(polls, [])
+
+            def close(self):
+                Watcher.closed = True
+
+        chunks = list(
+            stream_events(
+                Watcher(),
+                "status",
+                heartbeat=4,
+                max_duration=12,
+                clock=lambda: next(ticks),
+            )
+        )
+        self.assertEqual(chunks[0], "retry: 1000\n\n")
+        self.assertEqual(
+            chunks[1],
+            format_event(
+                "status", {"id": "7", "data": {"_id": _id, "status": "Completed"}}
+            ),
+        )
+        self.assertTrue(chunks[1].startswith("event: status\nid: 7\ndata: {"))
+        self.assertEqual(chunks[2:], [": keep-alive\n\n"] * 2)
+        self.assertTrue(Watcher.closed)
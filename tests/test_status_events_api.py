@@ -0,0 +1,91 @@
+"""
+Tests for the /events/<resource> endpoint in ingestion_api.py
+"""
+import datetime
+import unittest
+from unittest import mock
+
+import mongomock
+import pytest
+from bson import ObjectId
+
+pytest.importorskip("cidc_utils")
+pytest.importorskip("eve_swagger")
+
+# pylint: disable=wrong-import-position
+from auth_harness import as_user, import_app
+
+
+class TestStatusEvents(unittest.TestCase):
+    """
+    Tests for status_events in polling mode.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.api = import_app()
+
+    def setUp(self):
+        self.database = mongomock.MongoClient().db
+        self.trial, self.assay = ObjectId(), ObjectId()
+        self.database["accounts"].insert_one(
+            {
+                "email": "reader@cidc.test",
+                "permissions": [
+                    {"trial": self.trial, "assay": self.assay, "role": "read"}
+                ],
+            }
+        )
+        self.client = self.api.APP.test_client()
+
+    def events(self, url: str) -> str:
+        """
+        Reads the event stream until it ends.
+        """
+        with as_user(self.api, "reader@cidc.test", self.database), mock.patch.multiple(
+            self.api,
+            EVENTS_MODE="poll",
+            EVENTS_POLL_INTERVAL=0.01,
+            EVENTS_MAX_DURATION=0.1,
+        ):
+            response = self.client.get(url, headers={"Authorization": "Bearer token"})
+            self.assertEqual(response.mimetype, "text/event-stream")
+            return response.get_data(as_text=True)
+
+    def test_permitted_analyses_are_pushed(self):
+        """
+        Only analyses the user may read are pushed.
+        """
+        later = datetime.datetime.utcnow().replace(microsecond=0) + datetime.timedelta(
+            seconds=1
+        )
+        visible = self.database["analysis"].insert_one(
+            {
+                "trial": self.trial,
+                "assay": self.assay,
+                "status": "Completed",
+                "_updated": later,
+            }
+        )
+        self.database["analysis"].insert_one(
+            {
+                "trial": ObjectId(),
+                "assay": self.assay,
+                "status": "Failed",
+                "_updated": later,
+            }
+        )
+        body = self.events("/events/status")
+        self.assertIn('"status": "Completed"', body)
+        self.assertIn(str(visible.inserted_id), body)
+        self.assertNotIn("Failed", body)
+
+    def test_other_resources_are_refused(self):
+        """
+        Only resources with a watched status field have events.
+        """
+        with as_user(self.api, "reader@cidc.test", self.database):
+            response = self.client.get(
+                "/events/trials", headers={"Authorization": "Bearer token"}
+            )
+        self.assertEqual(response.status_code, 404)
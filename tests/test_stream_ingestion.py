@@ -0,0 +1,117 @@
+"""
+Tests for the /stream/<resource> endpoint in ingestion_api.py
+"""
+import json
+import unittest
+from unittest import mock
+
+import mongomock
+import pytest
+from bson import ObjectId
+
+pytest.importorskip("cidc_utils")
+pytest.importorskip("eve_swagger")
+
+# pylint: disable=wrong-import-position
+from auth_harness import as_user, import_app
+from trial_locks import TrialLockCache
+
+
+class TestStreamIngestion(unittest.TestCase):
+    """
+    Tests for stream_ingestion.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.api = import_app()
+
+    def setUp(self):
+        self.database = mongomock.MongoClient().db
+        self.trial, self.locked, self.assay = ObjectId(), ObjectId(), ObjectId()
+        self.database["trials"].insert_many(
+            [{"_id": self.trial, "locked": False}, {"_id": self.locked, "locked": True}]
+        )
+        self.database["data"].insert_one(
+            {
+                "trial": self.trial,
+                "assay": self.assay,
+                "file_name": "uploaded.fastq",
+                "visibility": True,
+            }
+        )
+        self.client = self.api.APP.test_client()
+
+    def stream(self, entries: list):
+        """
+        Posts file entries as NDJSON and returns the response lines.
+        """
+
+        body = "\n".join(json.dumps(entry) for entry in entries)
+        with as_user(self.api, "uploader@cidc.test", self.database), mock.patch.object(
+            self.api.hooks, "TRIAL_LOCK_CACHE", TrialLockCache()
+        ):
+            response = self.client.post(
+                "/stream/ingestion",
+                data=body,
+                content_type="application/x-ndjson",
+                headers={"Authorization": "Bearer token"},
+            )
+            return [json.loads(line) for line in response.get_data().splitlines()]
+
+    def entry(self, name: str, trial: ObjectId = None) -> dict:
+        return {
+            "trial": str(trial or self.trial),
+            "assay": str(self.assay),
+            "file_name": name,
+            "uuid_alias": name,
+        }
+
+    def test_valid_entries_are_added_to_the_job(self):
+        """
+        Accepted entries end up in the job, rejected ones are reported by line.
+        """
+        lines = self.stream(
+            [
+                self.entry("a.fastq"),
+                {"file_name": "b.fastq"},
+                self.entry("uploaded.fastq"),
+                self.entry("c.fastq", self.locked),
+                self.entry("d.fastq"),
+            ]
+        )
+        self.assertEqual(sorted(line["_line"] for line in lines[:-1]), [2, 3, 4])
+        summary = lines[-1]
+        self.assertEqual((summary["accepted"], summary["rejected"]), (2, 3))
+
+        job = self.database["ingestion"].find_one({"_id": ObjectId(summary["_id"])})
+        self.assertEqual(job["number_of_files"], 2)
+        files = list(self.database["ingestion_files"].find({"job": job["_id"]}))
+        self.assertEqual(
+            [entry["file_name"] for entry in files], ["a.fastq", "d.fastq"]
+        )
+        self.assertEqual(files[0]["trial"], self.trial)
+        self.assertEqual(files[0]["started_by"], "uploader@cidc.test")
+        self.assertEqual(job["started_by"], "uploader@cidc.test")
+        self.assertIn("start_time", job)
+
+    def test_job_without_files_is_removed(self):
+        """
+        When every entry is rejected, no empty job is left behind.
+        """
+        lines = self.stream([{"file_name": "b.fastq"}, self.entry("uploaded.fastq")])
+        summary = lines[-1]
+        self.assertEqual(summary["_status"], "ERR")
+        self.assertEqual((summary["accepted"], summary["rejected"]), (0, 2))
+        self.assertNotIn("_id", summary)
+        self.assertEqual(self.database["ingestion"].count_documents({}), 0)
+
+    def test_other_resources_are_refused(self):
+        """
+        Only ingestion jobs can be streamed.
+        """
+        with as_user(self.api, "uploader@cidc.test", self.database):
+            response = self.client.post(
+                "/stream/data", headers={"Authorization": "Bearer token"}
+            )
+        self.assertEqual(response.status_code, 404)
@@ -0,0 +1,75 @@
+"""
+Tests for the task payload encodings in task_payloads.py
+"""
+import datetime
+import unittest
+
+from bson import ObjectId
+
+import task_payloads
+from task_payloads import MSGPACK, check_serializer, decode, encode, reference
+
+
+class TestTaskPayloads(unittest.TestCase):
+    """
+    Tests for encode, decode and reference.
+    """
+
+    def setUp(self):
+        self.payload = {
+            "id": 91011,
+            "task": "framework.tasks.processing_tasks.postprocessing",
+            "args": [
+                reference(
+                    "data",
+                    [
+                        {"_id": ObjectId(), "_etag": "a1", "fastq_properties": {}},
+                        {"_id": ObjectId(), "_etag": "b2", "children": []},
+                    ],
+                )
+            ],
+            "kwargs": {},
+            "retries": 0,
+            "created": datetime.datetime(2019, 1, 2, 3, 4, 5, 6000),
+        }
+
+    def test_reference_keeps_only_ids_and_etags(self):
+        """
+        References carry the resource, ids and etags only.
+        """
+        refs = self.payload["args"][0]
+        self.assertEqual(refs["resource"], "data")
+        self.assertEqual([sorted(ref) for ref in refs["refs"]], [["_etag", "_id"]] * 2)
+
+    def test_json_round_trip(self):
+        """
+        JSON payloads keep ObjectIds and datetimes through json_util.
+        """
+        body, content_type, _ = encode(self.payload)
+        decoded = decode(body, content_type)
+        self.assertEqual(decoded["args"], self.payload["args"])
+        self.assertEqual(
+            decoded["created"].replace(tzinfo=None), self.payload["created"]
+        )
+
+    @unittest.skipUnless(task_payloads.msgpack, "msgpack is not installed")
+    def test_msgpack_round_trip(self):
+        """
+        msgpack payloads keep ObjectIds and datetimes through extension types, and
+        are smaller than JSON.
+        """
+        body, content_type, encoding = encode(self.payload, MSGPACK)
+        self.assertEqual((content_type, encoding), ("application/x-msgpack", "binary"))
+        decoded = decode(body, content_type)
+        self.assertEqual(decoded["args"], self.payload["args"])
+        self.assertEqual(
+            decoded["created"].replace(tzinfo=None), self.payload["created"]
+        )
+        self.assertLess(len(body), len(encode(self.payload)[0]))
+
+    def test_unknown_serializer_is_rejected(self):
+        """
+        Misconfigured serializers fail at startup rather than at publish time.
+        """
+        with self.assertRaises(ValueError):
+            check_serializer("pickle")
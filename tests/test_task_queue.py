@@ -0,0 +1,98 @@
+"""
+Tests for the pooled task publisher in task_queue.py
+"""
+import json
+import os
+import unittest
+from unittest import mock
+
+from kombu import Connection
+
+from metrics import LatencyHistogram
+from task_queue import TaskPublisher
+
+
+class TestTaskPublisher(unittest.TestCase):
+    """
+    Tests for TaskPublisher, against kombu's in-memory transport.
+    """
+
+    def setUp(self):
+        self.publisher = TaskPublisher("memory://", pool_limit=2)
+        self.consumer = Connection("memory://")
+        self.queue = self.consumer.SimpleQueue("celery")
+
+    def tearDown(self):
+        self.queue.clear()
+        self.queue.close()
+        self.consumer.release()
+        self.publisher.close()
+
+    def test_publish_delivers_message(self):
+        """
+        Published messages arrive on the celery queue unchanged.
+        """
+        body = json.dumps({"id": 1, "task": "framework.tasks.test", "args": []})
+        self.publisher.publish(body)
+        message = self.queue.get(timeout=1)
+        self.assertEqual(message.payload, json.loads(body))
+        self.assertEqual(message.content_type, "application/json")
+        message.ack()
+
+    def test_connections_are_reused(self):
+        """
+        Many publishes share the pooled connections instead of opening new ones.
+        """
+        pool = self.publisher.producers
+        establish = Connection._establish_connection
+        with mock.patch.object(
+            Connection, "_establish_connection", autospec=True, side_effect=establish
+        ) as connects:
+            for index in range(20):
+                self.publisher.publish(json.dumps({"id": index}))
+        self.assertIs(self.publisher.producers, pool)
+        self.assertEqual(connects.call_count, 1)
+        self.assertEqual(self.publisher.stats()["published"], 20)
+        self.assertEqual(self.publisher.stats()["latency"]["count"], 20)
+        self.assertEqual(self.queue.qsize(), 20)
+
+    def test_pool_recreated_after_fork(self):
+        """
+        A forked worker gets its own pool rather than the parent's sockets.
+        """
+        pool = self.publisher.producers
+        with mock.patch("task_queue.os.getpid", return_value=os.getpid() + 1):
+            self.assertIsNot(self.publisher.producers, pool)
+
+    def test_publish_errors_are_counted(self):
+        """
+        Failed publishes are counted and raised to the caller.
+        """
+        with mock.patch(
+            "kombu.messaging.Producer.publish", side_effect=ConnectionError
+        ):
+            with self.assertRaises(ConnectionError):
+                self.publisher.publish("{}")
+        self.assertEqual(self.publisher.stats()["errors"], 1)
+
+
+class TestLatencyHistogram(unittest.TestCase):
+    """
+    Tests for LatencyHistogram.
+    """
+
+    def test_percentiles_use_bucket_bounds(self):
+        """
+        Percentiles are reported as the upper bound of their bucket.
+        """
+        histogram = LatencyHistogram("test")
+        for _ in range(90):
+            histogram.observe(0.0015)
+        for _ in range(10):
+            histogram.observe(0.2)
+        snapshot = histogram.snapshot()
+        self.assertEqual(snapshot["count"], 100)
+        self.assertEqual(snapshot["p50_ms"], 2)
+        self.assertEqual(snapshot["p95_ms"], 250)
+        self.assertEqual(snapshot["buckets"]["<=2"], 90)
+        self.assertEqual(snapshot["buckets"]["<=250"], 10)
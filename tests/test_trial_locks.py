@@ -0,0 +1,62 @@
+"""
+Tests for the trial lock cache in trial_locks.py
+"""
+import unittest
+
+from bson import ObjectId
+
+from auth_harness import CountingDatabase
+from trial_locks import TrialLockCache
+
+
+class TestTrialLockCache(unittest.TestCase):
+    """
+    Tests for TrialLockCache.
+    """
+
+    def setUp(self):
+        self.database = CountingDatabase()
+        self.trials = self.database["trials"]
+        self.locked, self.open = ObjectId(), ObjectId()
+        self.database.database["trials"].insert_many(
+            [{"_id": self.locked, "locked": True}, {"_id": self.open, "locked": False}]
+        )
+        self.database.calls.clear()
+        self.cache = TrialLockCache(ttl=60)
+
+    def test_one_query_for_distinct_trials(self):
+        """
+        String and ObjectId forms of a trial id are checked once, in one query.
+        """
+        trial_ids = [str(self.locked), self.locked, str(self.open), ObjectId()] * 50
+        self.assertEqual(
+            self.cache.locked_trials(self.trials, trial_ids), {self.locked}
+        )
+        self.assertEqual(self.database.total_calls, 1)
+
+    def test_cached_until_invalidated(self):
+        """
+        Lock state is served from the cache until the trial is invalidated.
+        """
+        self.cache.locked_trials(self.trials, [self.open])
+        self.database.database["trials"].update_one(
+            {"_id": self.open}, {"$set": {"locked": True}}
+        )
+        self.assertEqual(self.cache.locked_trials(self.trials, [self.open]), set())
+        self.assertEqual(self.database.total_calls, 1)
+
+        self.cache.invalidate(str(self.open))
+        self.assertEqual(
+            self.cache.locked_trials(self.trials, [self.open]), {self.open}
+        )
+        self.assertEqual(self.database.total_calls, 2)
+        self.assertEqual(self.cache.stats(), {"size": 1, "hits": 1, "misses": 2})
+
+    def test_entries_expire(self):
+        """
+        Entries older than the TTL are looked up again.
+        """
+        cache = TrialLockCache(ttl=0)
+        cache.locked_trials(self.trials, [self.locked])
+        self.assertEqual(cache.locked_trials(self.trials, [self.locked]), {self.locked})
+        self.assertEqual(self.database.total_calls, 2)
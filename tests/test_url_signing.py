@@ -0,0 +1,198 @@
+"""
+Tests for the URL signer in url_signing.py
+"""
+import binascii
+import datetime
+import hashlib
+import json
+import os
+import tempfile
+import unittest
+import urllib.parse
+from unittest import mock
+
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import padding
+
+from auth_harness import make_key
+from url_signing import SignedUrlCache, UrlSigner
+
+EMAIL = "signer@cidc-test.iam.gserviceaccount.com"
+NOW = datetime.datetime(2019, 2, 3, 4, 5, 6)
+
+
+class TestUrlSigner(unittest.TestCase):
+    """
+    Tests for UrlSigner, with a locally generated key.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.pem = make_key("signer")[0]
+        cls.private_key = serialization.load_pem_private_key(
+            cls.pem, None, default_backend()
+        )
+
+    def setUp(self):
+        self.signer = UrlSigner(private_key=self.private_key, client_email=EMAIL)
+
+    def verify(self, url: str) -> dict:
+        """
+        Rebuilds the string GCS signs for a URL and checks the signature against the
+        public key.
+
+        Returns:
+            dict -- The URL's query parameters.
+        """
+        parsed = urllib.parse.urlsplit(url)
+        query, signature = parsed.query.split("&X-Goog-Signature=")
+        params = dict(urllib.parse.parse_qsl(query))
+        canonical_request = "\n".join(
+            [
+                "GET",
+                parsed.path,
+                query,
+                "host:storage.googleapis.com\n",
+                "host",
+                "UNSIGNED-PAYLOAD",
+            ]
+        )
+        string_to_sign = "\n".join(
+            [
+                "GOOG4-RSA-SHA256",
+                params["X-Goog-Date"],
+                params["X-Goog-Credential"].split("/", 1)[1],
+                hashlib.sha256(canonical_request.encode("utf-8")).hexdigest(),
+            ]
+        )
+        self.private_key.public_key().verify(
+            binascii.unhexlify(signature),
+            string_to_sign.encode("utf-8"),
+            padding.PKCS1v15(),
+            hashes.SHA256(),
+        )
+        return params
+
+    def test_sign(self):
+        """
+        A signed URL carries a valid V4 signature and the expected parameters.
+        """
+        url = self.signer.sign("bucket", "trial 1/file#1.fastq", 1000, now=NOW)
+        self.assertTrue(
+            url.startswith(
+                "https://storage.googleapis.com/bucket/trial%201/file%231.fastq?"
+            )
+        )
+        params = self.verify(url)
+        self.assertEqual(
+            params["X-Goog-Credential"],
+            EMAIL + "/20190203/auto/storage/goog4_request",
+        )
+        self.assertEqual(params["X-Goog-Date"], "20190203T040506Z")
+        self.assertEqual(params["X-Goog-Expires"], "1000")
+
+    def test_sign_many(self):
+        """
+        Batches sign every object, in order.
+        """
+        blobs = ["a/%s.bam" % index for index in range(5)]
+        urls = self.signer.sign_many("bucket", blobs, now=NOW)
+        self.assertEqual(len(urls), 5)
+        for blob, url in zip(blobs, urls):
+            self.assertIn("/bucket/%s?" % blob, url)
+            self.verify(url)
+
+    def test_key_file_is_loaded_once(self):
+        """
+        The key file is read on first use only.
+        """
+        info = {"client_email": EMAIL, "private_key": self.pem.decode("ascii")}
+        with tempfile.NamedTemporaryFile("w", suffix=".json", delete=False) as keyfile:
+            json.dump(info, keyfile)
+        try:
+            signer = UrlSigner(keyfile.name)
+            url = signer.sign("bucket", "a", now=NOW)
+        finally:
+            os.remove(keyfile.name)
+        self.verify(url)
+        self.assertEqual(signer.sign("bucket", "a", now=NOW), url)
+
+    def test_expiry_is_bounded(self):
+        """
+        Lifetimes GCS would reject are refused.
+        """
+        with self.assertRaises(ValueError):
+            self.signer.sign("bucket", "a", 8 * 24 * 3600)
+
+
+class TestSignedUrlCache(unittest.TestCase):
+    """
+    Tests for SignedUrlCache.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.private_key = serialization.load_pem_private_key(
+            make_key("signer")[0], None, default_backend()
+        )
+
+    def setUp(self):
+        self.signer = UrlSigner(private_key=self.private_key, client_email=EMAIL)
+        self.cache = SignedUrlCache(self.signer, lifetime=1000, window=300, maxsize=3)
+        self.start = 1549166700  # 2019-02-03T04:05:00Z, a window boundary.
+
+    def expiry(self, url: str) -> float:
+        """
+        Returns:
+            float -- Unix time the URL expires.
+        """
+        params = dict(urllib.parse.parse_qsl(urllib.parse.urlsplit(url).query))
+        signed_at = datetime.datetime.strptime(params["X-Goog-Date"], "%Y%m%dT%H%M%SZ")
+        return (signed_at - datetime.datetime(1970, 1, 1)).total_seconds() + int(
+            params["X-Goog-Expires"]
+        )
+
+    def test_urls_are_reused_within_window(self):
+        """
+        Requests within a window get the same URL, with at least the lifetime left.
+        """
+        first = self.cache.get("bucket", "a", now=self.start + 1)
+        self.assertEqual(self.cache.get("bucket", "a", now=self.start + 299), first)
+        self.assertEqual(self.cache.stats(), {"size": 1, "hits": 1, "misses": 1})
+        self.assertGreaterEqual(self.expiry(first) - (self.start + 299), 1000)
+
+        second = self.cache.get("bucket", "a", now=self.start + 300)
+        self.assertNotEqual(second, first)
+        self.assertEqual(self.expiry(second) - (self.start + 300), 1300)
+
+    def test_workers_agree_on_urls(self):
+        """
+        A cold cache produces the same URL as a warm one within the window.
+        """
+        url = self.cache.get("bucket", "a", now=self.start + 10)
+        other = SignedUrlCache(self.signer, lifetime=1000, window=300)
+        self.assertEqual(other.get("bucket", "a", now=self.start + 200), url)
+
+    def test_get_many_signs_misses_in_one_batch(self):
+        """
+        Batches return URLs in order and only sign what is not cached.
+        """
+        self.cache.get("bucket", "b", now=self.start)
+        with mock.patch.object(
+            self.signer, "sign_many", wraps=self.signer.sign_many
+        ) as sign_many:
+            urls = self.cache.get_many("bucket", ["a", "b", "c", "a"], now=self.start)
+        self.assertEqual(sign_many.call_args[0][1], ["a", "c"])
+        self.assertEqual(urls[0], urls[3])
+        self.assertEqual(urls[1], self.cache.get("bucket", "b", now=self.start))
+
+    def test_cache_is_bounded(self):
+        """
+        Past windows are dropped first, then least recently used entries.
+        """
+        self.cache.get_many("bucket", ["a", "b"], now=self.start)
+        self.cache.get_many("bucket", ["c", "d"], now=self.start + 300)
+        self.assertEqual(len(self.cache), 2)
+        self.cache.get_many("bucket", ["e", "f"], now=self.start + 300)
+        self.assertEqual(len(self.cache), 3)
@@ -0,0 +1,111 @@
+"""
+Offline benchmark of signed URL generation: the previous path, which signed a V2
+string through oauth2client's sign_blob on every call, against UrlSigner signing one
+URL at a time and in batches.
+"""
+import base64
+import datetime
+import os
+import sys
+import time
+import unittest
+import urllib.parse
+
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import serialization
+from oauth2client.service_account import ServiceAccountCredentials
+
+from auth_harness import make_key, percentile
+from url_signing import UrlSigner
+
+URLS = int(os.environ.get("SIGNING_BENCH_URLS", 100))
+EMAIL = "signer@cidc-test.iam.gserviceaccount.com"
+
+
+def legacy_sign_url(creds, bucket: str, bucket_object: str, expires: int) -> str:
+    """
+    The V2 signing hooks.sign_url did before UrlSigner.
+    """
+    gcs_filename = urllib.parse.quote("/%s/%s" % (bucket, bucket_object))
+    expiration = int(time.time()) + expires
+    signature_string = "\n".join(["GET", "", "", str(expiration), gcs_filename])
+    signature_bytes = creds.sign_blob(signature_string)[1]
+    query_params = {
+        "GoogleAccessId": creds.service_account_email,
+        "Expires": str(expiration),
+        "Signature": base64.b64encode(signature_bytes),
+    }
+    return "https://storage.googleapis.com%s?%s" % (
+        gcs_filename,
+        urllib.parse.urlencode(query_params),
+    )
+
+
+class TestUrlSigningBenchmark(unittest.TestCase):
+    """
+    Latency of each way of signing URLs.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        pem = make_key("signer")[0].decode("ascii")
+        cls.creds = ServiceAccountCredentials.from_json_keyfile_dict(
+            {
+                "type": "service_account",
+                "client_email": EMAIL,
+                "client_id": "1",
+                "private_key": pem,
+                "private_key_id": "signer",
+            }
+        )
+        cls.signer = UrlSigner(
+            private_key=serialization.load_pem_private_key(
+                pem.encode("ascii"), None, default_backend()
+            ),
+            client_email=EMAIL,
+        )
+        cls.blobs = ["trial/assay/file_%s.fastq.gz" % index for index in range(URLS)]
+
+    def time_each(self, sign) -> list:
+        """
+        Returns:
+            list -- Seconds taken to sign each blob.
+        """
+        latencies = []
+        for blob in self.blobs:
+            start = time.perf_counter()
+            sign(blob)
+            latencies.append(time.perf_counter() - start)
+        return latencies
+
+    def test_signing_paths(self):
+        """
+        Reports per URL latency of each path, and checks local signing is faster.
+        """
+        legacy = self.time_each(
+            lambda blob: legacy_sign_url(self.creds, "bucket", blob, 1000)
+        )
+        local = self.time_each(lambda blob: self.signer.sign("bucket", blob, 1000))
+        start = time.perf_counter()
+        batch = self.signer.sign_many(
+            "bucket", self.blobs, 1000, now=datetime.datetime.utcnow()
+        )
+        batch_per_url = (time.perf_counter() - start) / len(self.blobs)
+        self.assertEqual(len(batch), len(self.blobs))
+
+        lines = ["", "url signing (ms per url, %s urls)" % URLS]
+        lines.append("%-18s %8s %8s %8s" % ("path", "p50", "p95", "max"))
+        for name, latencies in [("sign_blob (v2)", legacy), ("UrlSigner.sign", local)]:
+            lines.append(
+                "%-18s %8.3f %8.3f %8.3f"
+                % (
+                    name,
+                    percentile(latencies, 0.5) * 1000,
+                    percentile(latencies, 0.95) * 1000,
+                    max(latencies) * 1000,
+                )
+            )
+        lines.append("%-18s %8.3f" % ("UrlSigner batch", batch_per_url * 1000))
+        sys.stderr.write("\n".join(lines) + "\n")
+
+        self.assertLess(percentile(local, 0.5), percentile(legacy, 0.5))
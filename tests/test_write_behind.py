@@ -0,0 +1,49 @@
+"""
+Tests for the write-behind buffers in write_behind.py
+"""
+import unittest
+
+import mongomock
+
+from write_behind import LastAccessBuffer
+
+
+class TestLastAccessBuffer(unittest.TestCase):
+    """
+    Tests for LastAccessBuffer.
+    """
+
+    def setUp(self):
+        self.collection = mongomock.MongoClient().db.last_access
+        self.buffer = LastAccessBuffer(interval=3600)
+
+    def tearDown(self):
+        self.buffer.stop()
+
+    def test_accesses_are_coalesced_per_user(self):
+        """
+        Repeated accesses by one user become a single upsert of the latest time.
+        """
+        self.buffer.record(self.collection, "a@b.com", "2019-01-01T00:00:01+00:00")
+        self.buffer.record(self.collection, "a@b.com", "2019-01-01T00:00:03+00:00")
+        self.buffer.record(self.collection, "a@b.com", "2019-01-01T00:00:02+00:00")
+        self.buffer.record(self.collection, "c@d.com", "2019-01-01T00:00:01+00:00")
+        self.assertFalse(self.collection.count_documents({}))
+
+        self.assertEqual(self.buffer.flush(), 2)
+        record = self.collection.find_one({"email": "a@b.com"})
+        self.assertEqual(record["last_access"], "2019-01-01T00:00:03+00:00")
+        self.assertEqual(self.buffer.flush(), 0)
+
+    def test_flush_never_moves_access_backwards(self):
+        """
+        A late flush with an older time leaves a newer stored time alone.
+        """
+        self.collection.insert_one(
+            {"email": "a@b.com", "last_access": "2019-01-02T00:00:00+00:00"}
+        )
+        self.buffer.record(self.collection, "a@b.com", "2019-01-01T00:00:00+00:00")
+        self.buffer.flush()
+        record = self.collection.find_one({"email": "a@b.com"})
+        self.assertEqual(record["last_access"], "2019-01-02T00:00:00+00:00")
+        self.assertEqual(self.collection.count_documents({}), 1)
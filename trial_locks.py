@@ -0,0 +1,83 @@
+"""
+Cached lookups of whether trials are locked against uploads.
+"""
+import threading
+import time
+from typing import Dict, Iterable, Set
+
+from bson import ObjectId
+
+
+class TrialLockCache:
+    """
+    Lock state of trials, looked up for many trials with one $in query and kept for
+    `ttl` seconds. Entries are invalidated in the worker that changes a trial, other
+    workers see the change once their entry expires.
+    """
+
+    def __init__(self, ttl: float = 10):
+        """
+        Keyword Arguments:
+            ttl {float} -- Seconds a trial's lock state is cached. (default: {10})
+        """
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: Dict[ObjectId, tuple] = {}
+        self._lock = threading.Lock()
+
+    def locked_trials(self, collection, trial_ids: Iterable) -> Set[ObjectId]:
+        """
+        Finds which of the given trials are locked.
+
+        Arguments:
+            collection {pymongo.collection.Collection} -- The trials collection.
+            trial_ids {Iterable} -- Trial ids, as strings or ObjectIds.
+
+        Returns:
+            Set[ObjectId] -- Ids of the locked trials.
+        """
+        trial_ids = {ObjectId(trial_id) for trial_id in trial_ids}
+        now = time.monotonic()
+        locked, missing = set(), []
+        with self._lock:
+            for trial_id in trial_ids:
+                entry = self._entries.get(trial_id)
+                if entry and entry[0] > now:
+                    if entry[1]:
+                        locked.add(trial_id)
+                else:
+                    missing.append(trial_id)
+            self.hits += len(trial_ids) - len(missing)
+            self.misses += len(missing)
+        if not missing:
+            return locked
+
+        found = {
+            trial["_id"]: bool(trial.get("locked"))
+            for trial in collection.find(
+                {"_id": {"$in": missing}}, projection={"locked": 1}
+            )
+        }
+        with self._lock:
+            for trial_id in missing:
+                self._entries[trial_id] = (now + self.ttl, found.get(trial_id, False))
+        locked.update(trial_id for trial_id, is_locked in found.items() if is_locked)
+        return locked
+
+    def invalidate(self, trial_id) -> None:
+        """
+        Drops a trial's cached lock state.
+
+        Arguments:
+            trial_id {ObjectId} -- Trial id.
+        """
+        with self._lock:
+            self._entries.pop(ObjectId(trial_id), None)
+
+    def stats(self) -> dict:
+        """
+        Returns:
+            dict -- Size of the cache and its hits and misses.
+        """
+        return {"size": len(self._entries), "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,294 @@
+"""
+Local V4 signing of Google Cloud Storage URLs with the service account's private key.
+"""
+import binascii
+import datetime
+import hashlib
+import json
+import threading
+import time
+import urllib.parse
+from collections import OrderedDict
+from typing import List
+
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import padding
+
+GCS_HOST = "storage.googleapis.com"
+ALGORITHM = "GOOG4-RSA-SHA256"
+# Longest lifetime GCS accepts for a V4 signed URL.
+MAX_EXPIRATION = 7 * 24 * 3600
+
+
+def _quote(value: str, safe: str = "~") -> str:
+    return urllib.parse.quote(value, safe=safe)
+
+
+class UrlSigner:
+    """
+    Signs URLs with the RSA key of a service account. The key file is read and the key
+    parsed once, on first use, and every signature after that is computed locally.
+    """
+
+    def __init__(self, keyfile: str = None, private_key=None, client_email: str = None):
+        """
+        Keyword Arguments:
+            keyfile {str} -- Path of the service account's JSON key file.
+                (default: {None})
+            private_key {RSAPrivateKey} -- Parsed key, instead of a key file.
+                (default: {None})
+            client_email {str} -- Service account email, with private_key.
+                (default: {None})
+        """
+        self.keyfile = keyfile
+        self._private_key = private_key
+        self._client_email = client_email
+        self._lock = threading.Lock()
+
+    def _load(self) -> None:
+        """
+        Reads and parses the key file.
+        """
+        with self._lock:
+            if self._private_key is not None:
+                return
+            with open(self.keyfile) as keyfile:
+                info = json.load(keyfile)
+            self._client_email = info["client_email"]
+            self._private_key = serialization.load_pem_private_key(
+                info["private_key"].encode("utf-8"), None, default_backend()
+            )
+
+    @property
+    def client_email(self) -> str:
+        """
+        Returns:
+            str -- Email of the service account the URLs are signed as.
+        """
+        if self._private_key is None:
+            self._load()
+        return self._client_email
+
+    def _signature(self, string_to_sign: str) -> str:
+        if self._private_key is None:
+            self._load()
+        signature = self._private_key.sign(
+            string_to_sign.encode("utf-8"), padding.PKCS1v15(), hashes.SHA256()
+        )
+        return binascii.hexlify(signature).decode("ascii")
+
+    def sign_many(
+        self,
+        bucket: str,
+        blobs: List[str],
+        expires_after_seconds: int = 3600,
+        method: str = "GET",
+        now: datetime.datetime = None,
+    ) -> List[str]:
+        """
+        Signs a URL for each object, sharing the timestamp and credential scope.
+
+        Arguments:
+            bucket {str} -- Bucket the objects are in.
+            blobs {List[str]} -- Object paths inside the bucket.
+
+        Keyword Arguments:
+            expires_after_seconds {int} -- Seconds the URLs are valid for.
+                (default: {3600})
+            method {str} -- HTTP method the URLs allow. (default: {"GET"})
+            now {datetime.datetime} -- Signing time in UTC. (default: {None})
+
+        Raises:
+            ValueError -- If the lifetime is longer than GCS accepts.
+
+        Returns:
+            List[str] -- Signed URLs, in the order of the objects.
+        """
+        if not 0 < expires_after_seconds <= MAX_EXPIRATION:
+            raise ValueError(
+                "Signed URLs expire after 1 to %s seconds" % MAX_EXPIRATION
+            )
+        now = now or datetime.datetime.utcnow()
+        timestamp = now.strftime("%Y%m%dT%H%M%SZ")
+        scope = "%s/auto/storage/goog4_request" % now.strftime("%Y%m%d")
+        query = "&".join(
+            "%s=%s" % (_quote(key), _quote(value))
+            for key, value in sorted(
+                {
+                    "X-Goog-Algorithm": ALGORITHM,
+                    "X-Goog-Credential": "%s/%s" % (self.client_email, scope),
+                    "X-Goog-Date": timestamp,
+                    "X-Goog-Expires": str(expires_after_seconds),
+                    "X-Goog-SignedHeaders": "host",
+                }.items()
+            )
+        )
+
+        urls = []
+        for blob in blobs:
+            path = "/%s/%s" % (bucket, _quote(blob, safe="/~"))
+            canonical_request = "\n".join(
+                [
+                    method,
+                    path,
+                    query,
+                    "host:%s" % GCS_HOST,
+                    "",
+                    "host",
+                    "UNSIGNED-PAYLOAD",
+                ]
+            )
+            string_to_sign = "\n".join(
+                [
+                    ALGORITHM,
+                    timestamp,
+                    scope,
+                    hashlib.sha256(canonical_request.encode("utf-8")).hexdigest(),
+                ]
+            )
+            urls.append(
+                "https://%s%s?%s&X-Goog-Signature=%s"
+                % (GCS_HOST, path, query, self._signature(string_to_sign))
+            )
+        return urls
+
+    def sign(
+        self, bucket: str, blob: str, expires_after_seconds: int = 3600, **kwargs
+    ) -> str:
+        """
+        Signs a URL for one object.
+
+        Arguments:
+            bucket {str} -- Bucket the object is in.
+            blob {str} -- Object path inside the bucket.
+
+        Keyword Arguments:
+            expires_after_seconds {int} -- Seconds the URL is valid for.
+                (default: {3600})
+
+        Returns:
+            str -- The signed URL.
+        """
+        return self.sign_many(bucket, [blob], expires_after_seconds, **kwargs)[0]
+
+
+class SignedUrlCache:
+    """
+    Bounded LRU of signed URLs keyed by bucket and object.
+
+    Time is divided into windows of `window` seconds and every URL requested within a
+    window is signed as of the window's start, valid for `lifetime + window` seconds.
+    Signing is deterministic, so all workers hand out the same URL for an object until
+    the window ends, and a URL handed out always has at least `lifetime` seconds left.
+    Entries of past windows are never returned, and are dropped once the cache fills.
+    """
+
+    def __init__(
+        self,
+        signer: UrlSigner,
+        lifetime: int = 1000,
+        window: int = 300,
+        maxsize: int = 4096,
+    ):
+        """
+        Arguments:
+            signer {UrlSigner} -- Signer for URLs that are not cached.
+
+        Keyword Arguments:
+            lifetime {int} -- Least number of seconds a returned URL is valid for.
+                (default: {1000})
+            window {int} -- Seconds during which an object's URL is reused.
+                (default: {300})
+            maxsize {int} -- Maximum number of cached URLs. (default: {4096})
+        """
+        self.signer = signer
+        self.lifetime = lifetime
+        self.window = window
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get_many(self, bucket: str, blobs: List[str], now: float = None) -> List[str]:
+        """
+        Returns a signed URL for each object, signing the ones not cached as a batch.
+
+        Arguments:
+            bucket {str} -- Bucket the objects are in.
+            blobs {List[str]} -- Object paths inside the bucket.
+
+        Keyword Arguments:
+            now {float} -- Unix time of the request. (default: {None})
+
+        Returns:
+            List[str] -- Signed URLs, in the order of the objects.
+        """
+        now = time.time() if now is None else now
+        window_start = int(now // self.window * self.window)
+        urls = {}
+        with self._lock:
+            for blob in blobs:
+                entry = self._entries.get((bucket, blob))
+                if entry and entry[0] == window_start:
+                    self._entries.move_to_end((bucket, blob))
+                    urls[blob] = entry[1]
+            self.hits += len(urls)
+
+        missing = [blob for blob in dict.fromkeys(blobs) if blob not in urls]
+        if missing:
+            signed = self.signer.sign_many(
+                bucket,
+                missing,
+                self.lifetime + self.window,
+                now=datetime.datetime.utcfromtimestamp(window_start),
+            )
+            with self._lock:
+                self.misses += len(missing)
+                for blob, url in zip(missing, signed):
+                    urls[blob] = url
+                    self._entries[(bucket, blob)] = (window_start, url)
+                    self._entries.move_to_end((bucket, blob))
+                self._evict(window_start)
+        return [urls[blob] for blob in blobs]
+
+    def get(self, bucket: str, blob: str, now: float = None) -> str:
+        """
+        Returns a signed URL for one object.
+
+        Arguments:
+            bucket {str} -- Bucket the object is in.
+            blob {str} -- Object path inside the bucket.
+
+        Keyword Arguments:
+            now {float} -- Unix time of the request. (default: {None})
+
+        Returns:
+            str -- The signed URL.
+        """
+        return self.get_many(bucket, [blob], now=now)[0]
+
+    def _evict(self, window_start: int) -> None:
+        """
+        Drops entries of past windows once the cache is full, then least recently used
+        ones until it fits.
+        """
+        if len(self._entries) <= self.maxsize:
+            return
+        for key in [
+            key for key, entry in self._entries.items() if entry[0] != window_start
+        ]:
+            del self._entries[key]
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        """
+        Returns:
+            dict -- Size of the cache and its hits and misses.
+        """
+        return {"size": len(self._entries), "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,114 @@
+"""
+Write-behind buffering for writes that do not need to happen inside the request.
+"""
+import logging
+import os
+import threading
+from typing import Dict
+
+from pymongo import UpdateOne
+from pymongo.errors import PyMongoError
+
+
+class LastAccessBuffer:
+    """
+    Coalesces users' last access times in memory and writes them to the last_access
+    collection from a background thread as one unordered bulk upsert per interval.
+
+    Timestamps are ISO-8601 UTC strings, so the flush uses $max and a late flush from
+    another worker never moves a user's last access backwards.
+    """
+
+    def __init__(self, interval: float = 30):
+        """
+        Keyword Arguments:
+            interval {float} -- Seconds between flushes. (default: {30})
+        """
+        self.interval = interval
+        self.collection = None
+        self._pending: Dict[str, str] = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._pid = None
+
+    def record(self, collection, email: str, timestamp: str) -> None:
+        """
+        Buffers a user's last access time.
+
+        Arguments:
+            collection {pymongo.collection.Collection} -- The last_access collection.
+            email {str} -- User's email.
+            timestamp {str} -- ISO-8601 UTC time of the access.
+        """
+        self._ensure_flusher()
+        with self._lock:
+            self.collection = collection
+            if timestamp > self._pending.get(email, ""):
+                self._pending[email] = timestamp
+
+    def flush(self) -> int:
+        """
+        Writes the buffered access times.
+
+        Returns:
+            int -- Number of users written.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            collection = self.collection
+        if not pending:
+            return 0
+
+        operations = [
+            UpdateOne(
+                {"email": email}, {"$max": {"last_access": timestamp}}, upsert=True
+            )
+            for email, timestamp in pending.items()
+        ]
+        try:
+            collection.bulk_write(operations, ordered=False)
+        except PyMongoError:
+            logging.error(
+                {
+                    "message": "Failed to flush last access times",
+                    "category": "ERROR-EVE-LOGIN",
+                },
+                exc_info=True,
+            )
+            with self._lock:
+                for email, timestamp in pending.items():
+                    if timestamp > self._pending.get(email, ""):
+                        self._pending[email] = timestamp
+            return 0
+
+        log = "Last login updated for %s users" % len(pending)
+        logging.info({"message": log, "category": "FAIR-EVE-LOGIN"})
+        return len(pending)
+
+    def _ensure_flusher(self) -> None:
+        """
+        Starts the flush thread, again in each forked worker.
+        """
+        if self._pid == os.getpid() and self._thread and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._thread and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def _run(self) -> None:
+        """
+        Flushes the buffer every interval until stopped.
+        """
+        while not self._wake.wait(self.interval):
+            self.flush()
+
+    def stop(self) -> None:
+        """
+        Stops the flush thread and writes what is left in the buffer.
+        """
+        self._wake.set()
+        self.flush()